@@ -0,0 +1,247 @@
+"""
+エージェント共通の基底クラス
+クライアントの共有、応答キャッシュ、同時実行数の制限、再試行とタイムアウト、構造化出力の検証と修正をまとめる
+"""
+
+from typing import Any, Callable, Dict, Optional, TypeVar
+from dataclasses import replace
+import time
+
+from anthropic import Anthropic, AsyncAnthropic
+
+from agents.client_pool import pooled_client, pooled_async_client
+from agents.model_config import ModelConfig
+from agents.prompt_cache import CacheStats
+from agents.response_cache import ResponseCache
+from agents.retry import RetryPolicy, ConcurrencyLimiter, call_with_retry, acall_with_retry, is_retryable
+from agents.streaming import stream_message, astream_message
+from agents.structured_output import StructuredOutputError, decode_output, message_text, tool_choice
+from instrumentation.metrics import CallRecord, record_call
+
+
+T = TypeVar("T")
+
+# 構造化出力の修正に使う安価なモデル
+REPAIR_MODEL = "claude-3-5-haiku-20241022"
+
+REPAIR_SYSTEM_PROMPT = """あなたはJSONの修正係です。
+与えられた出力を、検証エラーが解消するよう最小限の修正でスキーマに合わせ、ツールで提出してください。
+分析内容や数値の意味は変えず、欠けている項目は出力の本文から補ってください。"""
+
+
+class BaseAgent:
+    """LLMを呼び出すエージェントの基底クラス
+
+    サブクラスは name / role / system_prompt / output_tool を設定し、build_request とパース処理を実装する
+    """
+
+    output_tool: Optional[Dict[str, Any]] = None  # 応答の形を指定するツール定義（JSONスキーマ）
+    default_model_config = ModelConfig()  # 分析に使うモデル設定の既定値（サブクラスで役割ごとに指定）
+    default_discussion_config = ModelConfig(max_tokens=1000, temperature=0.2)  # 討議の既定値（モデルは分析と同じ）
+
+    def __init__(self, anthropic_client: Optional[Anthropic] = None,
+                 async_anthropic_client: Optional[AsyncAnthropic] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 limiter: Optional[ConcurrencyLimiter] = None,
+                 model_config: Optional[ModelConfig] = None):
+        self.model_config = model_config or self.default_model_config  # 分析のモデル・最大トークン数・温度
+        self.client = anthropic_client or pooled_client()
+        self._async_client = async_anthropic_client
+        self.cache_stats = CacheStats()  # プロンプトキャッシュの利用状況
+        self.response_cache = response_cache  # 応答のディスクキャッシュ（Noneなら使わない）
+        self.retry_policy = retry_policy or RetryPolicy()  # 再試行とタイムアウト
+        self.limiter = limiter or ConcurrencyLimiter()  # LLM同時呼び出し数の上限（エージェント間で共有可）
+
+    @property
+    def discussion_config(self) -> ModelConfig:
+        """討議のモデル設定（分析と同じモデルで、短く少し高めの温度）"""
+        return replace(self.default_discussion_config, model=self.model_config.model)
+
+    @property
+    def async_client(self) -> AsyncAnthropic:
+        """非同期クライアント（未指定なら実行中のイベントループの共有クライアントを使う）"""
+        return self._async_client or pooled_async_client()
+
+    def _cached_response(self, params: Dict[str, Any]) -> Optional[str]:
+        """ディスクキャッシュ済みの応答テキスト"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(self.role, params)
+
+    def _store_response(self, params: Dict[str, Any], response_text: str) -> None:
+        """パースに成功した応答テキストをディスクキャッシュへ保存"""
+        if self.response_cache is not None:
+            self.response_cache.put(self.role, params, response_text)
+
+    def decode_output(self, response_text: str) -> Dict[str, Any]:
+        """応答テキストから output_tool のスキーマに合うJSONを取り出す（合わなければ StructuredOutputError）"""
+        return decode_output(response_text, self.output_tool["input_schema"])
+
+    def build_repair_request(self, params: Dict[str, Any], error: StructuredOutputError) -> Dict[str, Any]:
+        """検証に失敗した応答を直す呼び出しのパラメータ（レース情報は送らず、応答と検証エラーだけを渡す）"""
+
+        errors = "\n".join(f"- {message}" for message in error.errors)
+        return {
+            "model": REPAIR_MODEL,
+            "max_tokens": params["max_tokens"],
+            "temperature": 0.0,
+            "system": REPAIR_SYSTEM_PROMPT,
+            "tools": [self.output_tool],
+            "tool_choice": tool_choice(self.output_tool),
+            "messages": [
+                {"role": "user", "content": f"検証エラー：\n{errors}\n\n修正する出力：\n{error.response_text}"}
+            ]
+        }
+
+    @staticmethod
+    def _on_retry(record: Optional[CallRecord]) -> Optional[Callable[[Exception], None]]:
+        if record is None:
+            return None
+
+        def count(error: Exception) -> None:
+            record.retries += 1
+        return count
+
+    def _call(self, params: Dict[str, Any], on_text: Optional[Callable[[str], None]] = None,
+              record: Optional[CallRecord] = None) -> Any:
+        """messages.create（on_text があれば messages.stream）を同時実行数の制限・再試行付きで呼び出す
+
+        ストリーミングでテキストを流し始めた後のエラーは、表示が重複しないよう再試行しない
+        """
+
+        streamed = False
+
+        def forward(text: str) -> None:
+            nonlocal streamed
+            streamed = True
+            on_text(text)
+
+        def attempt(timeout: float) -> Any:
+            with self.limiter.limit():
+                if on_text is None:
+                    return self.client.messages.create(**params, timeout=timeout)
+                return stream_message(self.client, params, forward, timeout=timeout)
+
+        return call_with_retry(self.retry_policy, attempt, lambda e: not streamed and is_retryable(e),
+                               self._on_retry(record))
+
+    async def _acall(self, params: Dict[str, Any], on_text: Optional[Callable[[str], None]] = None,
+                     record: Optional[CallRecord] = None) -> Any:
+        """messages.create（on_text があれば messages.stream）を同時実行数の制限・再試行付きで呼び出す（非同期版）"""
+
+        streamed = False
+
+        def forward(text: str) -> None:
+            nonlocal streamed
+            streamed = True
+            on_text(text)
+
+        async def attempt(timeout: float) -> Any:
+            async with self.limiter.alimit():
+                if on_text is None:
+                    return await self.async_client.messages.create(**params, timeout=timeout)
+                return await astream_message(self.async_client, params, forward, timeout=timeout)
+
+        return await acall_with_retry(self.retry_policy, attempt, lambda e: not streamed and is_retryable(e),
+                                      self._on_retry(record))
+
+    @staticmethod
+    def _timed_text(on_text: Optional[Callable[[str], None]], record: CallRecord,
+                    started: float) -> Optional[Callable[[str], None]]:
+        """最初の断片が届いた時刻を記録してから on_text に渡す"""
+
+        if on_text is None:
+            return None
+
+        def forward(text: str) -> None:
+            if record.ttft is None:
+                record.ttft = time.perf_counter() - started
+            on_text(text)
+        return forward
+
+    def _record_response(self, record: CallRecord, response: Any, started: float) -> str:
+        """応答のトークン数と最初のトークンまでの時間を記録して本文を返す"""
+
+        usage = getattr(response, "usage", None)
+        self.cache_stats.record(usage)
+        record.record_usage(usage)
+        if record.ttft is None:
+            record.ttft = time.perf_counter() - started
+        return message_text(response)
+
+    def _complete(self, params: Dict[str, Any], parse: Callable[[str], T],
+                  on_text: Optional[Callable[[str], None]] = None) -> T:
+        """応答キャッシュを確認してLLMを呼び出し、パースに成功した応答をキャッシュする
+
+        パース（スキーマ検証）に失敗した場合は1回だけ修正呼び出しを行う。
+        所要時間・トークン数・再試行回数・パース成否は実行中のノードの計測に記録する
+        （応答が届く前の通信エラーはパース成否を記録しない）
+        """
+
+        record = CallRecord(agent=self.role, model=params.get("model"))
+        started = time.perf_counter()
+        try:
+            cached_text = self._cached_response(params)
+            if cached_text is not None:
+                record.response_cached = True
+                if on_text is not None:
+                    on_text(cached_text)
+                record.parsed = False  # 応答が届いた後の失敗はパース失敗として数える
+                result = parse(cached_text)
+            else:
+                response = self._call(params, self._timed_text(on_text, record, started), record)
+                response_text = self._record_response(record, response, started)
+                record.parsed = False
+                try:
+                    result = parse(response_text)
+                except StructuredOutputError as e:
+                    # 生成し直さず、壊れた部分だけを安価なモデルで直す
+                    record.repaired = True
+                    repaired = self._call(self.build_repair_request(params, e), record=record)
+                    response_text = self._record_response(record, repaired, started)
+                    result = parse(response_text)
+                self._store_response(params, response_text)
+            record.parsed = True
+            return result
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - started
+            record_call(record)
+
+    async def _acomplete(self, params: Dict[str, Any], parse: Callable[[str], T],
+                         on_text: Optional[Callable[[str], None]] = None) -> T:
+        """応答キャッシュを確認してLLMを呼び出し、パースに成功した応答をキャッシュする（非同期版）"""
+
+        record = CallRecord(agent=self.role, model=params.get("model"))
+        started = time.perf_counter()
+        try:
+            cached_text = self._cached_response(params)
+            if cached_text is not None:
+                record.response_cached = True
+                if on_text is not None:
+                    on_text(cached_text)
+                record.parsed = False  # 応答が届いた後の失敗はパース失敗として数える
+                result = parse(cached_text)
+            else:
+                response = await self._acall(params, self._timed_text(on_text, record, started), record)
+                response_text = self._record_response(record, response, started)
+                record.parsed = False
+                try:
+                    result = parse(response_text)
+                except StructuredOutputError as e:
+                    record.repaired = True
+                    repaired = await self._acall(self.build_repair_request(params, e), record=record)
+                    response_text = self._record_response(record, repaired, started)
+                    result = parse(response_text)
+                self._store_response(params, response_text)
+            record.parsed = True
+            return result
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.wall_time = time.perf_counter() - started
+            record_call(record)
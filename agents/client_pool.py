@@ -0,0 +1,63 @@
+"""
+共有HTTPクライアント
+全エージェントで1つのコネクションプールを使い回し、キープアライブでTLSハンドシェイクを省く
+（再試行はエージェント側の RetryPolicy で行うため、SDK自体の再試行は無効にする）
+"""
+
+from typing import Optional
+import asyncio
+import threading
+import weakref
+
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+
+# コネクションプールの設定
+POOL_LIMITS = httpx.Limits(
+    max_connections=64,  # 同時接続数の上限
+    max_keepalive_connections=32,  # 待機させておく接続数
+    keepalive_expiry=60.0,  # 待機中の接続を閉じるまでの秒数
+)
+CONNECT_TIMEOUT = 10.0  # 接続確立のタイムアウト（秒）
+READ_TIMEOUT = 120.0  # 1回の呼び出しのタイムアウトの既定値（秒、呼び出しごとに上書きされる）
+
+_lock = threading.Lock()
+_client: Optional[Anthropic] = None
+# 非同期クライアントはイベントループごと（プールの接続は作成したループに紐づき、asyncio.run のたびにループが変わる）
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncAnthropic]" = weakref.WeakKeyDictionary()
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def pooled_client() -> Anthropic:
+    """プロセスで共有する同期クライアント"""
+
+    global _client
+    with _lock:
+        if _client is None:
+            _client = Anthropic(
+                http_client=DefaultHttpxClient(limits=POOL_LIMITS, timeout=_timeout()),
+                max_retries=0,
+            )
+        return _client
+
+
+def pooled_async_client() -> AsyncAnthropic:
+    """実行中のイベントループで共有する非同期クライアント（イベントループの中で呼ぶ）
+
+    ループが閉じた後の接続を次のループで使い回さないよう、ループごとに別のコネクションプールを作る
+    """
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncAnthropic(
+                http_client=DefaultAsyncHttpxClient(limits=POOL_LIMITS, timeout=_timeout()),
+                max_retries=0,
+            )
+            _async_clients[loop] = client
+        return client
@@ -0,0 +1,173 @@
+"""
+専門家の自己一貫性サンプリング
+1人の専門家に高めの温度で複数回並列に分析させ、推奨馬の得票分布にまとめる
+上位の推奨が統計的に安定した時点で追加の試行を打ち切るため、追加の呼び出しは推奨が割れるレースにだけかかる
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import asyncio
+import contextvars
+import math
+import statistics
+
+from agents.expert_agent import ExpertAgent
+from agents.opinion import ExpertOpinion
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class SamplingConfig:
+    """サンプリングの設定"""
+    initial_samples: int = 2  # 最初に並列で行う試行の数（2回とも同じ推奨なら追加しない）
+    batch_size: int = 2  # 安定していない場合に追加で並列に行う試行の数
+    max_samples: int = 7  # 1人の専門家の試行数の上限
+    temperature: float = 0.7  # 試行の温度（試行ごとに推奨がばらつくよう、通常の分析より高くする）
+    z: float = 1.0  # 上位の推奨とそれ以外の境界の票差が z×√(両馬の票数の合計) 以上なら安定とみなす
+
+    def __post_init__(self):
+        if not 1 <= self.initial_samples <= self.max_samples:
+            raise ValueError("initial_samples は1以上 max_samples 以下で指定してください")
+        if self.batch_size < 1:
+            raise ValueError("batch_size は1以上を指定してください")
+
+
+@dataclass
+class VoteDistribution:
+    """試行ごとの推奨の得票分布"""
+    opinions: List[ExpertOpinion] = field(default_factory=list)  # 成功した試行の意見
+
+    @property
+    def samples(self) -> int:
+        return len(self.opinions)
+
+    def counts(self) -> Dict[int, int]:
+        """馬番ごとの得票数"""
+
+        counts: Dict[int, int] = {}
+        for opinion in self.opinions:
+            for number in dict.fromkeys(opinion.recommended_horses):
+                counts[number] = counts.get(number, 0) + 1
+        return counts
+
+    def ranked(self) -> List[int]:
+        """得票数の多い順の馬番（同数なら確信度の合計、馬番の順）"""
+
+        weights: Dict[int, float] = {}
+        for opinion in self.opinions:
+            for number in dict.fromkeys(opinion.recommended_horses):
+                weights[number] = weights.get(number, 0.0) + opinion.confidence
+        counts = self.counts()
+        return sorted(counts, key=lambda number: (-counts[number], -weights[number], number))
+
+    def pick_size(self) -> int:
+        """まとめた推奨の頭数（試行の推奨頭数の中央値、推奨なしの試行が多ければ0）"""
+        return round(statistics.median(len(opinion.recommended_horses) for opinion in self.opinions))
+
+    def top_picks(self) -> List[int]:
+        return self.ranked()[:self.pick_size()]
+
+    def is_stable(self, z: float) -> bool:
+        """上位の推奨が安定しているか（境界の2頭の票差による符号検定）"""
+
+        ranked = self.ranked()
+        size = self.pick_size()
+        if size == 0 or not ranked:
+            return True
+        counts = self.counts()
+        inside = counts[ranked[size - 1]]
+        outside = counts[ranked[size]] if size < len(ranked) else 0
+        return inside - outside >= z * math.sqrt(inside + outside)
+
+    def to_opinion(self) -> ExpertOpinion:
+        """得票分布を1つの意見にまとめる
+
+        確信度は試行の確信度の平均に、まとめた推奨の得票率の平均を掛ける（試行間で割れるほど下がる）。
+        分析本文と根拠は、まとめた推奨に最も近い試行のものを使う
+        """
+
+        picks = self.top_picks()
+        counts = self.counts()
+        mean_confidence = sum(opinion.confidence for opinion in self.opinions) / self.samples
+        support = sum(counts[number] for number in picks) / (len(picks) * self.samples) if picks else 0.0
+        representative = max(
+            self.opinions,
+            key=lambda opinion: (len(set(opinion.recommended_horses) & set(picks)), opinion.confidence)
+        )
+        return ExpertOpinion(
+            analysis=representative.analysis,
+            recommended_horses=picks,
+            confidence=round(mean_confidence * support, 4),
+            reasoning=representative.reasoning,
+            samples=self.samples,
+            vote_distribution={number: round(count / self.samples, 3) for number, count in counts.items()},
+        )
+
+
+class SelfConsistencySampler:
+    """専門家ごとの並列サンプリングと逐次的な打ち切り"""
+
+    def __init__(self, config: Optional[SamplingConfig] = None):
+        self.config = config or SamplingConfig()
+
+    def _batch_sizes(self):
+        """試行のまとまりごとの数（最初の試行、以降は上限まで batch_size ずつ）"""
+
+        config = self.config
+        issued = config.initial_samples
+        yield issued
+        while issued < config.max_samples:
+            size = min(config.batch_size, config.max_samples - issued)
+            issued += size
+            yield size
+
+    def _finish(self, expert: ExpertAgent, distribution: VoteDistribution) -> ExpertOpinion:
+        if not distribution.opinions:
+            return expert.fallback_opinion(RuntimeError("すべての試行が失敗しました"))
+        return distribution.to_opinion()
+
+    def sample(self, expert: ExpertAgent, race_info: str) -> ExpertOpinion:
+        """上位の推奨が安定するまで試行を並列に重ねて、得票分布をまとめた意見を返す"""
+
+        distribution = VoteDistribution()
+        issued = 0
+        for size in self._batch_sizes():
+            indices = range(issued, issued + size)
+            issued += size
+            # 計測のノードに紐づくよう、スレッドごとに実行中のコンテキストを引き継ぐ
+            with ThreadPoolExecutor(max_workers=size) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, expert.analyze_sample,
+                                    race_info, index, self.config.temperature)
+                    for index in indices
+                ]
+                distribution.opinions.extend(
+                    opinion for opinion in (future.result() for future in futures) if opinion is not None
+                )
+            if distribution.opinions and distribution.is_stable(self.config.z):
+                break
+        return self._finish(expert, distribution)
+
+    async def asample(self, expert: ExpertAgent, race_info: str,
+                      limit: Optional[Callable[[Awaitable[T]], Awaitable[T]]] = None) -> ExpertOpinion:
+        """上位の推奨が安定するまで試行を並列に重ねて、得票分布をまとめた意見を返す（非同期版）
+
+        limit を渡すと各試行をその中で実行する（全体の同時実行数セマフォなど）
+        """
+
+        limit = limit or (lambda coro: coro)
+        distribution = VoteDistribution()
+        issued = 0
+        for size in self._batch_sizes():
+            opinions = await asyncio.gather(*[
+                limit(expert.aanalyze_sample(race_info, index, self.config.temperature))
+                for index in range(issued, issued + size)
+            ])
+            issued += size
+            distribution.opinions.extend(opinion for opinion in opinions if opinion is not None)
+            if distribution.opinions and distribution.is_stable(self.config.z):
+                break
+        return self._finish(expert, distribution)
@@ -0,0 +1,147 @@
+"""
+専門家エージェントの基底クラス
+全専門家で共通の処理（リクエストの組み立て・応答のパース・フォールバック・討議）をまとめ、
+専門家ごとの違いはプロンプトなどのクラス属性だけで指定する
+"""
+
+from typing import Dict, Any, Optional, Callable
+
+from agents.base_agent import BaseAgent
+from agents.opinion import ExpertOpinion, EXPERT_OPINION_TOOL
+from agents.prompt_cache import cached_system, cached_text, text_block
+from agents.structured_output import tool_choice
+
+
+class ExpertAgent(BaseAgent):
+    """専門家エージェントの基底クラス
+
+    サブクラスは name / role / system_prompt / instruction を設定する（応答の形は全専門家共通）
+    """
+
+    name: str = "専門家"
+    role: str = "expert_analysis"  # 応答キャッシュの削除などで使う役割名
+    system_prompt: str = ""
+    instruction: str = "以下のレース情報を分析してください："  # レース情報の前に置く指示
+    error_label: str = "分析"  # フォールバック時のメッセージ（「〇〇エラーが発生しました」）
+    discussion_viewpoint: str = "専門"  # 討議で意見を述べる観点（「〇〇の観点から」）
+    output_tool = EXPERT_OPINION_TOOL  # 応答の形（全専門家共通）
+
+    def build_request(self, race_info: str) -> Dict[str, Any]:
+        """messages.create に渡すパラメータを組み立てる"""
+        return {
+            **self.model_config.request_params(),
+            "system": cached_system(self.system_prompt),
+            "tools": [self.output_tool],
+            "tool_choice": tool_choice(self.output_tool),
+            "messages": [
+                {"role": "user", "content": [
+                    # レース情報ブロックまでをキャッシュし、同じレースへの再呼び出しでプレフィルを省く
+                    cached_text(f"{self.instruction}\n\n{race_info}")
+                ]}
+            ]
+        }
+
+    def parse_opinion(self, response_text: str) -> ExpertOpinion:
+        """応答（ツール入力のJSON、またはJSONを含むテキスト）をパース"""
+        return ExpertOpinion.from_dict(self.decode_output(response_text))
+
+    def fallback_opinion(self, error: Exception) -> ExpertOpinion:
+        """エラー時のフォールバック"""
+        return ExpertOpinion(
+            analysis=f"{self.error_label}エラーが発生しました: {str(error)}",
+            recommended_horses=[],
+            confidence=0.0,
+            reasoning="システムエラーのため分析を完了できませんでした"
+        )
+
+    def analyze_race(self, race_info: str,
+                     on_text: Optional[Callable[[str], None]] = None) -> ExpertOpinion:
+        """レース情報を分析して予想
+
+        on_text を渡すと応答をストリーミングし、届いたテキスト断片ごとに呼び出す
+        """
+
+        try:
+            params = self.build_request(race_info)
+            return self._complete(params, self.parse_opinion, on_text)
+        except Exception as e:
+            return self.fallback_opinion(e)
+
+    async def aanalyze_race(self, race_info: str,
+                            on_text: Optional[Callable[[str], None]] = None) -> ExpertOpinion:
+        """レース情報を分析して予想（非同期版）
+
+        on_text を渡すと応答をストリーミングし、届いたテキスト断片ごとに呼び出す
+        """
+
+        try:
+            params = self.build_request(race_info)
+            return await self._acomplete(params, self.parse_opinion, on_text)
+        except Exception as e:
+            return self.fallback_opinion(e)
+
+    def build_sample_request(self, race_info: str, index: int, temperature: float) -> Dict[str, Any]:
+        """自己一貫性サンプリングの index 番目の試行のリクエスト
+
+        2回目以降の試行は末尾に試行番号を付けて、応答キャッシュで同じ応答が返らないようにする
+        （レース情報ブロックまでは分析と同じため、プロンプトキャッシュは共有する）
+        """
+
+        params = self.build_request(race_info)
+        params["temperature"] = temperature
+        if index > 0:
+            params["messages"][0]["content"].append(text_block(f"（試行{index + 1}：他の試行とは独立に分析してください）"))
+        return params
+
+    def analyze_sample(self, race_info: str, index: int, temperature: float) -> Optional[ExpertOpinion]:
+        """自己一貫性サンプリングの1試行（失敗した試行はNone）"""
+
+        try:
+            return self._complete(self.build_sample_request(race_info, index, temperature), self.parse_opinion)
+        except Exception:
+            return None
+
+    async def aanalyze_sample(self, race_info: str, index: int, temperature: float) -> Optional[ExpertOpinion]:
+        """自己一貫性サンプリングの1試行（非同期版）"""
+
+        try:
+            return await self._acomplete(self.build_sample_request(race_info, index, temperature),
+                                         self.parse_opinion)
+        except Exception:
+            return None
+
+    def build_discussion_request(self, race_info: str, opinion: ExpertOpinion,
+                                 discussion_context: str) -> Dict[str, Any]:
+        """討議で推奨を見直すリクエスト
+
+        システムプロンプト・ツール・レース情報ブロックは分析と同じにして、プロンプトキャッシュを再利用する
+        """
+
+        params = self.build_request(race_info)
+        params.update(self.discussion_config.request_params())
+        params["messages"][0]["content"].append(text_block(f"""あなたの当初の推奨: {list(opinion.recommended_horses)} 確信度{opinion.confidence:.2f}
+根拠: {opinion.reasoning}
+
+{discussion_context}
+
+あなたの推奨は多数派と重なっていません。上記の意見を踏まえて、{self.discussion_viewpoint}の観点から推奨を見直してください。
+同意する点、異なる見解がある点を analysis に明記し、推奨を変える場合も変えない場合も理由を reasoning に示してください。"""))
+        return params
+
+    def reconsider(self, race_info: str, opinion: ExpertOpinion, discussion_context: str) -> ExpertOpinion:
+        """他の専門家の意見を受けて推奨を見直す（討議の1ターン、失敗時は元の意見のまま）"""
+
+        try:
+            return self._complete(self.build_discussion_request(race_info, opinion, discussion_context),
+                                  self.parse_opinion)
+        except Exception:
+            return opinion
+
+    async def areconsider(self, race_info: str, opinion: ExpertOpinion, discussion_context: str) -> ExpertOpinion:
+        """他の専門家の意見を受けて推奨を見直す（非同期版）"""
+
+        try:
+            return await self._acomplete(self.build_discussion_request(race_info, opinion, discussion_context),
+                                         self.parse_opinion)
+        except Exception:
+            return opinion
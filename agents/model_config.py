@@ -0,0 +1,46 @@
+"""
+エージェントごとのモデル設定
+モデル・最大トークン数・温度をエージェントごとに切り替える（安価なモデルで済む役割は下位モデルにする）
+"""
+
+from typing import Any, Dict
+from dataclasses import dataclass, fields
+import json
+
+
+# 既定のモデル
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+
+
+@dataclass(frozen=True)
+class ModelConfig:
+    """LLM呼び出しのモデル設定"""
+    model: str = DEFAULT_MODEL
+    max_tokens: int = 2000
+    temperature: float = 0.1
+
+    def request_params(self) -> Dict[str, Any]:
+        """messages.create に渡すモデル・最大トークン数・温度"""
+        return {"model": self.model, "max_tokens": self.max_tokens, "temperature": self.temperature}
+
+    def merged(self, overrides: Dict[str, Any]) -> "ModelConfig":
+        """指定した項目だけを上書きした設定"""
+
+        unknown = set(overrides) - {f.name for f in fields(self)}
+        if unknown:
+            raise ValueError(f"未対応のモデル設定です: {', '.join(sorted(unknown))}")
+        return ModelConfig(**{**self.request_params(), **overrides})
+
+
+def load_model_configs(path: str) -> Dict[str, Dict[str, Any]]:
+    """エージェントごとのモデル設定をJSONファイルから読み込む
+
+    形式: {"pace_expert": {"model": "...", "max_tokens": 1500, "temperature": 0.1}, "moderator": {...}}
+    （省略した項目はエージェントの既定値のまま）
+    """
+
+    with open(path, "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    if not isinstance(configs, dict) or not all(isinstance(value, dict) for value in configs.values()):
+        raise ValueError(f"{path}: エージェント名 -> 設定 の形式で指定してください")
+    return configs
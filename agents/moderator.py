@@ -1,12 +1,20 @@
 """
 総合判断専門家（モデレーター）
-展開予想専門家と騎手専門家の意見を統合し、最終的な投資判断を行う
+専門家の意見を統合し、最終的な投資判断を行う
 """
 
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Callable, Tuple
 from dataclasses import dataclass
-import json
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
+
+from agents.base_agent import BaseAgent
+from agents.model_config import ModelConfig
+from agents.opinion import ExpertOpinion
+from agents.registry import ExpertSpec, expert_specs
+from agents.prompt_cache import cached_system, cached_text, text_block
+from agents.response_cache import ResponseCache
+from agents.retry import RetryPolicy, ConcurrencyLimiter
+from agents.structured_output import output_tool, tool_choice
 
 
 @dataclass
@@ -15,9 +23,10 @@ class BettingRecommendation:
     horse_number: int  # 馬番号
     win_odds: float  # 単勝オッズ
     expected_value: float  # 期待値
-    bet_amount: int  # ベット額（1000円固定）
+    bet_amount: int  # ベット額
     confidence: float  # 確信度
     edge_score: float = 0.0  # エッジスコア（0.0-1.0）
+    win_probability: Optional[float] = None  # 見積もり勝率
 
 
 @dataclass
@@ -32,140 +41,246 @@ class FinalJudgment:
     risk_assessment: str  # リスク評価
 
 
-class Moderator:
-    """総合判断専門家（モデレーター）"""
+# 推奨の集計表に載せる馬の数と、根拠を引き継ぐ専門家の数（専門家の人数によらずプロンプトの大きさを一定にする）
+AGGREGATE_HORSES = 8
+RATIONALE_EXPERTS = 4
+SUPPORTER_LABELS = 3  # 集計表の「主な推奨者」に載せる専門家の数
+
+# 引き継ぐ根拠の最大文字数（分析本文は引き継がない）
+RATIONALE_CHARS = 150
+
+
+def _ranked_horses(opinions: Dict[str, ExpertOpinion]) -> List[Tuple[int, List[str]]]:
+    """推奨された馬と推奨した専門家（確信度の高い順）を、推奨数・最大確信度の高い順に並べる"""
+
+    supporters: Dict[int, List[str]] = {}
+    for key, opinion in opinions.items():
+        for number in dict.fromkeys(opinion.recommended_horses):
+            supporters.setdefault(number, []).append(key)
+    for keys in supporters.values():
+        keys.sort(key=lambda key: -opinions[key].confidence)
+    return sorted(
+        supporters.items(),
+        key=lambda item: (-len(item[1]), -opinions[item[1][0]].confidence, item[0])
+    )
+
+
+def format_vote_aggregate(opinions: Dict[str, ExpertOpinion], short_labels: Dict[str, str]) -> str:
+    """馬ごとの推奨数・確信度の集計表（推奨数の多い順に上位 AGGREGATE_HORSES 頭）"""
+
+    ranked = _ranked_horses(opinions)
+    lines = ["馬番|推奨数|平均確信度|最大確信度|主な推奨者"]
+    for number, keys in ranked[:AGGREGATE_HORSES]:
+        confidences = [opinions[key].confidence for key in keys]
+        names = ",".join(f"{short_labels.get(key, key)}{opinions[key].confidence:.2f}" for key in keys[:SUPPORTER_LABELS])
+        if len(keys) > SUPPORTER_LABELS:
+            names += f" 他{len(keys) - SUPPORTER_LABELS}人"
+        lines.append(f"{number}|{len(keys)}|{sum(confidences) / len(confidences):.2f}|{max(confidences):.2f}|{names}")
+    if len(ranked) > AGGREGATE_HORSES:
+        lines.append(f"（ほか{len(ranked) - AGGREGATE_HORSES}頭に推奨あり）")
+    abstained = sum(not opinion.recommended_horses for opinion in opinions.values())
+    if abstained:
+        lines.append(f"（推奨なしの専門家: {abstained}人）")
+    return "\n".join(lines)
+
+
+def format_rationales(opinions: Dict[str, ExpertOpinion], labels: Dict[str, str]) -> str:
+    """集計表の上位の馬を最も強く推した専門家から順に、最大 RATIONALE_EXPERTS 人の推奨と短い根拠"""
+
+    selected: List[str] = []
+    for _, keys in _ranked_horses(opinions):
+        key = next((key for key in keys if key not in selected), None)
+        if key is not None:
+            selected.append(key)
+        if len(selected) >= RATIONALE_EXPERTS:
+            break
+
+    lines = []
+    for key in selected:
+        opinion = opinions[key]
+        rationale = opinion.reasoning.replace("\n", " ")
+        if len(rationale) > RATIONALE_CHARS:
+            rationale = rationale[:RATIONALE_CHARS] + "…"
+        lines.append(f"{labels.get(key, key)}: 推奨{list(opinion.recommended_horses)} "
+                     f"確信度{opinion.confidence:.2f} 根拠: {rationale}")
+    return "\n".join(lines) or "（推奨した専門家なし）"
+
+
+def final_judgment_tool(expert_keys: List[str]) -> Dict[str, Any]:
+    """総合判断の応答のツール定義（信頼度スコアは専門家キーごと）"""
+
+    # 期待値・賭け金はシステム側で計算するため含めない
+    schema = {
+        "type": "object",
+        "properties": {
+            "consensus_analysis": {"type": "string", "description": "専門家コンセンサスの要約（改行なし）"},
+            "minority_opinions": {"type": "string", "description": "マイノリティ意見とそのエッジ評価（改行なし）"},
+            "expert_reliability": {
+                "type": "object",
+                "properties": {key: {"type": "number", "minimum": 0.0, "maximum": 1.0} for key in expert_keys},
+                "required": list(expert_keys),
+                "description": "各専門家の信頼度スコア（0.0-1.0）"
+            },
+            "summary": {"type": "string", "description": "総合的な分析結果（改行なし）"},
+            "reasoning": {"type": "string", "description": "投資判断の根拠（改行なし）"},
+            "risk_assessment": {"type": "string", "description": "リスク評価（改行なし）"}
+        },
+        "required": ["consensus_analysis", "minority_opinions", "expert_reliability", "summary", "reasoning", "risk_assessment"]
+    }
+    return output_tool("submit_judgment", "総合判断の結果を提出する", schema)
+
+
+class Moderator(BaseAgent):
+    """総合判断専門家（モデレーター）
+    
+    専門家の構成は experts（登録内容の並び、Noneなら既定の専門家）で指定する
+    """
+    
+    default_model_config = ModelConfig(max_tokens=3000)
     
-    def __init__(self, anthropic_client: Optional[Anthropic] = None):
+    def __init__(self, anthropic_client: Optional[Anthropic] = None,
+                 async_anthropic_client: Optional[AsyncAnthropic] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 limiter: Optional[ConcurrencyLimiter] = None,
+                 model_config: Optional[ModelConfig] = None,
+                 experts: Optional[List[ExpertSpec]] = None):
+        super().__init__(anthropic_client, async_anthropic_client, response_cache, retry_policy, limiter,
+                         model_config)
         self.name = "総合判断専門家"
         self.role = "final_judge"
-        self.client = anthropic_client or Anthropic()
         
-        self.system_prompt = """あなたは競馬投資の総合判断専門家です。
-展開予想専門家、騎手専門家、穴狙い専門家の3人の意見を統合し、期待値に基づく投資判断を行います。
+        experts = experts or expert_specs()
+        self.expert_keys = [spec.key for spec in experts]
+        self.labels = {spec.key: spec.label for spec in experts}
+        self.short_labels = {spec.key: spec.short_label for spec in experts}
+        self.output_tool = final_judgment_tool(self.expert_keys)  # 応答の形
+        
+        expert_names = "、".join(spec.label for spec in experts)
+        reliability_lines = ",\n".join(f'        "{key}": 信頼度スコア' for key in self.expert_keys)
+        self.system_prompt = f"""あなたは競馬投資の総合判断専門家です。
+{expert_names}の{len(experts)}人の意見を統合し、期待値に基づく投資判断を行います。
 
 **重要な役割：専門家コンセンサスとマイノリティ意見の分析**
-1. 3人の専門家の意見から「コンセンサス（多数派意見）」を抽出
+1. 専門家の意見から「コンセンサス（多数派意見）」を抽出
 2. 「マイノリティ意見（逸脱意見）」を特定し、そのエッジを評価
 3. 各専門家の意見の信頼度スコアを推定（0.0-1.0）
 4. オッズとのギャップから投資機会を発見
 
 判断基準：
-- 期待値1.0超えの馬をすべて推奨対象とする
-- 1bet = 1000円で統一
 - 単勝のみで勝負
 - コンセンサス意見とマイノリティ意見のバランスを考慮
 - 「エッジの効いた意見」を特に重視
 
 **分析の観点：**
-- 3人全員が推す馬：高い信頼度だがオッズは低い可能性
-- 2人が推す馬：バランス型の投資対象
+- 多くの専門家が推す馬：高い信頼度だがオッズは低い可能性
+- 複数の専門家が推す馬：バランス型の投資対象
 - 1人だけが強く推す馬：エッジが効いており高配当の可能性
 - 誰も推さないがオッズが高い馬：見落とし馬の可能性も検討
 
-期待値計算：
-期待値 = (勝率 × オッズ × 信頼度加重) / 1.0
+**期待値と賭け金について：**
+勝率・期待値・賭け金は、あなたが推定した各専門家の信頼度スコアと専門家の推奨馬・確信度、現在のオッズからシステムが計算します。
+そのため、各専門家の根拠がこのレースでどれだけ当てになるかを慎重に見極め、信頼度スコアに反映してください。
 
-必ず以下のJSON形式で回答してください（文字列内では改行を使わず、一行で記述してください）：
-{
+必ず submit_judgment ツールで、以下の形式で回答してください（文字列内では改行を使わず、一行で記述してください）：
+{{
     "consensus_analysis": "専門家コンセンサスの要約（改行なし）",
     "minority_opinions": "マイノリティ意見とそのエッジ評価（改行なし）",
-    "expert_reliability": {
-        "pace_expert": 信頼度スコア,
-        "jockey_expert": 信頼度スコア,
-        "contrarian_expert": 信頼度スコア
-    },
+    "expert_reliability": {{
+{reliability_lines}
+    }},
     "summary": "総合的な分析結果（改行なし）",
-    "recommendations": [
-        {
-            "horse_number": 馬番号,
-            "win_odds": 単勝オッズ,
-            "expected_value": 期待値,
-            "bet_amount": 1000,
-            "confidence": 確信度,
-            "edge_score": エッジスコア（0.0-1.0）
-        }
-    ],
     "reasoning": "投資判断の根拠（改行なし）",
     "risk_assessment": "リスク評価（改行なし）"
-}
+}}
 
-市場が見落としている投資機会を発見し、期待値の高い馬を推奨してください。"""
+市場が見落としている投資機会を発見し、信頼できる専門家の意見を見極めてください。"""
     
-    def make_final_judgment(self, race_info: str, pace_expert_opinion: str, 
-                          jockey_expert_opinion: str, contrarian_expert_opinion: str) -> FinalJudgment:
-        """最終判断を下す"""
+    def build_request(self, race_info: str, opinions: Dict[str, ExpertOpinion]) -> Dict[str, Any]:
+        """messages.create に渡すパラメータを組み立てる
         
-        prompt = f"""以下の情報を基に、最終的な投資判断を行ってください。
-
-レース情報：
-{race_info}
-
-展開予想専門家の意見：
-{pace_expert_opinion}
+        専門家の意見は分析本文を渡さず、馬ごとの推奨の集計表と上位の馬を推した専門家の短い根拠にまとめる
+        （どちらも上限があるため、専門家の人数が増えてもプロンプトの大きさはほぼ一定）
+        """
+        
+        # レース情報（オッズ表）はオッズ更新がない限り同じレースで共通のため、キャッシュブロックに分ける
+        race_block = f"""以下の情報を基に、最終的な投資判断を行ってください。
 
-騎手専門家の意見：
-{jockey_expert_opinion}
+レース情報（オッズ表）：
+{race_info}"""
+        
+        opinions_block = f"""専門家{len(opinions)}人の推奨の集計（推奨数の多い順、確信度は推奨した専門家のもの）：
+{format_vote_aggregate(opinions, self.short_labels)}
 
-穴狙い専門家の意見：
-{contrarian_expert_opinion}
+上位の馬を推した専門家の推奨と根拠：
+{format_rationales(opinions, self.labels)}
 
-3人の専門家の意見を分析し、コンセンサスとマイノリティ意見を特定してください。
+専門家の意見を分析し、コンセンサスとマイノリティ意見を特定してください。
 特に「エッジの効いた意見」に注目し、市場が見落としている投資機会を発見してください。
-期待値1.0を超える馬があれば、すべて推奨してください。"""
+各専門家の信頼度スコアを推定してください。"""
+        
+        return {
+            **self.model_config.request_params(),
+            "system": cached_system(self.system_prompt),
+            "tools": [self.output_tool],
+            "tool_choice": tool_choice(self.output_tool),
+            "messages": [
+                {"role": "user", "content": [
+                    cached_text(race_block),
+                    text_block(opinions_block)
+                ]}
+            ]
+        }
+    
+    def parse_judgment(self, response_text: str) -> FinalJudgment:
+        """応答（ツール入力のJSON、またはJSONを含むテキスト）をパース"""
+        
+        result = self.decode_output(response_text)
+        
+        return FinalJudgment(
+            consensus_analysis=result["consensus_analysis"],
+            minority_opinions=result["minority_opinions"],
+            expert_reliability=result["expert_reliability"],
+            summary=result["summary"],
+            recommendations=[],  # 期待値・賭け金は応答に含めず、PricingEngine で計算して設定する
+            reasoning=result["reasoning"],
+            risk_assessment=result["risk_assessment"]
+        )
+    
+    def fallback_judgment(self, error: Exception) -> FinalJudgment:
+        """エラー時のフォールバック"""
+        return FinalJudgment(
+            consensus_analysis="エラーのため分析不可",
+            minority_opinions="エラーのため分析不可",
+            expert_reliability={key: 0.0 for key in self.expert_keys},
+            summary=f"最終判断エラーが発生しました: {str(error)}",
+            recommendations=[],
+            reasoning="システムエラーのため判断を完了できませんでした",
+            risk_assessment="エラーのためリスク評価不可"
+        )
+    
+    def make_final_judgment(self, race_info: str, opinions: Dict[str, ExpertOpinion],
+                            on_text: Optional[Callable[[str], None]] = None) -> FinalJudgment:
+        """最終判断を下す
+        
+        on_text を渡すと応答をストリーミングし、届いたテキスト断片ごとに呼び出す
+        """
+        
+        try:
+            params = self.build_request(race_info, opinions)
+            return self._complete(params, self.parse_judgment, on_text)
+        except Exception as e:
+            return self.fallback_judgment(e)
+    
+    async def amake_final_judgment(self, race_info: str, opinions: Dict[str, ExpertOpinion],
+                                   on_text: Optional[Callable[[str], None]] = None) -> FinalJudgment:
+        """最終判断を下す（非同期版）
+        
+        on_text を渡すと応答をストリーミングし、届いたテキスト断片ごとに呼び出す
+        """
         
         try:
-            response = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=3000,
-                temperature=0.1,
-                system=self.system_prompt,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # JSONレスポンスをパース
-            response_text = response.content[0].text
-            
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                json_text = response_text[json_start:json_end].strip()
-            else:
-                json_text = response_text.strip()
-            
-            result = json.loads(json_text)
-            
-            # BettingRecommendationオブジェクトに変換
-            recommendations = []
-            for rec in result["recommendations"]:
-                recommendations.append(BettingRecommendation(
-                    horse_number=rec["horse_number"],
-                    win_odds=rec["win_odds"],
-                    expected_value=rec["expected_value"],
-                    bet_amount=rec["bet_amount"],
-                    confidence=rec["confidence"],
-                    edge_score=rec.get("edge_score", 0.0)
-                ))
-            
-            return FinalJudgment(
-                consensus_analysis=result["consensus_analysis"],
-                minority_opinions=result["minority_opinions"],
-                expert_reliability=result["expert_reliability"],
-                summary=result["summary"],
-                recommendations=recommendations,
-                reasoning=result["reasoning"],
-                risk_assessment=result["risk_assessment"]
-            )
-            
+            params = self.build_request(race_info, opinions)
+            return await self._acomplete(params, self.parse_judgment, on_text)
         except Exception as e:
-            # エラー時のフォールバック
-            return FinalJudgment(
-                consensus_analysis="エラーのため分析不可",
-                minority_opinions="エラーのため分析不可",
-                expert_reliability={"pace_expert": 0.0, "jockey_expert": 0.0, "contrarian_expert": 0.0},
-                summary=f"最終判断エラーが発生しました: {str(e)}",
-                recommendations=[],
-                reasoning="システムエラーのため判断を完了できませんでした",
-                risk_assessment="エラーのためリスク評価不可"
-            )
+            return self.fallback_judgment(e)
@@ -0,0 +1,60 @@
+"""
+専門家の意見
+全専門家で共通の出力形式（データクラスと応答のJSONスキーマ）
+"""
+
+from typing import Any, Dict, List
+from dataclasses import dataclass, field
+
+from agents.structured_output import output_tool
+
+
+@dataclass
+class ExpertOpinion:
+    """専門家の意見"""
+    analysis: str  # 分析内容
+    recommended_horses: List[int]  # 推奨馬番号
+    confidence: float  # 確信度
+    reasoning: str  # 根拠
+    samples: int = 1  # まとめた試行の数（自己一貫性サンプリングをしない場合は1）
+    vote_distribution: Dict[int, float] = field(default_factory=dict)  # 馬番 -> 試行での得票率（サンプリング時のみ）
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ExpertOpinion":
+        return cls(
+            analysis=data["analysis"],
+            recommended_horses=data["recommended_horses"],
+            confidence=data["confidence"],
+            reasoning=data["reasoning"]
+        )
+
+    @classmethod
+    def from_vote(cls, vote: Dict[str, Any]) -> "ExpertOpinion":
+        """予想結果の expert_votes（推奨・確信度・根拠）から復元（分析本文は空）"""
+        return cls(
+            analysis="",
+            recommended_horses=vote["recommended_horses"],
+            confidence=vote["confidence"],
+            reasoning=vote.get("reasoning", ""),
+            samples=vote.get("samples", 1),
+            vote_distribution={int(number): share for number, share in vote.get("vote_distribution", {}).items()}
+        )
+
+
+# 専門家の応答のJSONスキーマ
+EXPERT_OPINION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analysis": {"type": "string", "description": "分析内容（改行なし）"},
+        "recommended_horses": {
+            "type": "array",
+            "items": {"type": "integer"},
+            "description": "推奨する馬番号のリスト（最大3頭）"
+        },
+        "confidence": {"type": "number", "minimum": 0.0, "maximum": 1.0, "description": "確信度"},
+        "reasoning": {"type": "string", "description": "推奨理由と根拠（改行なし）"}
+    },
+    "required": ["analysis", "recommended_horses", "confidence", "reasoning"]
+}
+
+EXPERT_OPINION_TOOL = output_tool("submit_opinion", "専門家としての分析結果を提出する", EXPERT_OPINION_SCHEMA)
@@ -0,0 +1,66 @@
+"""
+Anthropicのプロンプトキャッシュ
+静的なシステムプロンプトとレース情報ブロックにキャッシュブレークポイントを付け、
+response.usage からキャッシュのヒット／ミスのトークン数を集計する
+"""
+
+from typing import Any, Dict, List
+from dataclasses import dataclass, field
+import threading
+
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def cached_system(system_prompt: str) -> List[Dict[str, Any]]:
+    """キャッシュブレークポイント付きのシステムプロンプト"""
+    return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+
+def cached_text(text: str) -> Dict[str, Any]:
+    """キャッシュブレークポイント付きのテキストブロック（システムプロンプトからここまでがキャッシュされる）"""
+    return {"type": "text", "text": text, "cache_control": CACHE_CONTROL}
+
+
+def text_block(text: str) -> Dict[str, Any]:
+    """キャッシュしないテキストブロック"""
+    return {"type": "text", "text": text}
+
+
+@dataclass
+class CacheStats:
+    """プロンプトキャッシュの利用状況（並列実行中も安全に加算できる）"""
+    requests: int = 0  # リクエスト数
+    input_tokens: int = 0  # キャッシュ対象外の入力トークン
+    cache_creation_input_tokens: int = 0  # キャッシュ書き込み（ミス）
+    cache_read_input_tokens: int = 0  # キャッシュ読み込み（ヒット）
+    output_tokens: int = 0  # 出力トークン
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, usage: Any) -> None:
+        """response.usage を加算"""
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += getattr(usage, "input_tokens", 0) or 0
+            self.cache_creation_input_tokens += getattr(usage, "cache_creation_input_tokens", 0) or 0
+            self.cache_read_input_tokens += getattr(usage, "cache_read_input_tokens", 0) or 0
+            self.output_tokens += getattr(usage, "output_tokens", 0) or 0
+
+    @property
+    def hit_rate(self) -> float:
+        """入力トークンのうちキャッシュから読み込まれた割合"""
+        total = self.input_tokens + self.cache_creation_input_tokens + self.cache_read_input_tokens
+        return self.cache_read_input_tokens / total if total else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "input_tokens": self.input_tokens,
+                "cache_creation_input_tokens": self.cache_creation_input_tokens,
+                "cache_read_input_tokens": self.cache_read_input_tokens,
+                "output_tokens": self.output_tokens,
+                "cache_hit_rate": round(self.hit_rate, 3),
+            }
@@ -0,0 +1,89 @@
+"""
+専門家の登録
+予想に使う専門家（エージェントのクラス・表示名・出馬表のビュー）を専門家キーで登録し、
+グラフとモデレーターは登録内容から組み立てる（専門家を追加しても状態・ノード・モデレーターの変更は不要）
+"""
+
+from typing import Dict, Iterable, List, Optional, Type
+from dataclasses import dataclass
+import importlib
+
+from agents.expert_agent import ExpertAgent
+from agents.race_expert import RaceExpert
+from agents.jockey_expert import JockeyExpert
+from agents.contrarian_expert import ContrarianExpert
+from racecard.views import RaceView
+
+
+@dataclass(frozen=True)
+class ExpertSpec:
+    """登録する専門家"""
+    key: str  # 専門家キー（状態・結果・信頼度スコアのキー）
+    agent_class: Type[ExpertAgent]  # エージェントのクラス
+    label: str  # 表示名
+    short_label: str  # 推奨の集計表で使う短い名前
+    view: Optional[RaceView] = None  # 渡す出馬表のビュー（Noneなら racecard.views の同じキーのビュー、なければ全列）
+
+    @property
+    def node(self) -> str:
+        """グラフのノード名（計測レポートのノード名にもなる）"""
+        return f"{self.key[:-len('_expert')] if self.key.endswith('_expert') else self.key}_analysis"
+
+
+# 既定で使う専門家（結果の並び順）
+DEFAULT_EXPERTS = ["pace_expert", "jockey_expert", "contrarian_expert"]
+
+_REGISTRY: Dict[str, ExpertSpec] = {}
+
+
+def register_expert(spec: ExpertSpec, replace: bool = False) -> ExpertSpec:
+    """専門家を登録（同じキーの登録があれば replace=True のときだけ置き換える）"""
+
+    if spec.key == "moderator":
+        raise ValueError("moderator は専門家キーに使えません")
+    if spec.key in _REGISTRY and not replace:
+        raise ValueError(f"登録済みの専門家です: {spec.key}")
+    _REGISTRY[spec.key] = spec
+    return spec
+
+
+def expert_spec(key: str) -> ExpertSpec:
+    """専門家キーに対応する登録内容"""
+
+    if key not in _REGISTRY:
+        raise ValueError(f"未知の専門家です: {key}（登録済み: {', '.join(_REGISTRY)}）")
+    return _REGISTRY[key]
+
+
+def expert_specs(keys: Optional[Iterable[str]] = None) -> List[ExpertSpec]:
+    """専門家キーの並びに対応する登録内容（Noneなら既定の専門家）"""
+
+    keys = list(DEFAULT_EXPERTS if keys is None else keys)
+    if not keys:
+        raise ValueError("専門家を1人以上指定してください")
+    duplicated = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicated:
+        raise ValueError(f"専門家が重複しています: {', '.join(duplicated)}")
+    return [expert_spec(key) for key in keys]
+
+
+def registered_experts() -> List[str]:
+    """登録済みの専門家キー（登録順）"""
+    return list(_REGISTRY)
+
+
+def expert_label(key: str) -> str:
+    """専門家の表示名（未登録のキーはそのまま）"""
+    return _REGISTRY[key].label if key in _REGISTRY else key
+
+
+def load_plugins(modules: Iterable[str]) -> None:
+    """専門家を登録するモジュールを読み込む（モジュールの読み込み時に register_expert を呼ぶ）"""
+
+    for module in modules:
+        importlib.import_module(module)
+
+
+register_expert(ExpertSpec("pace_expert", RaceExpert, "展開予想専門家", "展開"))
+register_expert(ExpertSpec("jockey_expert", JockeyExpert, "騎手専門家", "騎手"))
+register_expert(ExpertSpec("contrarian_expert", ContrarianExpert, "穴狙い専門家", "穴"))
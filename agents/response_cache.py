@@ -0,0 +1,123 @@
+"""
+LLM応答のディスクキャッシュ
+モデル・温度・システムプロンプト・入力内容のハッシュをキーに応答テキストをSQLiteへ保存し、
+同じレース情報での再実行ではAPIを呼ばずに結果を返す
+"""
+
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """内容アドレス方式の応答キャッシュ（TTL・LRUで削除）"""
+
+    def __init__(self, path: str, ttl_seconds: Optional[float] = 24 * 60 * 60, max_entries: int = 10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds  # Noneなら期限なし
+        self.max_entries = max_entries  # 超えた分は最終アクセスが古い順に削除
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # 並列実行中のノードから同時に使われるため、接続は共有してロックで保護する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    response_text TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_namespace ON responses(namespace)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses(accessed_at)")
+
+    @staticmethod
+    def make_key(namespace: str, params: Dict[str, Any]) -> str:
+        """リクエストパラメータからキャッシュキーを作る
+
+        cache_controlなどキャッシュの有無に関係しない指定もそのままハッシュに含める
+        """
+        payload = json.dumps(
+            {
+                "namespace": namespace,
+                "model": params.get("model"),
+                "temperature": params.get("temperature"),
+                "max_tokens": params.get("max_tokens"),
+                "system": params.get("system"),
+                "messages": params.get("messages"),
+                "tools": params.get("tools"),
+                "tool_choice": params.get("tool_choice"),
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, namespace: str, params: Dict[str, Any]) -> Optional[str]:
+        """キャッシュ済みの応答テキスト（なければNone）"""
+
+        key = self.make_key(namespace, params)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response_text, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, namespace: str, params: Dict[str, Any], response_text: str) -> None:
+        """応答テキストを保存"""
+
+        key = self.make_key(namespace, params)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, response_text, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, response_text, now, now),
+            )
+            self._evict(now)
+
+    def invalidate(self, namespace: Optional[str] = None) -> int:
+        """指定した名前空間（エージェント）のキャッシュを削除。Noneなら全削除
+
+        削除した件数を返す
+        """
+
+        with self._lock, self._conn:
+            if namespace is None:
+                cursor = self._conn.execute("DELETE FROM responses")
+            else:
+                cursor = self._conn.execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+            return cursor.rowcount
+
+    def _evict(self, now: float) -> None:
+        """期限切れと上限超過分を削除（ロック取得済みで呼ぶ）"""
+
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,142 @@
+"""
+LLM呼び出しの再試行と同時実行数の制限
+一時的なエラー（429 / 529 / 5xx / 接続エラー）はジッター付き指数バックオフで再試行し、
+1回の呼び出し全体（再試行を含む）に期限を設けてテールレイテンシを抑える
+"""
+
+from typing import Awaitable, Callable, Optional, TypeVar
+from contextlib import contextmanager, asynccontextmanager
+from dataclasses import dataclass
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import anthropic
+
+
+T = TypeVar("T")
+
+# 再試行するHTTPステータス（リクエストタイムアウト・競合・レート制限・サーバーエラー）
+RETRYABLE_STATUS = (408, 409, 429)
+
+
+@dataclass
+class RetryPolicy:
+    """再試行とタイムアウトの設定"""
+    max_attempts: int = 4  # 最大試行回数（初回を含む）
+    base_delay: float = 1.0  # バックオフの基準秒数
+    max_delay: float = 30.0  # バックオフの上限秒数
+    call_timeout: float = 90.0  # 1回の試行のタイムアウト（秒）
+    deadline: float = 240.0  # 再試行を含めた呼び出し全体の期限（秒）
+
+    def backoff(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """attempt回目の失敗後の待ち時間（フルジッター、retry-afterヘッダーがあればそれ以上待つ）"""
+
+        delay = random.uniform(0.0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+def _retry_after(error: Optional[Exception]) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """一時的なエラーか（再試行で回復が見込めるか）"""
+
+    if isinstance(error, anthropic.APIConnectionError):  # 接続エラー・タイムアウト
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def call_with_retry(policy: RetryPolicy, call: Callable[[float], T],
+                    should_retry: Callable[[Exception], bool] = is_retryable,
+                    on_retry: Optional[Callable[[Exception], None]] = None) -> T:
+    """call(タイムアウト秒) を再試行付きで実行（再試行の直前に on_retry を呼ぶ）"""
+
+    started = time.monotonic()
+    for attempt in range(policy.max_attempts):
+        remaining = policy.deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            raise TimeoutError(f"LLM呼び出しが期限（{policy.deadline}秒）内に完了しませんでした")
+        try:
+            return call(min(policy.call_timeout, remaining))
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not should_retry(e):
+                raise
+            delay = policy.backoff(attempt, e)
+            if time.monotonic() - started + delay >= policy.deadline:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+async def acall_with_retry(policy: RetryPolicy, call: Callable[[float], Awaitable[T]],
+                           should_retry: Callable[[Exception], bool] = is_retryable,
+                           on_retry: Optional[Callable[[Exception], None]] = None) -> T:
+    """call(タイムアウト秒) を再試行付きで実行（非同期版）"""
+
+    started = time.monotonic()
+    for attempt in range(policy.max_attempts):
+        remaining = policy.deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            raise TimeoutError(f"LLM呼び出しが期限（{policy.deadline}秒）内に完了しませんでした")
+        try:
+            return await call(min(policy.call_timeout, remaining))
+        except Exception as e:
+            if attempt + 1 >= policy.max_attempts or not should_retry(e):
+                raise
+            delay = policy.backoff(attempt, e)
+            if time.monotonic() - started + delay >= policy.deadline:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+class ConcurrencyLimiter:
+    """LLM同時呼び出し数の上限
+
+    同期呼び出しはスレッド間、非同期呼び出しはイベントループごとに上限を適用する
+    （バックオフ中は枠を占有しない）
+    """
+
+    def __init__(self, max_concurrency: int = 16):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency は1以上を指定してください")
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._loop_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def limit(self):
+        with self._semaphore:
+            yield
+
+    @asynccontextmanager
+    async def alimit(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._loop_semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._loop_semaphores[loop] = semaphore
+        async with semaphore:
+            yield
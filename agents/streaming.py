@@ -0,0 +1,51 @@
+"""
+応答のストリーミング
+messages.stream で応答を受け取り、届いたテキスト断片を逐次コールバックに渡す
+（ツール使用の応答では入力JSONの断片を渡す。最終的なメッセージは messages.create と同じ形で返すため、
+呼び出し側のパース処理はそのまま使える）
+"""
+
+from typing import Any, Callable, Dict, Optional
+
+from anthropic import Anthropic, AsyncAnthropic
+
+
+TextCallback = Callable[[str], None]
+
+
+def _request_options(timeout: Optional[float]) -> Dict[str, Any]:
+    return {} if timeout is None else {"timeout": timeout}
+
+
+def _delta_text(event: Any) -> str:
+    """ストリームのイベントに含まれるテキスト断片（テキスト・ツール入力JSON以外は空）"""
+
+    if event.type == "text":
+        return event.text
+    if event.type == "input_json":
+        return event.partial_json
+    return ""
+
+
+def stream_message(client: Anthropic, params: Dict[str, Any], on_text: TextCallback,
+                   timeout: Optional[float] = None) -> Any:
+    """ストリーミングで呼び出し、テキスト断片ごとに on_text を呼んで最終メッセージを返す"""
+
+    with client.messages.stream(**params, **_request_options(timeout)) as stream:
+        for event in stream:
+            text = _delta_text(event)
+            if text:
+                on_text(text)
+        return stream.get_final_message()
+
+
+async def astream_message(client: AsyncAnthropic, params: Dict[str, Any], on_text: TextCallback,
+                          timeout: Optional[float] = None) -> Any:
+    """ストリーミングで呼び出し、テキスト断片ごとに on_text を呼んで最終メッセージを返す（非同期版）"""
+
+    async with client.messages.stream(**params, **_request_options(timeout)) as stream:
+        async for event in stream:
+            text = _delta_text(event)
+            if text:
+                on_text(text)
+        return await stream.get_final_message()
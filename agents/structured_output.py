@@ -0,0 +1,190 @@
+"""
+構造化出力
+ツール使用（JSONスキーマ）で応答の形を指定し、テキストで返ってきた場合も寛容に取り出して検証する
+（検証に失敗した応答は BaseAgent が安価な修正呼び出しで直す）
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import math
+
+
+class StructuredOutputError(ValueError):
+    """応答からスキーマに合うJSONを取り出せなかった"""
+
+    def __init__(self, errors: List[str], response_text: str):
+        super().__init__("; ".join(errors))
+        self.errors = errors  # 検証エラー
+        self.response_text = response_text  # 元の応答テキスト
+
+
+def output_tool(name: str, description: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """応答の形を指定するツール定義"""
+    return {"name": name, "description": description, "input_schema": schema}
+
+
+def tool_choice(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """指定したツールでの回答を強制する"""
+    return {"type": "tool", "name": tool["name"]}
+
+
+def message_text(message: Any) -> str:
+    """応答メッセージの本文（ツール使用なら入力JSON、それ以外はテキストを連結）"""
+
+    texts = []
+    for block in message.content:
+        if getattr(block, "type", "text") == "tool_use":
+            return json.dumps(block.input, ensure_ascii=False)
+        texts.append(getattr(block, "text", ""))
+    return "".join(texts)
+
+
+class JsonObjectExtractor:
+    """テキスト断片から最初のJSONオブジェクトを取り出す
+
+    前後の説明文やコードフェンスは読み飛ばし、閉じ括弧直前の余分なカンマは取り除く。
+    ストリーミング中に feed で断片を渡すと、オブジェクトが閉じた時点で結果が確定する
+    """
+
+    def __init__(self):
+        self.result: Optional[Any] = None  # 取り出したオブジェクト（未完了ならNone）
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, text: str) -> Optional[Any]:
+        """断片を読み込み、オブジェクトが閉じたらそれを返す"""
+
+        for char in text:
+            if self.done:
+                break
+            if self._depth == 0:
+                if char == "{":
+                    self._buffer = [char]
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._buffer.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._drop_trailing_comma()
+                self._depth -= 1
+            self._buffer.append(char)
+
+            if self._depth == 0:
+                self._close()
+        return self.result
+
+    def _drop_trailing_comma(self) -> None:
+        index = len(self._buffer) - 1
+        while index >= 0 and self._buffer[index].isspace():
+            index -= 1
+        if index >= 0 and self._buffer[index] == ",":
+            del self._buffer[index]
+
+    def _close(self) -> None:
+        try:
+            # 文字列内の生の改行などの制御文字も許容する
+            self.result = json.loads("".join(self._buffer), strict=False)
+        except json.JSONDecodeError:
+            # JSONに見えたが壊れていた場合は次の「{」から探し直す
+            self._buffer = []
+
+
+def extract_json(response_text: str) -> Any:
+    """応答テキストから最初のJSONオブジェクトを取り出す"""
+
+    extractor = JsonObjectExtractor()
+    result = extractor.feed(response_text)
+    if result is None:
+        raise StructuredOutputError(["応答にJSONオブジェクトが見つかりません"], response_text)
+    return result
+
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+}
+
+
+def conform(value: Any, schema: Dict[str, Any], path: str = "$") -> Tuple[Any, List[str]]:
+    """スキーマに合わせて値を検証する（数値の文字列など明らかな型違いはその場で変換）
+
+    変換後の値と検証エラーの一覧を返す
+    """
+
+    expected = schema.get("type")
+    errors: List[str] = []
+
+    if expected in ("number", "integer"):
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                return value, [f"{path}: 数値ではありません"]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return value, [f"{path}: 数値ではありません"]
+        if not math.isfinite(value):
+            # NaN・無限大は範囲の比較や整数への変換ができないため、修正呼び出しの対象にする
+            return value, [f"{path}: 有限の数値ではありません"]
+        if expected == "integer":
+            if float(value) != int(value):
+                return value, [f"{path}: 整数ではありません"]
+            value = int(value)
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {schema['minimum']}以上である必要があります")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {schema['maximum']}以下である必要があります")
+        return value, errors
+
+    if expected in _TYPES and not isinstance(value, _TYPES[expected]):
+        return value, [f"{path}: {expected}ではありません"]
+
+    if expected == "object":
+        conformed = dict(value)
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}.{key}: 必須項目がありません")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                conformed[key], sub_errors = conform(value[key], subschema, f"{path}.{key}")
+                errors.extend(sub_errors)
+        return conformed, errors
+
+    if expected == "array" and "items" in schema:
+        conformed = []
+        for index, item in enumerate(value):
+            item, sub_errors = conform(item, schema["items"], f"{path}[{index}]")
+            conformed.append(item)
+            errors.extend(sub_errors)
+        return conformed, errors
+
+    return value, errors
+
+
+def decode_output(response_text: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """応答テキストからスキーマに合うJSONを取り出す（合わなければ StructuredOutputError）"""
+
+    data, errors = conform(extract_json(response_text), schema)
+    if errors:
+        raise StructuredOutputError(errors, response_text)
+    return data
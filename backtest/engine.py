@@ -0,0 +1,240 @@
+"""
+バックテスト
+保存済みの予想とレース結果を突き合わせ、回収率・的中率・勝率の較正を
+エッジスコアの区間別・専門家別に集計する（集計はNumPyの配列演算で行い、数万レースでも一度に処理する）
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtest.store import ResultsStore, read_results_csv
+from racecard.entities import EntityCache
+
+
+# エッジスコアの区間の境界（最後の区間は上限を含む）
+EDGE_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 1.0)
+
+# 勝率の較正に使う区間の境界
+PROBABILITY_BUCKETS = (0.0, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0)
+
+# 専門家別の回収率で1頭に賭ける額（円）
+PICK_STAKE = 100.0
+
+
+def _bucket_labels(edges: Sequence[float]) -> List[str]:
+    return [f"{low:.2f}-{high:.2f}" for low, high in zip(edges[:-1], edges[1:])]
+
+
+def _bucket_index(values: np.ndarray, edges: Sequence[float]) -> np.ndarray:
+    """区間の添字（範囲外・nanは-1）"""
+
+    edges = np.asarray(edges, dtype=float)
+    index = np.searchsorted(edges, values, side="right") - 1
+    index[values == edges[-1]] = len(edges) - 2  # 上限ちょうどは最後の区間
+    index[~((values >= edges[0]) & (values <= edges[-1]))] = -1
+    return index
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def _rows(labels: List[str], key: str, **columns: np.ndarray) -> List[Dict[str, Any]]:
+    """区間・専門家ごとの集計を行のリストにする（nanはNone）"""
+
+    rows = []
+    for i, label in enumerate(labels):
+        row: Dict[str, Any] = {key: label}
+        for name, values in columns.items():
+            value = values[i]
+            if np.issubdtype(values.dtype, np.integer):
+                row[name] = int(value)
+            else:
+                row[name] = None if np.isnan(value) else round(float(value), 4)
+        rows.append(row)
+    return rows
+
+
+def bet_summary(bets: Dict[str, np.ndarray], edges: Sequence[float] = EDGE_BUCKETS) -> Dict[str, Any]:
+    """推奨馬券の回収率・的中率（全体とエッジスコアの区間別）"""
+
+    stake = bets["bet_amount"]
+    won = bets["finish"] == 1
+    returns = np.where(won, stake * np.nan_to_num(bets["payout_odds"]), 0.0)
+
+    bucket = _bucket_index(bets["edge_score"], edges)
+    valid = bucket >= 0
+    n = len(edges) - 1
+    count = np.bincount(bucket[valid], minlength=n)
+    stakes = np.bincount(bucket[valid], weights=stake[valid], minlength=n)
+    paid = np.bincount(bucket[valid], weights=returns[valid], minlength=n)
+    hits = np.bincount(bucket[valid], weights=won[valid], minlength=n)
+    probability = np.bincount(bucket[valid], weights=np.nan_to_num(bets["win_probability"][valid]), minlength=n)
+
+    total_stake = float(stake.sum())
+    return {
+        "races": int(len(np.unique(bets["race_id"]))),
+        "bets": int(len(stake)),
+        "stake": total_stake,
+        "return": float(returns.sum()),
+        "roi": round(float(returns.sum()) / total_stake - 1.0, 4) if total_stake > 0 else None,
+        "hit_rate": round(float(won.mean()), 4) if len(won) else None,
+        "by_edge": _rows(
+            _bucket_labels(edges), "edge_score",
+            bets=count,
+            roi=_ratio(paid, stakes) - 1.0,
+            hit_rate=_ratio(hits, count),
+            mean_win_probability=_ratio(probability, count),
+        ),
+    }
+
+
+def calibration(probabilities: np.ndarray, won: np.ndarray,
+                edges: Sequence[float] = PROBABILITY_BUCKETS) -> Dict[str, Any]:
+    """見積もり勝率の較正（区間ごとの平均見積もり勝率と実際の勝率、ブライアスコア）"""
+
+    known = ~np.isnan(probabilities)
+    probabilities, won = probabilities[known], won[known]
+    bucket = _bucket_index(probabilities, edges)
+    valid = bucket >= 0
+    n = len(edges) - 1
+    count = np.bincount(bucket[valid], minlength=n)
+    predicted = np.bincount(bucket[valid], weights=probabilities[valid], minlength=n)
+    observed = np.bincount(bucket[valid], weights=won[valid], minlength=n)
+    return {
+        "brier_score": round(float(np.mean((probabilities - won) ** 2)), 4) if len(won) else None,
+        "buckets": _rows(
+            _bucket_labels(edges), "win_probability",
+            count=count,
+            predicted=_ratio(predicted, count),
+            observed=_ratio(observed, count),
+        ),
+    }
+
+
+def expert_summary(picks: Dict[str, np.ndarray], experts: List[str]) -> List[Dict[str, Any]]:
+    """専門家ごとの推奨馬の成績
+
+    1頭あたり PICK_STAKE 円を単勝で買った場合の回収率、推奨馬の勝率、推奨馬のいずれかが勝ったレースの割合と、
+    確信度をそのレースの的中確率とみなしたときの較正（平均確信度とブライアスコア）
+    """
+
+    expert = picks["expert"].astype(int)
+    won = picks["finish"] == 1
+    n = len(experts)
+
+    count = np.bincount(expert, minlength=n)
+    paid = np.bincount(expert, weights=np.where(won, PICK_STAKE * np.nan_to_num(picks["payout_odds"]), 0.0),
+                       minlength=n)
+    hits = np.bincount(expert, weights=won, minlength=n)
+
+    # レース単位（専門家×レース）: 確信度は推奨馬すべてに同じ値が入っている
+    race_keys, race_index = np.unique(np.stack([expert, picks["race_id"].astype(int)]), axis=1, return_inverse=True)
+    race_index = race_index.ravel()
+    race_expert = race_keys[0]
+    race_hit = np.bincount(race_index, weights=won, minlength=race_keys.shape[1]) > 0
+    race_confidence = np.zeros(race_keys.shape[1])
+    race_confidence[race_index] = picks["confidence"]
+
+    races = np.bincount(race_expert, minlength=n)
+    race_hits = np.bincount(race_expert, weights=race_hit, minlength=n)
+    confidence = np.bincount(race_expert, weights=race_confidence, minlength=n)
+    brier = np.bincount(race_expert, weights=(race_confidence - race_hit) ** 2, minlength=n)
+
+    return _rows(
+        experts, "expert",
+        races=races,
+        picks=count,
+        roi=_ratio(paid, count * PICK_STAKE) - 1.0,
+        pick_hit_rate=_ratio(hits, count),
+        race_hit_rate=_ratio(race_hits, races),
+        mean_confidence=_ratio(confidence, races),
+        brier_score=_ratio(brier, races),
+    )
+
+
+class Backtester:
+    """保存済みの予想のバックテスト（各レースの最新の予想を使う）"""
+
+    def __init__(self, store: ResultsStore, edge_buckets: Sequence[float] = EDGE_BUCKETS,
+                 probability_buckets: Sequence[float] = PROBABILITY_BUCKETS):
+        self.store = store
+        self.edge_buckets = edge_buckets
+        self.probability_buckets = probability_buckets
+
+    def run(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+            venue: Optional[str] = None, course: Optional[str] = None) -> Dict[str, Any]:
+        """期間（YYYY-MM-DD）・競馬場・コース（例: ダート1800）で絞り込んで集計"""
+
+        bets = self.store.bet_columns(date_from, date_to, venue, course)
+        picks = self.store.pick_columns(date_from, date_to, venue, course)
+        return {
+            "filters": {"date_from": date_from, "date_to": date_to, "venue": venue, "course": course},
+            "bets": bet_summary(bets, self.edge_buckets),
+            "calibration": calibration(bets["win_probability"], (bets["finish"] == 1).astype(float),
+                                       self.probability_buckets),
+            "experts": expert_summary(picks, self.store.experts()),
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    bets = report["bets"]
+    print("=== 推奨馬券 ===")
+    print(f"{bets['races']}レース {bets['bets']}点 投資{bets['stake']:.0f}円 払戻{bets['return']:.0f}円 "
+          f"回収率{bets['roi']} 的中率{bets['hit_rate']}")
+    for row in bets["by_edge"]:
+        print(f"エッジ {row['edge_score']}: {row['bets']}点 回収率{row['roi']} 的中率{row['hit_rate']} "
+              f"平均勝率{row['mean_win_probability']}")
+
+    print("\n=== 勝率の較正 ===")
+    print(f"ブライアスコア: {report['calibration']['brier_score']}")
+    for row in report["calibration"]["buckets"]:
+        print(f"勝率 {row['win_probability']}: {row['count']}頭 見積もり{row['predicted']} 実際{row['observed']}")
+
+    print("\n=== 専門家別 ===")
+    for row in report["experts"]:
+        print(f"{row['expert']}: {row['races']}レース {row['picks']}頭 回収率{row['roi']} "
+              f"推奨馬の勝率{row['pick_hit_rate']} レース的中率{row['race_hit_rate']} "
+              f"平均確信度{row['mean_confidence']} ブライアスコア{row['brier_score']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みの予想のバックテスト")
+    parser.add_argument("--store", default=".cache/results.sqlite3", help="予想と結果のストア")
+    parser.add_argument("--import-results", help="レース結果のCSV（race_date, venue, race_number, horse_number, finish, win_odds）")
+    parser.add_argument("--from", dest="date_from", help="開始日（YYYY-MM-DD）")
+    parser.add_argument("--to", dest="date_to", help="終了日（YYYY-MM-DD）")
+    parser.add_argument("--venue", help="競馬場（例: 阪神）")
+    parser.add_argument("--course", help="コース（例: ダート1800）")
+    parser.add_argument("--entities", help="取り込んだ結果を反映する騎手・調教師・父の成績キャッシュ（例: .cache/entities.sqlite3）")
+    parser.add_argument("--json", action="store_true", help="JSONで出力")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.import_results:
+        print(f"{store.import_results_csv(args.import_results)}レースの結果を取り込みました")
+        if args.entities:
+            entity_cache = EntityCache(args.entities)
+            runs = sum(
+                entity_cache.record_result(race_date_iso, venue, race_number, finishes)
+                for (race_date_iso, venue, race_number), (finishes, _) in read_results_csv(args.import_results).items()
+            )
+            print(f"成績キャッシュに{runs}走を反映しました")
+
+    report = Backtester(store).run(args.date_from, args.date_to, args.venue, args.course)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
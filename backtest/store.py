@@ -0,0 +1,262 @@
+"""
+予想と結果の保存
+過去の予想（最終判断・専門家の推奨）とレース結果をSQLiteに保存し、バックテスト用に列ごとの配列で取り出す
+（開催日・競馬場・コース・レースに索引を張り、数万レースでも絞り込みと結合をSQLite側で済ませる）
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from racecard.models import Race
+from racecard.parser import race_date
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS races (
+        id INTEGER PRIMARY KEY,
+        race_date TEXT NOT NULL,
+        venue TEXT NOT NULL,
+        race_number INTEGER NOT NULL,
+        meeting TEXT,
+        race_name TEXT,
+        course TEXT,
+        field_size INTEGER,
+        UNIQUE (race_date, venue, race_number)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_races_date ON races(race_date)",
+    "CREATE INDEX IF NOT EXISTS idx_races_venue ON races(venue, race_date)",
+    "CREATE INDEX IF NOT EXISTS idx_races_course ON races(course, race_date)",
+    """CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY,
+        race_id INTEGER NOT NULL REFERENCES races(id),
+        created_at REAL NOT NULL,
+        final_judgment TEXT NOT NULL,
+        expert_votes TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_predictions_race ON predictions(race_id, id)",
+    """CREATE TABLE IF NOT EXISTS bets (
+        prediction_id INTEGER NOT NULL REFERENCES predictions(id),
+        horse_number INTEGER NOT NULL,
+        win_odds REAL,
+        expected_value REAL,
+        bet_amount REAL NOT NULL,
+        confidence REAL,
+        edge_score REAL,
+        win_probability REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_bets_prediction ON bets(prediction_id)",
+    """CREATE TABLE IF NOT EXISTS expert_picks (
+        prediction_id INTEGER NOT NULL REFERENCES predictions(id),
+        expert TEXT NOT NULL,
+        horse_number INTEGER NOT NULL,
+        win_odds REAL,
+        confidence REAL NOT NULL,
+        reliability REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_expert_picks_prediction ON expert_picks(prediction_id)",
+    """CREATE TABLE IF NOT EXISTS results (
+        race_id INTEGER NOT NULL REFERENCES races(id),
+        horse_number INTEGER NOT NULL,
+        finish INTEGER,
+        win_odds REAL,
+        PRIMARY KEY (race_id, horse_number)
+    )""",
+]
+
+# 各レースの最新の予想（結果が登録済みのレースのみ）を絞り込み条件付きで選ぶ
+LATEST_PREDICTIONS = """
+    SELECT MAX(p.id) AS prediction_id, p.race_id
+    FROM predictions p JOIN races r ON r.id = p.race_id
+    WHERE EXISTS (SELECT 1 FROM results res WHERE res.race_id = p.race_id) {conditions}
+    GROUP BY p.race_id
+"""
+
+
+def course_label(race: Race) -> str:
+    """コースの表記（例: ダート1800）"""
+    return f"{race.surface}{race.distance or ''}"
+
+
+def read_results_csv(path: str) -> Dict[Tuple[str, str, int], Tuple[Dict[int, Optional[int]], Dict[int, float]]]:
+    """レース結果のCSVを (開催日, 競馬場, レース番号) -> (馬番 -> 着順, 馬番 -> 確定単勝オッズ) にする"""
+
+    races: Dict[Tuple[str, str, int], Tuple[Dict[int, Optional[int]], Dict[int, float]]] = {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            key = (row["race_date"], row["venue"], int(row["race_number"]))
+            finishes, odds = races.setdefault(key, ({}, {}))
+            number = int(row["horse_number"])
+            finishes[number] = int(row["finish"]) if row.get("finish") else None
+            if row.get("win_odds"):
+                odds[number] = float(row["win_odds"])
+    return races
+
+
+class ResultsStore:
+    """予想とレース結果のSQLiteストア"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # 並行して予想するレースから同時に書き込まれるため、接続は共有してロックで保護する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+    def _race_id(self, race_date_iso: str, venue: str, race_number: int, race: Optional[Race] = None) -> int:
+        """レースの行ID（なければ作成、出馬表があればレース名やコースを更新。ロック取得済みで呼ぶ）"""
+
+        details = (None, None, None, None)
+        if race is not None:
+            details = (race.meeting, race.race_name, course_label(race), race.field_size)
+        self._conn.execute(
+            "INSERT INTO races (race_date, venue, race_number, meeting, race_name, course, field_size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (race_date, venue, race_number) DO UPDATE SET "
+            "meeting = COALESCE(excluded.meeting, meeting), race_name = COALESCE(excluded.race_name, race_name), "
+            "course = COALESCE(excluded.course, course), field_size = COALESCE(excluded.field_size, field_size)",
+            (race_date_iso, venue, race_number, *details),
+        )
+        (row_id,) = self._conn.execute(
+            "SELECT id FROM races WHERE race_date = ? AND venue = ? AND race_number = ?",
+            (race_date_iso, venue, race_number),
+        ).fetchone()
+        return row_id
+
+    def record_prediction(self, race: Race, result: Dict[str, Any]) -> Optional[int]:
+        """予想結果（predict_race の戻り値）を保存し、予想のIDを返す（最終判断がなければ保存しない）"""
+
+        final_judgment = result.get("final_judgment")
+        if final_judgment is None or race.race_number is None:
+            return None
+        expert_votes = result.get("expert_votes", {})
+        reliability = final_judgment.get("expert_reliability", {})
+        odds = {entry.number: entry.win_odds for entry in race.entries}
+
+        with self._lock, self._conn:
+            race_id = self._race_id(race_date(race).isoformat(), race.venue, race.race_number, race)
+            cursor = self._conn.execute(
+                "INSERT INTO predictions (race_id, created_at, final_judgment, expert_votes) VALUES (?, ?, ?, ?)",
+                (race_id, time.time(), json.dumps(final_judgment, ensure_ascii=False),
+                 json.dumps(expert_votes, ensure_ascii=False)),
+            )
+            prediction_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO bets (prediction_id, horse_number, win_odds, expected_value, bet_amount, confidence, "
+                "edge_score, win_probability) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (prediction_id, rec["horse_number"], rec["win_odds"], rec["expected_value"], rec["bet_amount"],
+                     rec["confidence"], rec["edge_score"], rec.get("win_probability"))
+                    for rec in final_judgment.get("recommendations", [])
+                ],
+            )
+            self._conn.executemany(
+                "INSERT INTO expert_picks (prediction_id, expert, horse_number, win_odds, confidence, reliability) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (prediction_id, expert, number, odds.get(number), vote["confidence"], reliability.get(expert))
+                    for expert, vote in expert_votes.items()
+                    for number in vote["recommended_horses"]
+                ],
+            )
+        return prediction_id
+
+    def record_result(self, race_date_iso: str, venue: str, race_number: int,
+                      finishes: Dict[int, Optional[int]], win_odds: Optional[Dict[int, float]] = None) -> None:
+        """レース結果（馬番 -> 着順、中止・除外はNone）と確定単勝オッズを保存"""
+
+        win_odds = win_odds or {}
+        with self._lock, self._conn:
+            race_id = self._race_id(race_date_iso, venue, race_number)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (race_id, horse_number, finish, win_odds) VALUES (?, ?, ?, ?)",
+                [(race_id, number, finish, win_odds.get(number)) for number, finish in finishes.items()],
+            )
+
+    def import_results_csv(self, path: str) -> int:
+        """CSV（race_date, venue, race_number, horse_number, finish, win_odds）からレース結果を取り込み、件数を返す"""
+
+        races = read_results_csv(path)
+        for (race_date_iso, venue, race_number), (finishes, odds) in races.items():
+            self.record_result(race_date_iso, venue, race_number, finishes, odds)
+        return len(races)
+
+    @staticmethod
+    def _conditions(date_from: Optional[str], date_to: Optional[str], venue: Optional[str],
+                    course: Optional[str]) -> Tuple[str, list]:
+        conditions, params = [], []
+        for column, operator, value in (("race_date", ">=", date_from), ("race_date", "<=", date_to),
+                                        ("venue", "=", venue), ("course", "=", course)):
+            if value is not None:
+                conditions.append(f"AND r.{column} {operator} ?")
+                params.append(value)
+        return " ".join(conditions), params
+
+    def _columns(self, query: str, params: Iterable[Any], names: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+        """数値の列を配列で取り出す（欠損はクエリ側で -1 にしておき nan に戻す）"""
+
+        with self._lock:
+            rows = self._conn.execute(query, list(params)).fetchall()
+        values = np.array(rows, dtype=float).reshape(len(rows), len(names))
+        values[values < 0] = np.nan
+        return {name: values[:, i] for i, name in enumerate(names)}
+
+    def bet_columns(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    venue: Optional[str] = None, course: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """各レースの最新の予想の推奨馬券と結果（1行1点、欠損はnan）
+
+        払戻のオッズは確定オッズ（結果に登録があれば）、なければ予想時のオッズ
+        """
+
+        conditions, params = self._conditions(date_from, date_to, venue, course)
+        query = f"""
+            SELECT latest.race_id, b.bet_amount, IFNULL(b.edge_score, -1), IFNULL(b.win_probability, -1),
+                   IFNULL(COALESCE(res.win_odds, b.win_odds), -1), IFNULL(res.finish, -1)
+            FROM ({LATEST_PREDICTIONS.format(conditions=conditions)}) latest
+            JOIN bets b ON b.prediction_id = latest.prediction_id
+            LEFT JOIN results res ON res.race_id = latest.race_id AND res.horse_number = b.horse_number
+        """
+        names = ("race_id", "bet_amount", "edge_score", "win_probability", "payout_odds", "finish")
+        return self._columns(query, params, names)
+
+    def experts(self) -> List[str]:
+        """推奨を保存した専門家（pick_columns の expert 列はこの一覧の添字）"""
+
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT expert FROM expert_picks ORDER BY expert")]
+
+    def pick_columns(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                     venue: Optional[str] = None, course: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """各レースの最新の予想の専門家の推奨馬と結果（1行1頭、欠損はnan）"""
+
+        conditions, params = self._conditions(date_from, date_to, venue, course)
+        query = f"""
+            SELECT latest.race_id, x.expert_index, e.confidence,
+                   IFNULL(COALESCE(res.win_odds, e.win_odds), -1), IFNULL(res.finish, -1)
+            FROM ({LATEST_PREDICTIONS.format(conditions=conditions)}) latest
+            JOIN expert_picks e ON e.prediction_id = latest.prediction_id
+            JOIN (SELECT expert, ROW_NUMBER() OVER (ORDER BY expert) - 1 AS expert_index
+                  FROM (SELECT DISTINCT expert FROM expert_picks)) x ON x.expert = e.expert
+            LEFT JOIN results res ON res.race_id = latest.race_id AND res.horse_number = e.horse_number
+        """
+        names = ("race_id", "expert", "confidence", "payout_odds", "finish")
+        return self._columns(query, params, names)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
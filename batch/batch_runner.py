@@ -0,0 +1,235 @@
+"""
+Message Batches APIによる一括予想
+バックテストや夜間の大量予想向けに、専門家の分析と総合判断をそれぞれ1つのバッチとして投入する
+（レイテンシより処理量とバッチ割引を優先）
+"""
+
+from typing import Any, Dict, List, Optional
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.structured_output import message_text
+from graph.prediction_graph import (
+    HorseRacePredictionGraph,
+    format_expert_opinion,
+    judgment_to_dict,
+    vote_to_dict,
+)
+from pricing.prescreen import Prescreener
+from racecard.models import Race
+from racecard.parser import parse_race_card
+
+
+class BatchPredictionRunner:
+    """2段階（専門家 -> 総合判断）のバッチ予想
+
+    進捗は state_path のJSONに保存され、中断後に同じレース一覧で再実行すると続きから再開する
+    """
+
+    def __init__(self, graph: HorseRacePredictionGraph, state_path: str,
+                 batch_client: Optional[Any] = None, poll_interval: float = 60.0):
+        self.graph = graph
+        self.client = batch_client or graph.client  # messages.batches を持つクライアント
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def _custom_id(race_index: int, role: str) -> str:
+        """バッチ内のリクエストID（英数字・ハイフン・アンダースコアのみ）"""
+        return f"race{race_index:05d}--{role}"
+
+    @staticmethod
+    def _races_digest(races: List[str]) -> str:
+        digest = hashlib.sha256()
+        for race_info in races:
+            digest.update(hashlib.sha256(race_info.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def _load_state(self, races: List[str]) -> Dict[str, Any]:
+        """保存済みの進捗を読み込む（なければ新規）"""
+
+        digest = self._races_digest(races)
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("races_digest") != digest:
+                raise ValueError(f"{self.state_path} は別のレース一覧の進捗です")
+            return state
+
+        return {
+            "races_digest": digest,
+            "expert_batch_id": None,
+            "expert_responses": None,
+            "moderator_batch_id": None,
+            "moderator_responses": None,
+        }
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        """進捗を保存（書き込み途中で中断されても壊れないよう置き換えで保存）"""
+
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_path, self.state_path)
+
+    def _run_stage(self, state: Dict[str, Any], stage: str, requests: List[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+        """バッチを投入（投入済みなら再利用）し、完了を待って結果を集める
+
+        結果は custom_id -> {"text": 応答テキスト} または {"error": 失敗理由}
+        """
+
+        if state[f"{stage}_responses"] is not None:
+            return state[f"{stage}_responses"]
+        if not requests:
+            return {}  # 全レースを絞り込みで見送った場合はバッチを投入しない
+
+        if state[f"{stage}_batch_id"] is None:
+            batch = self.client.messages.batches.create(requests=requests)
+            state[f"{stage}_batch_id"] = batch.id
+            self._save_state(state)
+
+        batch_id = state[f"{stage}_batch_id"]
+        while self.client.messages.batches.retrieve(batch_id).processing_status != "ended":
+            time.sleep(self.poll_interval)
+
+        responses: Dict[str, Dict[str, str]] = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                responses[entry.custom_id] = {"text": message_text(entry.result.message)}
+            else:
+                responses[entry.custom_id] = {"error": f"バッチ結果: {entry.result.type}"}
+
+        state[f"{stage}_responses"] = responses
+        self._save_state(state)
+        return responses
+
+    @staticmethod
+    def _parse_race(race_info: str) -> Optional[Race]:
+        try:
+            return parse_race_card(race_info)
+        except ValueError:
+            return None
+
+    def run(self, races: List[str]) -> List[Dict[str, Any]]:
+        """レース一覧をバッチで予想（結果は predict_race と同じ形式、入力順）"""
+
+        state = self._load_state(races)
+        parsed = [self._parse_race(race_info) for race_info in races]
+
+        # 絞り込みで見送るレースはバッチに含めない
+        screenings = [self.graph.screen(race) for race in parsed]
+        active = [index for index, screening in enumerate(screenings) if screening is None or screening["passed"]]
+        views = {index: self.graph.race_views(races[index]) for index in active}
+
+        # 第1段階：対象レースの専門家分析
+        expert_requests = [
+            {
+                "custom_id": self._custom_id(index, role),
+                "params": self.graph.experts[role].build_request(views[index][role]),
+            }
+            for index in active
+            for role in self.graph.expert_keys
+        ]
+        expert_responses = self._run_stage(state, "expert", expert_requests)
+
+        expert_results: Dict[int, Dict[str, Any]] = {}
+        for index in active:
+            opinions = {}
+            for role in self.graph.expert_keys:
+                expert = self.graph.experts[role]
+                response = expert_responses.get(self._custom_id(index, role), {"error": "バッチ結果なし"})
+                try:
+                    if "error" in response:
+                        raise RuntimeError(response["error"])
+                    opinion = expert.parse_opinion(response["text"])
+                except Exception as e:
+                    opinion = expert.fallback_opinion(e)
+                opinions[role] = opinion
+            expert_results[index] = opinions
+
+        # 第2段階：対象レースの総合判断
+        moderator_requests = [
+            {
+                "custom_id": self._custom_id(index, "moderator"),
+                "params": self.graph.moderator.build_request(
+                    views[index]["moderator"],
+                    expert_results[index],
+                ),
+            }
+            for index in active
+        ]
+        moderator_responses = self._run_stage(state, "moderator", moderator_requests)
+
+        results = []
+        for index, race_info in enumerate(races):
+            race = parsed[index]
+            if index not in expert_results:
+                results.append(self.graph.screened_out_result(race_info, screenings[index]))
+                continue
+
+            response = moderator_responses.get(self._custom_id(index, "moderator"), {"error": "バッチ結果なし"})
+            try:
+                if "error" in response:
+                    raise RuntimeError(response["error"])
+                final_judgment = self.graph.moderator.parse_judgment(response["text"])
+            except Exception as e:
+                final_judgment = self.graph.moderator.fallback_judgment(e)
+
+            final_judgment = self.graph.apply_pricing(race, expert_results[index], final_judgment)
+
+            result = {
+                "race_info": race_info,
+                "expert_opinions": [
+                    format_expert_opinion(role, expert_results[index][role]) for role in self.graph.expert_keys
+                ],
+                "expert_votes": {
+                    role: vote_to_dict(expert_results[index][role])
+                    for role in self.graph.expert_keys
+                },
+                "final_judgment": judgment_to_dict(final_judgment),
+            }
+            if screenings[index] is not None:
+                result["screening"] = screenings[index]
+            if self.graph.results_store is not None and race is not None:
+                self.graph.results_store.record_prediction(race, result)
+            results.append(result)
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Message Batches APIで複数レースを一括予想")
+    parser.add_argument("inputs", nargs="+", help="レース情報ファイル（globパターン可）")
+    parser.add_argument("--state", default=".cache/batch_state.json", help="進捗ファイル（中断後の再開に使用）")
+    parser.add_argument("--output", default="batch_results.jsonl", help="結果の出力先（JSONL）")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="バッチ状態の確認間隔（秒）")
+    parser.add_argument("--screen", action="store_true", help="近走の指標とオッズで絞り込み、妙味のあるレースだけバッチに含める")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.inputs for path in glob.glob(pattern)})
+    races = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            races.append(f.read())
+
+    graph = HorseRacePredictionGraph(prescreener=Prescreener() if args.screen else None)
+    runner = BatchPredictionRunner(graph, args.state, poll_interval=args.poll_interval)
+    results = runner.run(races)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        for path, result in zip(paths, results):
+            f.write(json.dumps({"source": path, **result}, ensure_ascii=False) + "\n")
+    print(f"{len(results)}レースの予想を {args.output} に出力しました")
+
+
+if __name__ == "__main__":
+    main()
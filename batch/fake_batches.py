@@ -0,0 +1,83 @@
+"""
+ローカルで動くMessage Batches APIの代替
+APIを呼ばずにバッチ予想の流れ（投入・ポーリング・結果取得・再開）を確認するためのもの
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from types import SimpleNamespace
+import itertools
+import json
+
+
+def canned_response(params: Dict[str, Any]) -> str:
+    """リクエスト内容に応じた固定の応答（総合判断か専門家かをシステムプロンプトで判定）"""
+
+    system = json.dumps(params.get("system"), ensure_ascii=False)
+    if "expert_reliability" in system:
+        return json.dumps({
+            "consensus_analysis": "固定応答",
+            "minority_opinions": "固定応答",
+            "expert_reliability": {"pace_expert": 0.5, "jockey_expert": 0.5, "contrarian_expert": 0.5},
+            "summary": "固定応答",
+            "reasoning": "固定応答",
+            "risk_assessment": "固定応答"
+        }, ensure_ascii=False)
+    return json.dumps({
+        "analysis": "固定応答",
+        "recommended_horses": [1],
+        "confidence": 0.5,
+        "reasoning": "固定応答"
+    }, ensure_ascii=False)
+
+
+class FakeBatches:
+    """messages.batches の代替（create / retrieve / results）"""
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], str], polls_until_ended: int = 1,
+                 failed_custom_ids: Optional[List[str]] = None):
+        self.responder = responder
+        self.polls_until_ended = polls_until_ended  # retrieveを何回呼ぶと完了になるか
+        self.failed_custom_ids = set(failed_custom_ids or [])  # errored として返すリクエスト
+        self.created: Dict[str, List[Dict[str, Any]]] = {}  # バッチID -> リクエスト
+        self._polls: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+
+    def create(self, requests: List[Dict[str, Any]]) -> SimpleNamespace:
+        batch_id = f"msgbatch_fake_{next(self._ids):04d}"
+        self.created[batch_id] = list(requests)
+        self._polls[batch_id] = 0
+        return SimpleNamespace(id=batch_id, processing_status="in_progress")
+
+    def retrieve(self, batch_id: str) -> SimpleNamespace:
+        self._polls[batch_id] += 1
+        ended = self._polls[batch_id] >= self.polls_until_ended
+        return SimpleNamespace(id=batch_id, processing_status="ended" if ended else "in_progress")
+
+    def _content_block(self, params: Dict[str, Any]) -> SimpleNamespace:
+        """応答ブロック（ツール指定があればツール使用、なければテキスト）"""
+
+        text = self.responder(params)
+        tool = params.get("tool_choice", {}).get("name")
+        if tool is None:
+            return SimpleNamespace(type="text", text=text)
+        return SimpleNamespace(type="tool_use", id="toolu_fake", name=tool, input=json.loads(text))
+
+    def results(self, batch_id: str) -> Iterator[SimpleNamespace]:
+        for request in self.created[batch_id]:
+            if request["custom_id"] in self.failed_custom_ids:
+                result = SimpleNamespace(type="errored", error=SimpleNamespace(type="api_error"))
+            else:
+                message = SimpleNamespace(
+                    content=[self._content_block(request["params"])],
+                    usage=SimpleNamespace(input_tokens=0, output_tokens=0),
+                )
+                result = SimpleNamespace(type="succeeded", message=message)
+            yield SimpleNamespace(custom_id=request["custom_id"], result=result)
+
+
+class FakeBatchClient:
+    """BatchPredictionRunnerに渡せるクライアント（client.messages.batches を持つ）"""
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], str] = canned_response, polls_until_ended: int = 1,
+                 failed_custom_ids: Optional[List[str]] = None):
+        self.messages = SimpleNamespace(batches=FakeBatches(responder, polls_until_ended, failed_custom_ids))
@@ -0,0 +1,215 @@
+"""
+予想パイプラインのベンチマーク
+FakeAnthropic（ネットワークなし）で、順次・並列・複数レース同時実行のレイテンシと処理量、
+出馬表と応答のパース時間、出走頭数（8〜18頭）に対するプロンプトサイズと所要時間の伸びを測る
+"""
+
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.opinion import EXPERT_OPINION_SCHEMA
+from agents.registry import DEFAULT_EXPERTS
+from agents.structured_output import decode_output
+from batch.fake_batches import canned_response
+from benchmarks.fake_client import FakeAnthropic, FakeAsyncAnthropic, LatencyModel, LATENCY_DISTRIBUTIONS
+from graph.prediction_graph import HorseRacePredictionGraph
+from racecard.parser import parse_race_card, ENTRY_PATTERN, FOOTER_MARKERS
+from racecard.views import render_view
+
+
+FIELD_SIZES = list(range(8, 19, 2))  # 出走頭数のスケーリングで測る頭数
+
+FRAME_COLORS = ["白", "黒", "赤", "青", "黄", "緑", "橙", "桃"]
+
+
+def frame_numbers(field_size: int) -> List[int]:
+    """馬番順の枠番（9頭以上は外枠から順に2頭・3頭になるJRAの枠順）"""
+
+    if field_size <= 8:
+        return list(range(1, field_size + 1))
+    base, extra = divmod(field_size, 8)
+    frames = []
+    for frame in range(1, 9):
+        frames += [frame] * (base + (1 if frame > 8 - extra else 0))
+    return frames
+
+
+def resize_field(race_text: str, field_size: int) -> str:
+    """出馬表の出走馬を field_size 頭に増減したレース情報（足りない分は先頭から繰り返す）"""
+
+    lines = race_text.splitlines()
+    starts = [i for i, line in enumerate(lines) if ENTRY_PATTERN.match(line.rstrip())]
+    if not starts:
+        raise ValueError("出走馬が見つかりません")
+    footer = next((i for i in range(starts[-1], len(lines)) if lines[i].startswith(FOOTER_MARKERS)), len(lines))
+    bounds = starts + [footer]
+    entries = [lines[bounds[i] + 1:bounds[i + 1]] for i in range(len(starts))]
+
+    resized = lines[:starts[0]]
+    for number, frame in enumerate(frame_numbers(field_size), 1):
+        resized.append(f"枠{frame}{FRAME_COLORS[frame - 1]}\t{number}\t")
+        resized += entries[(number - 1) % len(entries)]
+    return "\n".join(resized + lines[footer:])
+
+
+def make_graph(latency: LatencyModel, seed: int = 0, parallel: bool = True,
+               max_concurrent_calls: int = 16) -> HorseRacePredictionGraph:
+    """FakeAnthropic を使う予想グラフ（同期・非同期で呼び出し記録を共有）"""
+
+    client = FakeAnthropic(latency=latency, seed=seed)
+    return HorseRacePredictionGraph(
+        anthropic_client=client,
+        async_anthropic_client=FakeAsyncAnthropic.sharing(client),
+        parallel=parallel,
+        max_concurrent_calls=max_concurrent_calls,
+    )
+
+
+def summarize(latencies: List[float], wall_time: float) -> Dict[str, Any]:
+    """レースごとの所要時間と全体の所要時間から、分位点と処理量（レース/秒）をまとめる"""
+
+    values = np.asarray(latencies, dtype=float)
+    return {
+        "races": len(latencies),
+        "wall_time": round(wall_time, 4),
+        "throughput": round(len(latencies) / wall_time, 3) if wall_time > 0 else None,
+        "latency_mean": round(float(values.mean()), 4),
+        "latency_p50": round(float(np.percentile(values, 50)), 4),
+        "latency_p95": round(float(np.percentile(values, 95)), 4),
+        "latency_max": round(float(values.max()), 4),
+    }
+
+
+def bench_modes(race_text: str, races: int, concurrency: int, latency: LatencyModel,
+                seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    """順次（専門家も直列）・順次（専門家は並列）・複数レース同時実行の比較"""
+
+    race_texts = [resize_field(race_text, FIELD_SIZES[i % len(FIELD_SIZES)]) for i in range(races)]
+    report = {}
+
+    for mode, parallel in (("sequential_serial_experts", False), ("sequential_parallel_experts", True)):
+        graph = make_graph(latency, seed, parallel=parallel)
+        started = time.perf_counter()
+        results = [graph.predict_race(text) for text in race_texts]
+        report[mode] = summarize([r["metrics"]["wall_time"] for r in results], time.perf_counter() - started)
+
+    graph = make_graph(latency, seed)
+    started = time.perf_counter()
+    results = graph.predict_races(race_texts, max_concurrency=concurrency)
+    report["concurrent"] = {
+        **summarize([r["metrics"]["wall_time"] for r in results], time.perf_counter() - started),
+        "max_concurrency": concurrency,
+    }
+    return report
+
+
+def _per_call(function: Callable[[], Any], iterations: int) -> float:
+    """1回あたりの所要時間（マイクロ秒）"""
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return round((time.perf_counter() - started) / iterations * 1e6, 2)
+
+
+def bench_parse(race_text: str, iterations: int = 200) -> Dict[str, float]:
+    """出馬表のパース・ビュー生成と、応答のJSON取り出し・検証の所要時間（マイクロ秒/回）"""
+
+    race = parse_race_card(race_text)
+    tool_json = canned_response({})
+    fenced_text = f"分析結果です。\n```json\n{tool_json[:-1]},\n}}\n```\n以上です。"
+
+    report = {
+        "parse_race_card": _per_call(lambda: parse_race_card(race_text), iterations),
+        "decode_tool_json": _per_call(lambda: decode_output(tool_json, EXPERT_OPINION_SCHEMA), iterations),
+        "decode_fenced_text": _per_call(lambda: decode_output(fenced_text, EXPERT_OPINION_SCHEMA), iterations),
+    }
+    for role in DEFAULT_EXPERTS + ["moderator"]:
+        report[f"render_view_{role}"] = _per_call(lambda: render_view(race, role), iterations)
+    return report
+
+
+def bench_field_sizes(race_text: str, latency: LatencyModel, sizes: Optional[List[int]] = None,
+                      repeat: int = 3, seed: int = 0) -> List[Dict[str, Any]]:
+    """出走頭数ごとのプロンプトサイズ（役割別の入力トークンの概算）と予想1回の所要時間"""
+
+    rows = []
+    for size in sizes or FIELD_SIZES:
+        text = resize_field(race_text, size)
+        graph = make_graph(latency, seed)
+        latencies = []
+        prompt_tokens: Dict[str, int] = {}
+        for _ in range(repeat):
+            metrics = graph.predict_race(text)["metrics"]
+            latencies.append(metrics["wall_time"])
+            for node in metrics["nodes"]:
+                for call in node["calls"]:
+                    prompt_tokens[call["agent"]] = call["prompt_tokens"]
+        rows.append({
+            "field_size": size,
+            "prompt_tokens": prompt_tokens,
+            "total_prompt_tokens": sum(prompt_tokens.values()),
+            "latency_p50": round(float(np.percentile(latencies, 50)), 4),
+            "latency_max": round(max(latencies), 4),
+        })
+    return rows
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print("=== 実行方式 ===")
+    for mode, stats in report["modes"].items():
+        print(f"{mode}: {stats['races']}レース {stats['wall_time']:.2f}秒 "
+              f"{stats['throughput']}レース/秒 p50 {stats['latency_p50']:.3f}秒 p95 {stats['latency_p95']:.3f}秒")
+
+    print("\n=== パース（マイクロ秒/回） ===")
+    for name, micros in report["parse"].items():
+        print(f"{name}: {micros}")
+
+    print("\n=== 出走頭数 ===")
+    for row in report["field_sizes"]:
+        print(f"{row['field_size']}頭: プロンプト計{row['total_prompt_tokens']}トークン "
+              f"p50 {row['latency_p50']:.3f}秒 最大 {row['latency_max']:.3f}秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="予想パイプラインのベンチマーク（ネットワーク不要）")
+    parser.add_argument("--race", default=os.path.join(os.path.dirname(__file__), "../data/race.txt"),
+                        help="基にするレース情報ファイル")
+    parser.add_argument("--races", type=int, default=8, help="実行方式の比較に使うレース数")
+    parser.add_argument("--concurrency", type=int, default=8, help="複数レース同時実行のLLM同時呼び出し数")
+    parser.add_argument("--repeat", type=int, default=3, help="出走頭数ごとの繰り返し回数")
+    parser.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal",
+                        help="応答レイテンシの分布")
+    parser.add_argument("--ttft", type=float, default=0.6, help="最初のトークンまでの時間の基準値（秒）")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="レイテンシ全体の倍率")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    with open(args.race, "r", encoding="utf-8") as f:
+        race_text = f.read()
+
+    latency = LatencyModel(distribution=args.distribution, ttft=args.ttft, time_scale=args.time_scale)
+    report = {
+        "latency_model": vars(latency),
+        "modes": bench_modes(race_text, args.races, args.concurrency, latency, args.seed),
+        "parse": bench_parse(race_text),
+        "field_sizes": bench_field_sizes(race_text, latency, repeat=args.repeat, seed=args.seed),
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
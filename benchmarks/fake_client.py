@@ -0,0 +1,310 @@
+"""
+ネットワークなしで動くAnthropicクライアントの代替
+固定のJSON応答を、指定した分布のレイテンシ（最初のトークンまでの時間・プレフィル・生成）で返す
+（HorseRacePredictionGraph の anthropic_client / async_anthropic_client に渡してベンチマークに使う）
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from collections import defaultdict
+from dataclasses import dataclass
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import anthropic
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch.fake_batches import canned_response
+
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+
+@dataclass
+class LatencyModel:
+    """応答レイテンシの分布
+
+    最初のトークンまでの時間 = 基準値（分布に従ってばらつく）+ 入力トークン数 × per_input_token、
+    生成時間 = 出力トークン数 × per_output_token。全体に time_scale を掛ける
+    """
+    distribution: str = "lognormal"  # constant / uniform / lognormal
+    ttft: float = 0.6  # 最初のトークンまでの時間の基準値（秒、lognormalでは中央値）
+    spread: float = 0.35  # ばらつき（lognormalはσ、uniformは基準値に対する±の割合）
+    per_input_token: float = 0.00005  # 入力1トークンあたりのプレフィル時間（秒）
+    per_output_token: float = 0.012  # 出力1トークンあたりの生成時間（秒）
+    time_scale: float = 1.0  # 全体の倍率（ベンチマークを短時間で回す場合は小さくする）
+
+    def __post_init__(self):
+        if self.distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"distribution は {', '.join(LATENCY_DISTRIBUTIONS)} のいずれかを指定してください")
+
+    def sample(self, rng: random.Random, input_tokens: int, output_tokens: int) -> Tuple[float, float]:
+        """(最初のトークンまでの秒数, 生成の秒数)"""
+
+        if self.distribution == "lognormal":
+            base = self.ttft * math.exp(rng.gauss(0.0, self.spread))
+        elif self.distribution == "uniform":
+            base = self.ttft * rng.uniform(1.0 - self.spread, 1.0 + self.spread)
+        else:
+            base = self.ttft
+        ttft = max(0.0, base) + input_tokens * self.per_input_token
+        return ttft * self.time_scale, output_tokens * self.per_output_token * self.time_scale
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCIIは約4文字、それ以外は約1.2文字で1トークン）"""
+
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 1.2)
+
+
+def _block_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def prompt_text(params: Dict[str, Any]) -> str:
+    """リクエストのうちプロンプトとして送られるテキスト（システム・メッセージ・ツール定義）"""
+
+    parts = [_block_text(params.get("system", ""))]
+    parts += [_block_text(message["content"]) for message in params.get("messages", [])]
+    if params.get("tools"):
+        parts.append(json.dumps(params["tools"], ensure_ascii=False))
+    return "\n".join(parts)
+
+
+def _request_digest(params: Dict[str, Any]) -> str:
+    payload = json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Planned:
+    """1回の呼び出しの応答とレイテンシ"""
+
+    def __init__(self, message: SimpleNamespace, chunks: List[Tuple[str, str]], ttft: float,
+                 generation: float, timeout: Optional[float]):
+        self.message = message
+        self.chunks = chunks  # (イベント種別, 断片)
+        self.ttft = ttft
+        self.chunk_delay = generation / max(1, len(chunks))
+        self.timeout = timeout
+
+    @property
+    def total(self) -> float:
+        return self.ttft + self.chunk_delay * len(self.chunks)
+
+    def exceeds_timeout(self, elapsed: float) -> bool:
+        return self.timeout is not None and elapsed > self.timeout
+
+    @property
+    def timed_out(self) -> bool:
+        return self.exceeds_timeout(self.total)
+
+
+def _timeout_error() -> anthropic.APITimeoutError:
+    return anthropic.APITimeoutError(request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+
+
+class FakeMessages:
+    """messages の代替（create / stream）
+
+    乱数はシードとリクエスト内容から決まるため、同時実行の順序によらず同じリクエストには同じ応答時間を返す
+    """
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], str], latency: LatencyModel, seed: int,
+                 chunk_size: int):
+        self.responder = responder
+        self.latency = latency
+        self.seed = seed
+        self.chunk_size = chunk_size  # ストリーミングの1断片の文字数
+        self.calls: List[Dict[str, Any]] = []  # 受け取ったリクエスト
+        self._counts: Dict[str, itertools.count] = defaultdict(itertools.count)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _plan(self, params: Dict[str, Any]) -> _Planned:
+        timeout = params.pop("timeout", None)
+        digest = _request_digest(params)
+        with self._lock:
+            self.calls.append(params)
+            repeat = next(self._counts[digest])  # 同じリクエストの何回目か
+            message_id = f"msg_fake_{next(self._ids):06d}"
+        rng = random.Random(f"{self.seed}:{digest}:{repeat}")
+
+        text = self.responder(params)
+        tool = (params.get("tool_choice") or {}).get("name")
+        if tool is None:
+            block = SimpleNamespace(type="text", text=text)
+            kind, stop_reason = "text", "end_turn"
+        else:
+            block = SimpleNamespace(type="tool_use", id=f"toolu_fake_{message_id[9:]}", name=tool,
+                                    input=json.loads(text))
+            kind, stop_reason = "input_json", "tool_use"
+
+        input_tokens = estimate_tokens(prompt_text(params))
+        output_tokens = estimate_tokens(text)
+        message = SimpleNamespace(
+            id=message_id,
+            type="message",
+            role="assistant",
+            model=params.get("model"),
+            content=[block],
+            stop_reason=stop_reason,
+            usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens,
+                                  cache_read_input_tokens=0, cache_creation_input_tokens=0),
+        )
+        chunks = [(kind, text[i:i + self.chunk_size]) for i in range(0, len(text), self.chunk_size)]
+        ttft, generation = self.latency.sample(rng, input_tokens, output_tokens)
+        return _Planned(message, chunks, ttft, generation, timeout)
+
+    def create(self, **params: Any) -> SimpleNamespace:
+        planned = self._plan(params)
+        if planned.timed_out:
+            time.sleep(planned.timeout)
+            raise _timeout_error()
+        time.sleep(planned.total)
+        return planned.message
+
+    def stream(self, **params: Any) -> "FakeStream":
+        return FakeStream(self._plan(params))
+
+
+def _event(kind: str, text: str) -> SimpleNamespace:
+    if kind == "input_json":
+        return SimpleNamespace(type="input_json", partial_json=text)
+    return SimpleNamespace(type="text", text=text)
+
+
+class FakeStream:
+    """messages.stream の代替（イベントの反復と get_final_message）"""
+
+    def __init__(self, planned: _Planned):
+        self._planned = planned
+
+    def __enter__(self) -> "FakeStream":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+    def __iter__(self) -> Iterator[SimpleNamespace]:
+        planned = self._planned
+        elapsed = planned.ttft
+        if planned.exceeds_timeout(elapsed):
+            time.sleep(planned.timeout)
+            raise _timeout_error()
+        time.sleep(planned.ttft)
+        for kind, text in planned.chunks:
+            yield _event(kind, text)
+            elapsed += planned.chunk_delay
+            if planned.exceeds_timeout(elapsed):
+                raise _timeout_error()
+            time.sleep(planned.chunk_delay)
+
+    def get_final_message(self) -> SimpleNamespace:
+        return self._planned.message
+
+
+class FakeAsyncMessages:
+    """messages の代替（非同期版）"""
+
+    def __init__(self, messages: FakeMessages):
+        self._messages = messages
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        return self._messages.calls
+
+    async def create(self, **params: Any) -> SimpleNamespace:
+        planned = self._messages._plan(params)
+        if planned.timed_out:
+            await asyncio.sleep(planned.timeout)
+            raise _timeout_error()
+        await asyncio.sleep(planned.total)
+        return planned.message
+
+    def stream(self, **params: Any) -> "FakeAsyncStream":
+        return FakeAsyncStream(self._messages._plan(params))
+
+
+class FakeAsyncStream:
+    """messages.stream の代替（非同期版）"""
+
+    def __init__(self, planned: _Planned):
+        self._planned = planned
+
+    async def __aenter__(self) -> "FakeAsyncStream":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> bool:
+        return False
+
+    async def __aiter__(self):
+        planned = self._planned
+        elapsed = planned.ttft
+        if planned.exceeds_timeout(elapsed):
+            await asyncio.sleep(planned.timeout)
+            raise _timeout_error()
+        await asyncio.sleep(planned.ttft)
+        for kind, text in planned.chunks:
+            yield _event(kind, text)
+            elapsed += planned.chunk_delay
+            if planned.exceeds_timeout(elapsed):
+                raise _timeout_error()
+            await asyncio.sleep(planned.chunk_delay)
+
+    async def get_final_message(self) -> SimpleNamespace:
+        return self._planned.message
+
+
+class FakeAnthropic:
+    """Anthropic の代替（client.messages.create / stream）
+
+    responder はリクエストを受け取って応答のJSONテキストを返す関数（既定は固定応答）。
+    試行のタイムアウトより応答時間が長い場合は APITimeoutError を送出する
+    """
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], str] = canned_response,
+                 latency: Optional[LatencyModel] = None, seed: int = 0, chunk_size: int = 16):
+        self.latency = latency or LatencyModel()
+        self.messages = FakeMessages(responder, self.latency, seed, chunk_size)
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        return self.messages.calls
+
+
+class FakeAsyncAnthropic:
+    """AsyncAnthropic の代替
+
+    同期版と応答・乱数を共有する場合は FakeAsyncAnthropic.sharing(client) を使う
+    """
+
+    def __init__(self, responder: Callable[[Dict[str, Any]], str] = canned_response,
+                 latency: Optional[LatencyModel] = None, seed: int = 0, chunk_size: int = 16):
+        self.latency = latency or LatencyModel()
+        self.messages = FakeAsyncMessages(FakeMessages(responder, self.latency, seed, chunk_size))
+
+    @classmethod
+    def sharing(cls, client: FakeAnthropic) -> "FakeAsyncAnthropic":
+        """同期版の FakeAnthropic と呼び出し記録を共有する非同期クライアント"""
+
+        async_client = cls.__new__(cls)
+        async_client.latency = client.latency
+        async_client.messages = FakeAsyncMessages(client.messages)
+        return async_client
+
+    @property
+    def calls(self) -> List[Dict[str, Any]]:
+        return self.messages.calls
@@ -0,0 +1,99 @@
+"""
+専門家の討議
+推奨が多数派から外れた専門家だけが他の専門家の意見を受けて推奨を見直す（反論の機会）
+ラウンド数の上限・トークン予算・推奨の一致度が変わらなくなった時点のいずれかで打ち切る
+"""
+
+from typing import Any, Dict, List, Optional, Set
+from dataclasses import dataclass
+import itertools
+import math
+
+from agents.moderator import format_vote_aggregate, format_rationales
+from agents.opinion import ExpertOpinion
+
+
+# 討議を打ち切った理由
+STOP_AGREED = "合意"  # 多数派から外れた専門家がいない
+STOP_MAX_ROUNDS = "上限"  # ラウンド数の上限
+STOP_BUDGET = "予算"  # トークン予算を使い切った（次のラウンドで超える見込み）
+STOP_CONVERGED = "収束"  # 推奨の一致度が変わらなくなった
+
+
+@dataclass
+class DebateConfig:
+    """討議の設定"""
+    max_rounds: int = 2  # ラウンド数の上限
+    token_budget: int = 30000  # 1レースの討議で使うトークン数の上限（入力・出力の合計）
+    min_agreement_change: float = 0.02  # 一致度の変化がこれ未満になったら打ち切る
+    consensus_share: float = 0.5  # この割合以上の専門家が推す馬を多数派の推奨とする（最低2人）
+
+    def __post_init__(self):
+        if not 1 <= self.max_rounds <= 5:
+            raise ValueError("max_rounds は1から5で指定してください")
+        if self.token_budget < 1:
+            raise ValueError("token_budget は1以上を指定してください")
+
+
+def _voters(opinions: Dict[str, ExpertOpinion]) -> Dict[str, Set[int]]:
+    """推奨馬を出した専門家の推奨（分析に失敗して推奨がない専門家は討議に参加しない）"""
+    return {key: set(opinion.recommended_horses) for key, opinion in opinions.items() if opinion.recommended_horses}
+
+
+def consensus_horses(opinions: Dict[str, ExpertOpinion], config: DebateConfig) -> Set[int]:
+    """多数派の推奨（consensus_share 以上・最低2人の専門家が推す馬）"""
+
+    voters = _voters(opinions)
+    required = max(2, math.ceil(config.consensus_share * len(voters)))
+    counts: Dict[int, int] = {}
+    for picks in voters.values():
+        for number in picks:
+            counts[number] = counts.get(number, 0) + 1
+    return {number for number, count in counts.items() if count >= required}
+
+
+def divergent_experts(opinions: Dict[str, ExpertOpinion], config: DebateConfig) -> List[str]:
+    """多数派の推奨と1頭も重ならない専門家（多数派がいなければ推奨を出した全員）"""
+
+    consensus = consensus_horses(opinions, config)
+    return [key for key, picks in _voters(opinions).items() if not picks & consensus]
+
+
+def vote_agreement(opinions: Dict[str, ExpertOpinion]) -> float:
+    """推奨の一致度（専門家の組ごとの推奨馬の重なり（Jaccard係数）の平均、0.0-1.0）"""
+
+    pairs = list(itertools.combinations(_voters(opinions).values(), 2))
+    if not pairs:
+        return 1.0
+    return sum(len(a & b) / len(a | b) for a, b in pairs) / len(pairs)
+
+
+def stop_reason(debate: Dict[str, Any], divergent: List[str], config: DebateConfig) -> Optional[str]:
+    """次のラウンドに進まない理由（進む場合はNone）"""
+
+    if not divergent:
+        return STOP_AGREED
+    if debate["rounds"] >= config.max_rounds:
+        return STOP_MAX_ROUNDS
+    # 1ターンの平均トークン数から、次のラウンドで予算を超える見込みなら始めない
+    per_turn = debate["tokens"] / debate["turns"] if debate["turns"] else 0
+    if debate["tokens"] + per_turn * len(divergent) > config.token_budget:
+        return STOP_BUDGET
+    agreement = debate["agreement"]
+    if len(agreement) >= 2 and abs(agreement[-1] - agreement[-2]) < config.min_agreement_change:
+        return STOP_CONVERGED
+    return None
+
+
+def discussion_context(key: str, opinions: Dict[str, ExpertOpinion], consensus: Set[int],
+                       labels: Dict[str, str], short_labels: Dict[str, str]) -> str:
+    """反論する専門家に渡す他の専門家の意見（モデレーターと同じ上限付きの集計表と短い根拠）"""
+
+    others = {other: opinion for other, opinion in opinions.items() if other != key}
+    return f"""多数派の推奨: {sorted(consensus) if consensus else "なし（推奨が割れています）"}
+
+他の専門家の推奨の集計（推奨数の多い順、確信度は推奨した専門家のもの）：
+{format_vote_aggregate(others, short_labels)}
+
+他の専門家の推奨と根拠：
+{format_rationales(others, labels)}"""
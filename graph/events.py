@@ -0,0 +1,38 @@
+"""
+ストリーミング予想のイベント
+HorseRacePredictionGraph.stream_race / astream_race が発生順に返す
+（role は専門家キーまたは "moderator"）
+"""
+
+from typing import Any, Dict, Union
+from dataclasses import dataclass
+
+
+@dataclass
+class ExpertStarted:
+    """専門家（総合判断専門家を含む）がLLM呼び出しを開始した"""
+    role: str  # 専門家キー / "moderator"
+
+
+@dataclass
+class TextDelta:
+    """応答テキストの断片が届いた"""
+    role: str  # 専門家キー / "moderator"
+    text: str  # テキスト断片
+
+
+@dataclass
+class ExpertDone:
+    """専門家の分析が完了した"""
+    role: str  # 専門家キー
+    opinion: Any  # パース済みの ExpertOpinion
+    text: str  # モデレーターに渡す意見テキスト
+
+
+@dataclass
+class JudgmentDone:
+    """総合判断が完了した（レースの予想はここで終わり）"""
+    result: Dict[str, Any]  # predict_race と同じ形式の結果
+
+
+PredictionEvent = Union[ExpertStarted, TextDelta, ExpertDone, JudgmentDone]
@@ -0,0 +1,129 @@
+"""
+オッズ更新時の差分予想
+専門家の分析をレースごとに保持し、オッズ・人気だけが動いた場合は総合判断だけをやり直す
+（出走取消や乗り替わりなど出走馬が変わった場合は専門家の分析から再実行する）
+"""
+
+from typing import Any, Dict, Optional, Tuple
+from dataclasses import dataclass
+import copy
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.opinion import ExpertOpinion
+from instrumentation.metrics import RaceMetrics
+from graph.prediction_graph import HorseRacePredictionGraph, judgment_to_dict, recommendation_to_dict
+from pricing.ev_engine import ExpertVote
+from racecard.models import Race
+from racecard.parser import parse_race_card
+from racecard.diff import UNCHANGED, ODDS_ONLY, FIELD_CHANGED, race_key, race_label, classify_change
+
+
+# オッズのみ変更時の再判断方法
+REJUDGE_MODERATOR = "moderator"  # 総合判断専門家だけを再実行（LLM呼び出し1回）
+REJUDGE_LOCAL = "local"  # 前回の専門家の推奨と信頼度から期待値を新オッズで再計算（LLM呼び出しなし）
+
+
+@dataclass
+class RaceSnapshot:
+    """前回予想時のレースの状態"""
+    race: Race  # 前回の出馬表
+    result: Dict[str, Any]  # 前回の予想結果
+
+
+class IncrementalPredictor:
+    """出馬表の変更内容に応じて必要な部分だけを再予想する"""
+
+    def __init__(self, graph: HorseRacePredictionGraph, odds_rejudge: str = REJUDGE_MODERATOR):
+        if odds_rejudge not in (REJUDGE_MODERATOR, REJUDGE_LOCAL):
+            raise ValueError(f"odds_rejudge は {REJUDGE_MODERATOR} か {REJUDGE_LOCAL} を指定してください")
+        self.graph = graph
+        self.odds_rejudge = odds_rejudge
+        self._snapshots: Dict[Tuple, RaceSnapshot] = {}
+
+    def invalidate(self, race_info: Optional[str] = None) -> None:
+        """保持している専門家の分析を破棄（Noneなら全レース）"""
+
+        if race_info is None:
+            self._snapshots.clear()
+            return
+        try:
+            self._snapshots.pop(race_key(parse_race_card(race_info)), None)
+        except ValueError:
+            pass
+
+    def refresh(self, race_info: str) -> Dict[str, Any]:
+        """最新の出馬表で予想を更新
+
+        結果は predict_race と同じ形式で、"update" に実行内容（full / odds / unchanged）が入る
+        """
+
+        try:
+            race = parse_race_card(race_info)
+        except ValueError:
+            # 構造化できないレース情報は差分を判定できないため毎回フルで予想する
+            return {**self.graph.predict_race(race_info), "update": "full"}
+
+        snapshot = self._snapshots.get(race_key(race))
+        change = FIELD_CHANGED if snapshot is None else classify_change(snapshot.race, race)
+        if change == ODDS_ONLY and snapshot.result["final_judgment"] is None:
+            # 絞り込みで見送ったレースは専門家の分析がないため、新しいオッズで絞り込みからやり直す
+            change = FIELD_CHANGED
+
+        if change == UNCHANGED:
+            result = snapshot.result
+        elif change == ODDS_ONLY:
+            result = self._rejudge(snapshot, race, race_info)
+        else:
+            result = self.graph.predict_race(race_info)
+
+        self._snapshots[race_key(race)] = RaceSnapshot(race=race, result=result)
+        return {**result, "update": "full" if change == FIELD_CHANGED else change}
+
+    def _rejudge(self, snapshot: RaceSnapshot, race: Race, race_info: str) -> Dict[str, Any]:
+        """オッズのみ変更時の再判断（専門家の分析は前回のものを使う）
+
+        結果は predict_race と同じく計測レポートを付け、ストアがあれば予想を保存する
+        """
+
+        metrics = RaceMetrics(race_label(race))
+        if self.odds_rejudge == REJUDGE_LOCAL:
+            final_judgment = self._reprice(snapshot.result, race)
+        else:
+            # モデレーターに渡すのは推奨・確信度・根拠だけのため、前回の expert_votes から復元できる
+            votes = snapshot.result["expert_votes"]
+            opinions = {key: ExpertOpinion.from_vote(votes[key]) for key in self.graph.expert_keys if key in votes}
+            with metrics.node("make_judgment"):
+                judgment = self.graph.moderator.make_final_judgment(self.graph.moderator_view(race), opinions)
+            # 勝率・期待値・賭け金はフル予想と同じくローカルで計算する
+            final_judgment = judgment_to_dict(self.graph.apply_pricing(race, opinions, judgment))
+
+        result = {
+            "race_info": race_info,
+            "expert_opinions": snapshot.result["expert_opinions"],
+            "expert_votes": snapshot.result["expert_votes"],
+            "final_judgment": final_judgment,
+        }
+        return self.graph.finish_result(result, metrics, race)
+
+    def _reprice(self, previous: Dict[str, Any], race: Race) -> Dict[str, Any]:
+        """前回の専門家の推奨・確信度とモデレーターの信頼度を据え置き、新しいオッズで期待値と賭け金を再計算"""
+
+        final_judgment = copy.deepcopy(previous["final_judgment"])
+        votes = {
+            key: ExpertVote(recommended_horses=vote["recommended_horses"], confidence=vote["confidence"])
+            for key, vote in previous["expert_votes"].items()
+        }
+        pricing = self.graph.pricing
+        priced = pricing.price(
+            [entry.number for entry in race.entries],
+            [entry.win_odds for entry in race.entries],
+            votes,
+            final_judgment["expert_reliability"],
+        )
+        final_judgment["recommendations"] = [
+            recommendation_to_dict(rec) for rec in pricing.recommendations(priced)
+        ]
+        return final_judgment
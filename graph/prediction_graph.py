@@ -1,16 +1,24 @@
 """
 LangGraphを使った競馬予想対話システム
-3人の専門家が議論して最終的な投資判断を下す
+登録された専門家（agents/registry.py）が並列に分析し、総合判断専門家が最終的な投資判断を下す
 """
 
-from typing import Dict, List, Any, Optional
-from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Annotated, Callable, Iterable, Iterator, AsyncIterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import argparse
+import asyncio
+import contextvars
+import itertools
 import json
 import os
 from dotenv import load_dotenv
-from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import StreamWriter
 from langgraph.graph.state import CompiledStateGraph
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -18,172 +26,673 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
-from agents.race_expert import RaceExpert
-from agents.jockey_expert import JockeyExpert
-from agents.contrarian_expert import ContrarianExpert
+from agents.ensemble import SelfConsistencySampler, SamplingConfig
 from agents.moderator import Moderator
+from agents.registry import expert_specs, expert_label, load_plugins
+from agents.response_cache import ResponseCache
+from agents.model_config import load_model_configs
+from agents.client_pool import pooled_client
+from agents.retry import RetryPolicy, ConcurrencyLimiter
+from backtest.store import ResultsStore
+from pricing.ev_engine import PricingEngine, ExpertVote
+from pricing.prescreen import Prescreener, ScreenConfig
+from racecard.entities import EntityCache
+from racecard.models import Race
+from racecard.parser import parse_race_card
+from racecard.diff import race_label
+from racecard.views import EXPERT_VIEWS, render_view
+from racecard.loader import RaceText, expand_inputs, iter_races
+from instrumentation.metrics import RaceMetrics
+from graph.debate import DebateConfig, consensus_horses, discussion_context, divergent_experts, stop_reason, vote_agreement
+from graph.events import ExpertStarted, TextDelta, ExpertDone, JudgmentDone, PredictionEvent
+
+
+def merge_expert_opinions(left: Optional[Dict[str, Any]], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """並列ノードからの専門家意見を専門家キーでマージするリデューサー"""
+    merged = dict(left or {})
+    merged.update(right or {})
+    return merged
+
+
+def format_expert_opinion(key: str, opinion) -> str:
+    """専門家の意見を表示・出力用のテキストにする"""
+    return f"【{expert_label(key)}】\n{opinion.analysis}\n推奨馬: {opinion.recommended_horses}\n確信度: {opinion.confidence:.2f}\n根拠: {opinion.reasoning}"
+
+
+def vote_to_dict(opinion) -> Dict[str, Any]:
+    """専門家の推奨・確信度・根拠を辞書形式に変換（オッズ更新時の再判断で ExpertOpinion に戻す）
+    
+    自己一貫性サンプリングをした場合は試行数と得票率も付ける
+    """
+    vote = {
+        "recommended_horses": opinion.recommended_horses,
+        "confidence": opinion.confidence,
+        "reasoning": opinion.reasoning
+    }
+    if opinion.samples > 1:
+        vote["samples"] = opinion.samples
+        vote["vote_distribution"] = opinion.vote_distribution
+    return vote
+
+
+def recommendation_to_dict(rec) -> Dict[str, Any]:
+    """ベッティング推奨を辞書形式に変換"""
+    return {
+        "horse_number": rec.horse_number,
+        "win_odds": rec.win_odds,
+        "expected_value": rec.expected_value,
+        "bet_amount": rec.bet_amount,
+        "confidence": rec.confidence,
+        "edge_score": rec.edge_score,
+        "win_probability": rec.win_probability
+    }
+
+
+def judgment_to_dict(final_judgment) -> Dict[str, Any]:
+    """最終判断を辞書形式に変換"""
+    return {
+        "consensus_analysis": final_judgment.consensus_analysis,
+        "minority_opinions": final_judgment.minority_opinions,
+        "expert_reliability": final_judgment.expert_reliability,
+        "summary": final_judgment.summary,
+        "recommendations": [recommendation_to_dict(rec) for rec in final_judgment.recommendations],
+        "reasoning": final_judgment.reasoning,
+        "risk_assessment": final_judgment.risk_assessment
+    }
 
 
 @dataclass
 class PredictionState:
     """予想システムの状態"""
     race_info: str  # レース情報
-    pace_expert_analysis: Optional[str] = None  # 展開予想専門家の分析
-    jockey_expert_analysis: Optional[str] = None  # 騎手専門家の分析
-    contrarian_expert_analysis: Optional[str] = None  # 穴狙い専門家の分析
-    expert_opinions: List[str] = None  # 専門家意見リスト
+    race: Optional[Race] = None  # 構造化した出馬表（解析できない場合はNone）
+    expert_results: Annotated[Dict[str, Any], merge_expert_opinions] = field(default_factory=dict)  # 専門家キー -> ExpertOpinion
+    debate: Dict[str, Any] = field(default_factory=dict)  # 討議の経過（ラウンド数・トークン数・一致度の推移・打ち切り理由）
     final_judgment: Optional[Dict] = None  # 最終判断
     is_complete: bool = False  # 完了フラグ
-    
-    def __post_init__(self):
-        if self.expert_opinions is None:
-            self.expert_opinions = []
 
 
 class HorseRacePredictionGraph:
     """競馬予想対話グラフ"""
     
-    def __init__(self, anthropic_client: Optional[Anthropic] = None):
-        self.client = anthropic_client or Anthropic()
-        self.pace_expert = RaceExpert(self.client)
-        self.jockey_expert = JockeyExpert(self.client)
-        self.contrarian_expert = ContrarianExpert(self.client)
-        self.moderator = Moderator(self.client)
+    def __init__(self, anthropic_client: Optional[Anthropic] = None, parallel: bool = True,
+                 async_anthropic_client: Optional[AsyncAnthropic] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 pricing_engine: Optional[PricingEngine] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 max_concurrent_calls: int = 16,
+                 exporters: Optional[List[Any]] = None,
+                 results_store: Optional[ResultsStore] = None,
+                 entity_cache: Optional[EntityCache] = None,
+                 prescreener: Optional[Prescreener] = None,
+                 model_configs: Optional[Dict[str, Dict[str, Any]]] = None,
+                 experts: Optional[List[str]] = None,
+                 debate: Optional[DebateConfig] = None,
+                 sampling: Optional[SamplingConfig] = None):
+        # クライアントは全エージェントで共有する（未指定ならプロセス共通のコネクションプール）
+        # （非同期クライアントが未指定の場合は、実行中のイベントループごとの共有クライアントを使う）
+        self.client = anthropic_client or pooled_client()
+        self.async_client = async_anthropic_client
+        self.parallel = parallel  # Trueなら専門家を並列実行
+        self.response_cache = response_cache  # 応答のディスクキャッシュ（Noneなら使わない）
+        self.pricing = pricing_engine or PricingEngine()  # 期待値・賭け金の計算
+        self.retry_policy = retry_policy or RetryPolicy()  # 一時的なエラーの再試行とタイムアウト
+        self.limiter = ConcurrencyLimiter(max_concurrent_calls)  # 全エージェント共通のLLM同時呼び出し数の上限
+        self.exporters = list(exporters or [])  # 計測レポートの出力先（JsonlExporter / OpenMetricsExporter）
+        self.results_store = results_store  # 予想を保存するストア（バックテスト用、Noneなら保存しない）
+        self.entity_cache = entity_cache  # 騎手・調教師・父の成績キャッシュ（Noneなら成績表を渡さない）
+        self.prescreener = prescreener  # 予想前の絞り込み（Noneなら全レースを専門家が分析）
+        self.debate = debate  # 専門家の討議の設定（Noneなら討議なし）
+        # 専門家ごとの自己一貫性サンプリング（Noneなら1回の分析）
+        self.sampler = SelfConsistencySampler(sampling) if sampling is not None else None
+        
+        # 使う専門家（専門家キーの並び、Noneなら既定の専門家）。結果はこの順序で並べる
+        self.expert_specs = expert_specs(experts)
+        self.expert_keys = [spec.key for spec in self.expert_specs]
+        
+        # 専門家ごとの出馬表のビュー（登録時に指定がなければ racecard.views の同じキーのビュー）
+        self.views = dict(EXPERT_VIEWS)
+        self.views.update({spec.key: spec.view for spec in self.expert_specs if spec.view is not None})
+        
+        # エージェントごとのモデル設定（役割キー -> 上書きする項目、省略した項目は各エージェントの既定値）
+        model_configs = model_configs or {}
+        unknown = set(model_configs) - set(self.expert_keys + ["moderator"])
+        if unknown:
+            raise ValueError(f"未知のエージェントです: {', '.join(sorted(unknown))}")
+        agent_options = (self.client, self.async_client, response_cache, self.retry_policy, self.limiter)
         
-        # グラフの構築
+        def config(agent_class, key: str):
+            return agent_class.default_model_config.merged(model_configs.get(key, {}))
+        
+        self.experts = {
+            spec.key: spec.agent_class(*agent_options, config(spec.agent_class, spec.key))
+            for spec in self.expert_specs
+        }
+        self.moderator = Moderator(*agent_options, config(Moderator, "moderator"), experts=self.expert_specs)
+        
+        # グラフの構築（同期版・非同期版）
         self.graph = self._build_graph()
+        self.async_graph = self._build_graph(asynchronous=True)
     
-    def _build_graph(self) -> CompiledStateGraph:
+    def _build_graph(self, asynchronous: bool = False) -> CompiledStateGraph:
         """LangGraphを構築"""
         
         workflow = StateGraph(PredictionState)
         
-        # ノードの追加
-        workflow.add_node("pace_analysis", self._pace_expert_analysis)
-        workflow.add_node("jockey_analysis", self._jockey_expert_analysis)
-        workflow.add_node("contrarian_analysis", self._contrarian_expert_analysis)
-        workflow.add_node("make_judgment", self._final_judgment)
-        
-        # エッジの設定（順次実行・討議なし）
-        workflow.set_entry_point("pace_analysis")
-        workflow.add_edge("pace_analysis", "jockey_analysis")
-        workflow.add_edge("jockey_analysis", "contrarian_analysis")
-        workflow.add_edge("contrarian_analysis", "make_judgment")
+        # ノードの追加（専門家ごとのノードは登録内容から作る）
+        expert_nodes = []
+        for spec in self.expert_specs:
+            workflow.add_node(spec.node, self._expert_node(spec.key, spec.node, asynchronous))
+            expert_nodes.append(spec.node)
+        workflow.add_node("make_judgment", self._afinal_judgment if asynchronous else self._final_judgment)
+        
+        # 討議する場合は専門家の分析の後に討議のループを挟む
+        after_experts = "make_judgment"
+        if self.debate is not None:
+            workflow.add_node("debate", self._adebate if asynchronous else self._debate)
+            workflow.add_conditional_edges("debate", self._debate_route, ["debate", "make_judgment"])
+            after_experts = "debate"
+        
+        if self.parallel:
+            # エッジの設定（並列実行）
+            # 専門家は互いの意見を参照しないため、同時に実行して最も遅い専門家の完了を待つ
+            for node in expert_nodes:
+                workflow.add_edge(START, node)
+            workflow.add_edge(expert_nodes, after_experts)
+        else:
+            # エッジの設定（順次実行）
+            workflow.set_entry_point(expert_nodes[0])
+            for current, following in zip(expert_nodes, expert_nodes[1:]):
+                workflow.add_edge(current, following)
+            workflow.add_edge(expert_nodes[-1], after_experts)
         workflow.add_edge("make_judgment", END)
         
         return workflow.compile()
     
-    def _pace_expert_analysis(self, state: PredictionState) -> PredictionState:
-        """展開予想専門家の初期分析"""
+    @staticmethod
+    def _expert_update(key: str, opinion) -> Dict[str, Any]:
+        """専門家の意見の状態更新を作る"""
+        
+        # 並列実行時に他ノードと書き込みが衝突しないよう、自分の担当キーのみ更新する
+        return {"expert_results": {key: opinion}}
+    
+    def _ordered_opinions(self, expert_results: Dict[str, Any]) -> Dict[str, Any]:
+        """専門家の意見を設定した専門家の順に並べる（完了順に関係なくモデレーターへの入力を揃える）"""
+        return {key: expert_results[key] for key in self.expert_keys if key in expert_results}
+    
+    @staticmethod
+    def _judgment_update(final_judgment) -> Dict[str, Any]:
+        """最終判断を辞書形式に変換して状態更新を作る"""
+        
+        return {
+            "final_judgment": judgment_to_dict(final_judgment),
+            "is_complete": True
+        }
+    
+    def apply_pricing(self, race: Optional[Race], expert_results: Dict[str, Any], final_judgment):
+        """専門家の推奨・確信度とモデレーターの信頼度から、期待値・賭け金をローカルで計算して推奨を作る
+        
+        オッズが分からない（出馬表を構造化できない）場合は最終判断をそのまま返す
+        """
+        
+        if race is None:
+            return final_judgment
+        
+        votes = {
+            key: ExpertVote(recommended_horses=opinion.recommended_horses, confidence=opinion.confidence)
+            for key, opinion in expert_results.items()
+        }
+        priced = self.pricing.price(
+            [entry.number for entry in race.entries],
+            [entry.win_odds for entry in race.entries],
+            votes,
+            final_judgment.expert_reliability
+        )
+        final_judgment.recommendations = self.pricing.recommendations(priced)
+        return final_judgment
+    
+    @staticmethod
+    async def _limited(config: Optional[RunnableConfig], coro):
+        """全体の同時実行数セマフォの範囲内でLLM呼び出しを実行"""
+        
+        semaphore = (config or {}).get("configurable", {}).get("semaphore")
+        if semaphore is None:
+            return await coro
+        async with semaphore:
+            return await coro
+    
+    @staticmethod
+    def _text_callback(config: Optional[RunnableConfig], writer: StreamWriter,
+                       role: str) -> Optional[Callable[[str], None]]:
+        """ストリーミング実行時のみ開始イベントを送り、テキスト断片をイベントとして流すコールバックを返す"""
+        
+        if not (config or {}).get("configurable", {}).get("stream_tokens"):
+            return None
+        writer(ExpertStarted(role=role))
+        return lambda text: writer(TextDelta(role=role, text=text))
+    
+    @staticmethod
+    def _measure(config: Optional[RunnableConfig], node: str):
+        """ノードの所要時間とノード内のLLM呼び出しを計測（計測しない実行では何もしない）"""
         
-        opinion = self.pace_expert.analyze_race(state.race_info)
-        analysis_text = f"【展開予想専門家】\n{opinion.analysis}\n推奨馬: {opinion.recommended_horses}\n確信度: {opinion.confidence:.2f}\n根拠: {opinion.reasoning}"
+        metrics = (config or {}).get("configurable", {}).get("metrics")
+        return metrics.node(node) if metrics is not None else nullcontext()
+    
+    def _expert_node(self, key: str, node: str, asynchronous: bool = False) -> Callable:
+        """専門家の分析ノード（同期版・非同期版）を作る"""
+        
+        expert = self.experts[key]
+        
+        # サンプリング時は複数の試行の応答が混ざるため、ストリーミングでは開始と完了だけを流す
         
-        state.pace_expert_analysis = analysis_text
-        state.expert_opinions.append(analysis_text)
+        def analyze(state: PredictionState, config: RunnableConfig, writer: StreamWriter) -> Dict[str, Any]:
+            with self._measure(config, node):
+                on_text = self._text_callback(config, writer, key)
+                if self.sampler is not None:
+                    opinion = self.sampler.sample(expert, self._race_view(state, key))
+                else:
+                    opinion = expert.analyze_race(self._race_view(state, key), on_text)
+                return self._expert_update(key, opinion)
         
-        return state
+        async def aanalyze(state: PredictionState, config: RunnableConfig, writer: StreamWriter) -> Dict[str, Any]:
+            with self._measure(config, node):
+                on_text = self._text_callback(config, writer, key)
+                if self.sampler is not None:
+                    opinion = await self.sampler.asample(
+                        expert, self._race_view(state, key), lambda coro: self._limited(config, coro)
+                    )
+                else:
+                    opinion = await self._limited(config, expert.aanalyze_race(self._race_view(state, key), on_text))
+                return self._expert_update(key, opinion)
+        
+        return aanalyze if asynchronous else analyze
     
-    def _jockey_expert_analysis(self, state: PredictionState) -> PredictionState:
-        """騎手専門家の初期分析"""
+    def _debate_plan(self, state: PredictionState) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """討議の経過と、このラウンドで反論する専門家ごとの他の専門家の意見（打ち切る場合は空）"""
+        
+        opinions = self._ordered_opinions(state.expert_results)
+        if state.debate:
+            debate = {**state.debate, "agreement": list(state.debate["agreement"]), "revised": list(state.debate["revised"])}
+        else:
+            debate = {"rounds": 0, "turns": 0, "tokens": 0, "agreement": [round(vote_agreement(opinions), 4)], "revised": []}
         
-        opinion = self.jockey_expert.analyze_race(state.race_info)
-        analysis_text = f"【騎手専門家】\n{opinion.analysis}\n推奨馬: {opinion.recommended_horses}\n確信度: {opinion.confidence:.2f}\n根拠: {opinion.reasoning}"
+        divergent = divergent_experts(opinions, self.debate)
+        stopped = stop_reason(debate, divergent, self.debate)
+        if stopped is not None:
+            debate["stopped"] = stopped
+            return debate, {}
+        consensus = consensus_horses(opinions, self.debate)
+        return debate, {
+            key: discussion_context(key, opinions, consensus, self.moderator.labels, self.moderator.short_labels)
+            for key in divergent
+        }
+    
+    @staticmethod
+    def _debate_node(config: Optional[RunnableConfig], debate: Dict[str, Any]):
+        """討議のラウンドを計測（トークン予算の集計に使うため、計測しない実行でも記録する）"""
         
-        state.jockey_expert_analysis = analysis_text
-        state.expert_opinions.append(analysis_text)
+        metrics = (config or {}).get("configurable", {}).get("metrics") or RaceMetrics()
+        return metrics.node(f"debate_{debate['rounds'] + 1}")
+    
+    def _debate_update(self, state: PredictionState, debate: Dict[str, Any], revised: Dict[str, Any],
+                       record) -> Dict[str, Any]:
+        """ラウンドの結果（見直した意見・使ったトークン数・一致度）の状態更新を作る"""
         
-        return state
+        debate["rounds"] += 1
+        debate["turns"] += len(revised)
+        debate["tokens"] += sum(call.prompt_tokens + call.output_tokens for call in record.calls)
+        debate["agreement"].append(round(vote_agreement(self._ordered_opinions({**state.expert_results, **revised})), 4))
+        debate["revised"].append({
+            key: {"before": state.expert_results[key].recommended_horses, "after": opinion.recommended_horses}
+            for key, opinion in revised.items()
+        })
+        return {"expert_results": revised, "debate": debate}
     
-    def _contrarian_expert_analysis(self, state: PredictionState) -> PredictionState:
-        """穴狙い専門家の分析"""
+    def _debate(self, state: PredictionState, config: RunnableConfig, writer: StreamWriter) -> Dict[str, Any]:
+        """討議の1ラウンド（多数派から外れた専門家だけが並列に推奨を見直す）"""
         
-        opinion = self.contrarian_expert.analyze_race(state.race_info)
-        analysis_text = f"【穴狙い専門家】\n{opinion.analysis}\n推奨馬: {opinion.recommended_horses}\n確信度: {opinion.confidence:.2f}\n根拠: {opinion.reasoning}"
+        debate, contexts = self._debate_plan(state)
+        if not contexts:
+            return {"debate": debate}
         
-        state.contrarian_expert_analysis = analysis_text
-        state.expert_opinions.append(analysis_text)
+        def turn(key: str):
+            return self.experts[key].reconsider(self._race_view(state, key), state.expert_results[key], contexts[key])
         
-        return state
+        with self._debate_node(config, debate) as record:
+            # 計測のノードに紐づくよう、スレッドごとに実行中のコンテキストを引き継ぐ
+            with ThreadPoolExecutor(max_workers=len(contexts)) as executor:
+                futures = {key: executor.submit(contextvars.copy_context().run, turn, key) for key in contexts}
+                revised = {key: future.result() for key, future in futures.items()}
+        return self._debate_update(state, debate, revised, record)
     
-    def _final_judgment(self, state: PredictionState) -> PredictionState:
+    async def _adebate(self, state: PredictionState, config: RunnableConfig, writer: StreamWriter) -> Dict[str, Any]:
+        """討議の1ラウンド（非同期版）"""
+        
+        debate, contexts = self._debate_plan(state)
+        if not contexts:
+            return {"debate": debate}
+        
+        with self._debate_node(config, debate) as record:
+            opinions = await asyncio.gather(*[
+                self._limited(config, self.experts[key].areconsider(
+                    self._race_view(state, key), state.expert_results[key], context
+                ))
+                for key, context in contexts.items()
+            ])
+        return self._debate_update(state, debate, dict(zip(contexts, opinions)), record)
+    
+    @staticmethod
+    def _debate_route(state: PredictionState) -> str:
+        """打ち切るまで討議のラウンドを繰り返す"""
+        return "make_judgment" if state.debate.get("stopped") else "debate"
+    
+    def _final_judgment(self, state: PredictionState, config: RunnableConfig,
+                        writer: StreamWriter) -> Dict[str, Any]:
         """最終判断"""
         
-        final_judgment = self.moderator.make_final_judgment(
-            state.race_info,
-            state.pace_expert_analysis,
-            state.jockey_expert_analysis,
-            state.contrarian_expert_analysis
-        )
+        with self._measure(config, "make_judgment"):
+            final_judgment = self.moderator.make_final_judgment(
+                self._race_view(state, "moderator"),
+                self._ordered_opinions(state.expert_results),
+                self._text_callback(config, writer, "moderator")
+            )
+            final_judgment = self.apply_pricing(state.race, state.expert_results, final_judgment)
+            return self._judgment_update(final_judgment)
+    
+    async def _afinal_judgment(self, state: PredictionState, config: RunnableConfig,
+                               writer: StreamWriter) -> Dict[str, Any]:
+        """最終判断（非同期版）"""
         
-        # 結果を辞書形式で保存
-        state.final_judgment = {
-            "consensus_analysis": final_judgment.consensus_analysis,
-            "minority_opinions": final_judgment.minority_opinions,
-            "expert_reliability": final_judgment.expert_reliability,
-            "summary": final_judgment.summary,
-            "recommendations": [
-                {
-                    "horse_number": rec.horse_number,
-                    "win_odds": rec.win_odds,
-                    "expected_value": rec.expected_value,
-                    "bet_amount": rec.bet_amount,
-                    "confidence": rec.confidence,
-                    "edge_score": rec.edge_score
-                }
-                for rec in final_judgment.recommendations
+        with self._measure(config, "make_judgment"):
+            final_judgment = await self._limited(config, self.moderator.amake_final_judgment(
+                self._race_view(state, "moderator"),
+                self._ordered_opinions(state.expert_results),
+                self._text_callback(config, writer, "moderator")
+            ))
+            final_judgment = self.apply_pricing(state.race, state.expert_results, final_judgment)
+            return self._judgment_update(final_judgment)
+    
+    @staticmethod
+    def _parse_race(race_info: str) -> Optional[Race]:
+        """レース情報を構造化（netkeiba形式として解析できない場合はNone）"""
+        
+        try:
+            return parse_race_card(race_info)
+        except ValueError:
+            return None
+    
+    def _initial_state(self, race_info: str) -> PredictionState:
+        """初期状態（成績キャッシュがあれば出馬表の近走を取り込んでおく）"""
+        
+        race = self._parse_race(race_info)
+        if race is not None and self.entity_cache is not None:
+            self.entity_cache.observe_race(race)
+        return PredictionState(race_info=race_info, race=race)
+    
+    def _race_view(self, state: PredictionState, role: str) -> str:
+        """役割ごとに必要な列だけを含む出馬表（構造化できない場合は元のテキスト）"""
+        
+        if state.race is None:
+            return state.race_info
+        return render_view(state.race, role, self.views, self.entity_cache)
+    
+    def moderator_view(self, race: Race) -> str:
+        """総合判断専門家に渡す出馬表だけを作る（オッズ更新時の再判断用。近走の取り込みや専門家のビューの作成はしない）"""
+        
+        return render_view(race, "moderator", self.views, self.entity_cache)
+    
+    def race_views(self, race_info: str) -> Dict[str, str]:
+        """各専門家とモデレーターに渡す出馬表（役割キー -> テキスト）"""
+        
+        state = self._initial_state(race_info)
+        return {role: self._race_view(state, role) for role in self.expert_keys + ["moderator"]}
+    
+    def screen(self, race: Optional[Race], metrics: Optional[RaceMetrics] = None) -> Optional[Dict[str, Any]]:
+        """予想前の絞り込み結果（絞り込まない設定・出馬表を構造化できない場合はNone）"""
+        
+        if self.prescreener is None or race is None:
+            return None
+        with metrics.node("prescreen") if metrics is not None else nullcontext():
+            return self.prescreener.screen(race).to_dict()
+    
+    @staticmethod
+    def screened_out_result(race_info: str, screening: Dict[str, Any]) -> Dict[str, Any]:
+        """絞り込みで見送ったレースの結果（専門家の分析・最終判断なし）"""
+        
+        return {
+            "race_info": race_info,
+            "expert_opinions": [],
+            "expert_votes": {},
+            "final_judgment": None,
+            "screening": screening
+        }
+    
+    def _format_result(self, race_info: str, result: Dict[str, Any],
+                       screening: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """グラフの実行結果を整理（絞り込みをした場合はその結果も付ける）"""
+        
+        formatted = {
+            "race_info": race_info,
+            "expert_opinions": [
+                format_expert_opinion(key, result["expert_results"][key])
+                for key in self.expert_keys
+                if key in result["expert_results"]
             ],
-            "reasoning": final_judgment.reasoning,
-            "risk_assessment": final_judgment.risk_assessment
+            "expert_votes": {
+                key: vote_to_dict(result["expert_results"][key])
+                for key in self.expert_keys
+                if key in result["expert_results"]
+            },
+            "final_judgment": result["final_judgment"]
         }
+        if result.get("debate"):
+            formatted["debate"] = result["debate"]
+        if screening is not None:
+            formatted["screening"] = screening
+        return formatted
+    
+    @staticmethod
+    def _race_id(race: Optional[Race]) -> Optional[str]:
+        """計測レポート用のレースの識別子（開催日・開催・レース番号）"""
+        
+        if race is None:
+            return None
+        return race_label(race)
+    
+    def finish_result(self, result: Dict[str, Any], metrics: RaceMetrics, race: Optional[Race]) -> Dict[str, Any]:
+        """計測レポートを結果に付けて出力先へ書き出し、ストアがあれば予想を保存する"""
+        
+        metrics.finish()
+        report = metrics.report()
+        for exporter in self.exporters:
+            exporter.export(report)
+        result["metrics"] = report
+        if self.results_store is not None and race is not None:
+            self.results_store.record_prediction(race, result)
+        return result
+    
+    def invalidate_moderator_cache(self) -> int:
+        """総合判断専門家の応答キャッシュだけを削除（オッズ更新時など）
         
-        state.is_complete = True
+        専門家の分析はそのまま再利用される。削除した件数を返す
+        """
+        
+        if self.response_cache is None:
+            return 0
+        return self.response_cache.invalidate(self.moderator.role)
+    
+    def cache_report(self) -> Dict[str, Dict[str, Any]]:
+        """エージェントごとのプロンプトキャッシュ利用状況（ヒット／ミスのトークン数）"""
         
-        return state
+        report = {key: expert.cache_stats.to_dict() for key, expert in self.experts.items()}
+        report["moderator"] = self.moderator.cache_stats.to_dict()
+        return report
     
     def predict_race(self, race_info: str) -> Dict[str, Any]:
         """レース予想を実行"""
         
         # 初期状態の設定
-        initial_state = PredictionState(
-            race_info=race_info,
-            expert_opinions=[]
-        )
+        initial_state = self._initial_state(race_info)
+        metrics = RaceMetrics(self._race_id(initial_state.race))
+        
+        # 妙味のある馬がいないレースは専門家の分析を省く
+        screening = self.screen(initial_state.race, metrics)
+        if screening is not None and not screening["passed"]:
+            return self.finish_result(self.screened_out_result(race_info, screening), metrics, initial_state.race)
         
         # グラフの実行
-        result = self.graph.invoke(initial_state)
+        result = self.graph.invoke(initial_state, config={"configurable": {"metrics": metrics}})
         
         # 結果の整理
-        return {
-            "race_info": race_info,
-            "expert_opinions": result["expert_opinions"],
-            "final_judgment": result["final_judgment"]
-        }
-
-
-def main():
-    # 情報をファイルから読み込み
-    data_path = os.path.join(os.path.dirname(__file__), "../data/race.txt")
+        return self.finish_result(self._format_result(race_info, result, screening), metrics, initial_state.race)
     
-    try:
-        with open(data_path, "r", encoding="utf-8") as f:
-            sample_race = f.read()
-    except FileNotFoundError:
-        print(f"エラー: {data_path} が見つかりません")
-        return
+    async def apredict_race(self, race_info: str, semaphore: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+        """レース予想を実行（非同期版）
+        
+        semaphoreを渡すと、このレースのLLM呼び出しがその同時実行数の範囲内に制限される
+        """
+        
+        initial_state = self._initial_state(race_info)
+        metrics = RaceMetrics(self._race_id(initial_state.race))
+        screening = self.screen(initial_state.race, metrics)
+        if screening is not None and not screening["passed"]:
+            return self.finish_result(self.screened_out_result(race_info, screening), metrics, initial_state.race)
+        result = await self.async_graph.ainvoke(
+            initial_state,
+            config={"configurable": {"semaphore": semaphore, "metrics": metrics}}
+        )
+        return self.finish_result(self._format_result(race_info, result, screening), metrics, initial_state.race)
     
-    # 予想システムの実行
-    prediction_system = HorseRacePredictionGraph()
-    result = prediction_system.predict_race(sample_race)
+    @staticmethod
+    def _stream_events(mode: str, chunk: Any) -> Iterator[PredictionEvent]:
+        """グラフのストリーム出力（custom / updates）を予想イベントに変換"""
+        
+        if mode == "custom":
+            yield chunk
+        elif mode == "updates":
+            for node, update in chunk.items():
+                for key, opinion in (update or {}).get("expert_results", {}).items():
+                    text = format_expert_opinion(key, opinion)
+                    yield ExpertDone(role=key, opinion=opinion, text=f"（討議後）{text}" if node == "debate" else text)
     
-    print("=== 競馬予想システム実行結果 ===")
-    print("\n=== 専門家意見 ===")
-    for i, opinion in enumerate(result['expert_opinions'], 1):
-        print(f"{i}. {opinion}\n")
+    def stream_race(self, race_info: str) -> Iterator[PredictionEvent]:
+        """レース予想をストリーミング実行
+        
+        専門家の開始・応答テキストの断片・専門家の完了を発生順に返し、最後に JudgmentDone を返す
+        """
+        
+        initial_state = self._initial_state(race_info)
+        metrics = RaceMetrics(self._race_id(initial_state.race))
+        screening = self.screen(initial_state.race, metrics)
+        if screening is not None and not screening["passed"]:
+            yield JudgmentDone(result=self.finish_result(
+                self.screened_out_result(race_info, screening), metrics, initial_state.race
+            ))
+            return
+        final_state = None
+        for mode, chunk in self.graph.stream(
+            initial_state,
+            config={"configurable": {"stream_tokens": True, "metrics": metrics}},
+            stream_mode=["custom", "updates", "values"]
+        ):
+            if mode == "values":
+                final_state = chunk
+            else:
+                yield from self._stream_events(mode, chunk)
+        yield JudgmentDone(result=self.finish_result(
+            self._format_result(race_info, final_state, screening), metrics, initial_state.race
+        ))
+    
+    async def astream_race(self, race_info: str,
+                           semaphore: Optional[asyncio.Semaphore] = None) -> AsyncIterator[PredictionEvent]:
+        """レース予想をストリーミング実行（非同期版）"""
+        
+        initial_state = self._initial_state(race_info)
+        metrics = RaceMetrics(self._race_id(initial_state.race))
+        screening = self.screen(initial_state.race, metrics)
+        if screening is not None and not screening["passed"]:
+            yield JudgmentDone(result=self.finish_result(
+                self.screened_out_result(race_info, screening), metrics, initial_state.race
+            ))
+            return
+        final_state = None
+        async for mode, chunk in self.async_graph.astream(
+            initial_state,
+            config={"configurable": {"semaphore": semaphore, "stream_tokens": True, "metrics": metrics}},
+            stream_mode=["custom", "updates", "values"]
+        ):
+            if mode == "values":
+                final_state = chunk
+            else:
+                for event in self._stream_events(mode, chunk):
+                    yield event
+        yield JudgmentDone(result=self.finish_result(
+            self._format_result(race_info, final_state, screening), metrics, initial_state.race
+        ))
+    
+    async def apredict_races(self, races: List[str], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """複数レースの予想を並行実行（非同期版）
+        
+        全レースのLLM呼び出しを1つのセマフォで制限し、同時に最大max_concurrency件まで実行する。
+        結果は入力と同じ順序で返す。
+        """
+        
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency は1以上を指定してください")
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        return await asyncio.gather(*[
+            self.apredict_race(race_info, semaphore) for race_info in races
+        ])
+    
+    async def apredict_stream(self, races: Iterable[str],
+                              max_concurrency: int = 8) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """レースを読み進めながら並行予想し、終わった順に (入力順の番号, 結果) を返す
+        
+        同時に予想するレースとLLM呼び出しはそれぞれ最大max_concurrency件まで。
+        残りのレースは前のレースが終わるまで読み込まないため、レース数によらずメモリ使用量は一定。
+        """
+        
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency は1以上を指定してください")
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        numbered = enumerate(races)
+        running = set()
+        
+        async def predict(index: int, race_info: str) -> Tuple[int, Dict[str, Any]]:
+            return index, await self.apredict_race(race_info, semaphore)
+        
+        def fill() -> None:
+            while len(running) < max_concurrency:
+                item = next(numbered, None)
+                if item is None:
+                    return
+                running.add(asyncio.ensure_future(predict(*item)))
+        
+        try:
+            fill()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                running.difference_update(done)
+                for task in done:
+                    yield task.result()
+                fill()
+        finally:
+            for task in running:
+                task.cancel()
+    
+    def predict_races(self, races: List[str], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """複数レースの予想を並行実行（1日分の出馬表など）"""
+        
+        return asyncio.run(self.apredict_races(races, max_concurrency))
+
+
+def print_judgment(judgment: Optional[Dict[str, Any]]) -> None:
+    """最終判断を表示"""
     
     print("=== 最終判断 ===")
-    if result['final_judgment']:
-        judgment = result['final_judgment']
+    if judgment:
         print(f"コンセンサス分析: {judgment['consensus_analysis']}")
         print(f"マイノリティ意見: {judgment['minority_opinions']}")
         print(f"専門家信頼度: {judgment['expert_reliability']}")
@@ -195,6 +704,186 @@ def main():
         print(f"リスク評価: {judgment['risk_assessment']}")
 
 
+def render_stream(events: Iterator[PredictionEvent]) -> Dict[str, Any]:
+    """ストリーミングのイベントを逐次表示し、最終結果を返す
+    
+    専門家は並列で応答が混ざるため受信文字数の進捗だけを1行で更新し、完了した順に意見を表示する。
+    総合判断専門家の応答はそのまま流す
+    """
+    
+    received: Dict[str, int] = {}
+    
+    def show_progress():
+        status = " | ".join(f"{expert_label(key)} {count}字" for key, count in received.items())
+        print(f"\r\033[K分析中: {status}", end="", flush=True)
+    
+    print("=== 専門家意見 ===")
+    for event in events:
+        if isinstance(event, ExpertStarted):
+            if event.role == "moderator":
+                print("\n=== 総合判断（生成中） ===")
+            else:
+                received[event.role] = 0
+                show_progress()
+        elif isinstance(event, TextDelta):
+            if event.role == "moderator":
+                print(event.text, end="", flush=True)
+            else:
+                received[event.role] = received.get(event.role, 0) + len(event.text)
+                show_progress()
+        elif isinstance(event, ExpertDone):
+            received.pop(event.role, None)
+            print(f"\r\033[K{event.text}\n")
+            if received:
+                show_progress()
+        elif isinstance(event, JudgmentDone):
+            print("\n")
+            print_judgment(event.result["final_judgment"])
+            return event.result
+    return {}
+
+
+async def write_results(prediction_system: HorseRacePredictionGraph, races: Iterator[RaceText],
+                        max_concurrency: int, output_path: Optional[str]) -> int:
+    """複数レースを並行予想し、終わったレースから順に1行ずつJSONLへ書き出す（output_pathがNoneなら要約を表示）"""
+    
+    sources: Dict[int, str] = {}
+    
+    def texts() -> Iterator[str]:
+        for index, race in enumerate(races):
+            sources[index] = race.source
+            yield race.text
+    
+    count = 0
+    output = open(output_path, "w", encoding="utf-8") if output_path else None
+    try:
+        async for index, result in prediction_system.apredict_stream(texts(), max_concurrency):
+            source = sources.pop(index)
+            record = {"source": source, "race_id": result["metrics"]["race_id"]}
+            record.update({key: value for key, value in result.items() if key != "race_info"})
+            if output is not None:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+            judgment = result["final_judgment"] or {}
+            picks = [rec["horse_number"] for rec in judgment.get("recommendations", [])]
+            outcome = "見送り（絞り込み）" if not result.get("screening", {}).get("passed", True) else f"推奨馬 {picks}"
+            print(f"{source}: {record['race_id'] or '（出馬表を解析できません）'} {outcome}")
+            count += 1
+    finally:
+        if output is not None:
+            output.close()
+    return count
+
+
+def add_system_arguments(parser: argparse.ArgumentParser) -> None:
+    """予想システムの構成（ストア・絞り込み・モデル設定・専門家・討議・サンプリング）の引数を追加"""
+    
+    parser.add_argument("--store", help="予想を保存するストア（バックテスト用のSQLiteファイル）")
+    parser.add_argument("--screen", action="store_true", help="近走の指標とオッズで絞り込み、妙味のあるレースだけ専門家が分析する")
+    parser.add_argument("--screen-ev", type=float, default=ScreenConfig.min_expected_value,
+                        help="絞り込みで候補とする馬の期待値の下限")
+    parser.add_argument("--agent-config", help="エージェントごとのモデル・最大トークン数・温度（JSONファイル）")
+    parser.add_argument("--experts", nargs="+", help="使う専門家の専門家キー（省略時は展開予想・騎手・穴狙い）")
+    parser.add_argument("--expert-plugin", nargs="+", default=[],
+                        help="専門家を登録するモジュール（例: plugins.pedigree_expert）")
+    parser.add_argument("--debate-rounds", type=int, default=0,
+                        help="多数派から外れた専門家が推奨を見直す討議のラウンド数の上限（0なら討議なし）")
+    parser.add_argument("--debate-budget", type=int, default=DebateConfig.token_budget,
+                        help="1レースの討議で使うトークン数の上限")
+    parser.add_argument("--max-samples", type=int, default=1,
+                        help="専門家ごとの自己一貫性サンプリングの試行数の上限（1ならサンプリングなし）")
+
+
+def build_system(args: argparse.Namespace) -> HorseRacePredictionGraph:
+    """引数から予想システムを作る（同じレース情報での再実行は応答キャッシュから返す）"""
+    
+    load_plugins(args.expert_plugin)
+    # 騎手・調教師・父の成績は実行をまたいで積み上げる
+    cache_path = os.path.join(os.path.dirname(__file__), "../.cache/responses.sqlite3")
+    entity_path = os.path.join(os.path.dirname(__file__), "../.cache/entities.sqlite3")
+    return HorseRacePredictionGraph(
+        response_cache=ResponseCache(cache_path),
+        results_store=ResultsStore(args.store) if args.store else None,
+        entity_cache=EntityCache(entity_path),
+        prescreener=Prescreener(ScreenConfig(min_expected_value=args.screen_ev)) if args.screen else None,
+        model_configs=load_model_configs(args.agent_config) if args.agent_config else None,
+        experts=args.experts,
+        debate=DebateConfig(max_rounds=args.debate_rounds, token_budget=args.debate_budget) if args.debate_rounds else None,
+        sampling=SamplingConfig(initial_samples=min(SamplingConfig.initial_samples, args.max_samples),
+                                max_samples=args.max_samples) if args.max_samples > 1 else None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="競馬予想システム")
+    parser.add_argument("--stream", action="store_true", help="専門家の意見を届いた順に表示する（1レースのみ）")
+    parser.add_argument("--input", nargs="+",
+                        default=[os.path.join(os.path.dirname(__file__), "../data/race.txt")],
+                        help="レース情報（ファイル・ディレクトリ・globパターン、1ファイルに複数レースを連結可）")
+    parser.add_argument("--concurrency", type=int, default=4, help="複数レース時に同時に予想するレース数")
+    parser.add_argument("--output", help="結果を1レース1行で書き出すJSONLファイル")
+    add_system_arguments(parser)
+    args = parser.parse_args()
+    
+    # 情報をファイルから読み込み（2レース目までを先読みして1レースか複数レースかを判定）
+    try:
+        paths = list(expand_inputs(args.input))
+    except FileNotFoundError as e:
+        print(f"エラー: {e}")
+        return
+    races = iter_races(paths)
+    head = list(itertools.islice(races, 2))
+    if not head:
+        print(f"エラー: {' '.join(args.input)} にレース情報がありません")
+        return
+    bulk = len(head) > 1 or args.output is not None
+    if bulk and args.stream:
+        parser.error("--stream は1レースのみ指定できます")
+    
+    prediction_system = build_system(args)
+    
+    if bulk:
+        count = asyncio.run(write_results(
+            prediction_system, itertools.chain(head, races), args.concurrency, args.output
+        ))
+        print(f"\n{count}レースを予想しました" + (f"（{args.output}）" if args.output else ""))
+        return
+    
+    sample_race = head[0].text
+    print("=== 競馬予想システム実行結果 ===")
+    if args.stream:
+        result = render_stream(prediction_system.stream_race(sample_race))
+    else:
+        result = prediction_system.predict_race(sample_race)
+        print("\n=== 専門家意見 ===")
+        for i, opinion in enumerate(result['expert_opinions'], 1):
+            print(f"{i}. {opinion}\n")
+        print_judgment(result['final_judgment'])
+    
+    screening = result.get("screening")
+    if screening is not None:
+        print("\n=== 絞り込み ===")
+        status = "専門家が分析" if screening["passed"] else "見送り（期待値が基準以上の馬なし）"
+        print(f"{status} 最大期待値{screening['race_score']} 候補{screening['candidates']}")
+    
+    debate = result.get("debate")
+    if debate:
+        print("\n=== 討議 ===")
+        print(f"{debate['rounds']}ラウンド（{debate['stopped']}で終了） 一致度{debate['agreement']} {debate['tokens']}トークン")
+    
+    if not args.stream:
+        metrics = result["metrics"]
+        print("\n=== 計測 ===")
+        for node in metrics["nodes"]:
+            print(f"{node['node']}: {node['wall_time']:.2f}秒")
+        totals = metrics["totals"]
+        print(f"合計: {metrics['wall_time']:.2f}秒 LLM呼び出し{totals['calls']}回 再試行{totals['retries']}回 パース失敗{totals['parse_failures']}回")
+    
+    print("\n=== プロンプトキャッシュ ===")
+    for agent_name, stats in prediction_system.cache_report().items():
+        print(f"{agent_name}: ヒット{stats['cache_read_input_tokens']}トークン ミス{stats['cache_creation_input_tokens']}トークン 非キャッシュ{stats['input_tokens']}トークン ヒット率{stats['cache_hit_rate']:.0%}")
+
+
 if __name__ == "__main__":
     main()
     
\ No newline at end of file
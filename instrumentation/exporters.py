@@ -0,0 +1,122 @@
+"""
+計測レポートの出力
+JSONL（レースごとに1行）と OpenMetrics テキスト形式（Prometheusのテキストファイル収集向けの累積値）
+"""
+
+from typing import Any, Dict, Tuple
+from collections import defaultdict
+import json
+import os
+import threading
+
+
+class JsonlExporter:
+    """計測レポートをJSONLファイルに追記"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, report: Dict[str, Any]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        line = json.dumps(report, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# トークン種別 -> CallRecord の項目
+TOKEN_KINDS = {
+    "input": "input_tokens",
+    "output": "output_tokens",
+    "cache_read": "cache_read_input_tokens",
+    "cache_creation": "cache_creation_input_tokens",
+}
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class OpenMetricsExporter:
+    """計測レポートを累積し、OpenMetrics テキスト形式のファイルに書き出す
+
+    export のたびにファイル全体を置き換える（読み取り側が書き込み途中を読まないよう置き換えで保存）
+    """
+
+    def __init__(self, path: str, prefix: str = "clauma"):
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._races = [0, 0.0]  # 件数, 合計秒
+        self._nodes: Dict[str, list] = defaultdict(lambda: [0, 0.0])  # ノード -> 件数, 合計秒
+        self._ttft: Dict[str, list] = defaultdict(lambda: [0, 0.0])  # エージェント -> 件数, 合計秒
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+
+    def _count(self, name: str, value: float, **labels: str) -> None:
+        self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def export(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self._races[0] += 1
+            self._races[1] += report["wall_time"]
+            for node in report["nodes"]:
+                self._nodes[node["node"]][0] += 1
+                self._nodes[node["node"]][1] += node["wall_time"]
+                for call in node["calls"]:
+                    agent = call["agent"]
+                    self._count("llm_calls", 1, agent=agent)
+                    self._count("llm_retries", call["retries"], agent=agent)
+                    self._count("llm_parse_failures", call["parsed"] is False, agent=agent)
+                    self._count("llm_repairs", call["repaired"], agent=agent)
+                    self._count("llm_response_cache_hits", call["response_cached"], agent=agent)
+                    for kind, key in TOKEN_KINDS.items():
+                        self._count("llm_tokens", call[key], agent=agent, kind=kind)
+                    if call["ttft"] is not None:
+                        self._ttft[agent][0] += 1
+                        self._ttft[agent][1] += call["ttft"]
+            text = self.render()
+
+            # 一時ファイルへの書き込みと置き換えもロックの中で行う（並行した export が同じ一時ファイルを奪い合わず、
+            # 最後に累積した値が残る）
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(temp_path, self.path)
+
+    def render(self) -> str:
+        """現在の累積値を OpenMetrics テキスト形式にする"""
+
+        p = self.prefix
+        lines = [
+            f"# TYPE {p}_race_duration_seconds summary",
+            f"# UNIT {p}_race_duration_seconds seconds",
+            f"{p}_race_duration_seconds_count {self._races[0]}",
+            f"{p}_race_duration_seconds_sum {self._races[1]}",
+            f"# TYPE {p}_node_duration_seconds summary",
+            f"# UNIT {p}_node_duration_seconds seconds",
+        ]
+        for node, (count, total) in sorted(self._nodes.items()):
+            lines.append(f"{p}_node_duration_seconds_count{_labels(node=node)} {count}")
+            lines.append(f"{p}_node_duration_seconds_sum{_labels(node=node)} {total}")
+
+        lines += [f"# TYPE {p}_llm_ttft_seconds summary", f"# UNIT {p}_llm_ttft_seconds seconds"]
+        for agent, (count, total) in sorted(self._ttft.items()):
+            lines.append(f"{p}_llm_ttft_seconds_count{_labels(agent=agent)} {count}")
+            lines.append(f"{p}_llm_ttft_seconds_sum{_labels(agent=agent)} {total}")
+
+        names = sorted({name for name, _ in self._counters})
+        for name in names:
+            lines.append(f"# TYPE {p}_{name} counter")
+            for (counter, labels), value in sorted(self._counters.items()):
+                if counter == name:
+                    lines.append(f"{p}_{name}_total{_labels(**dict(labels))} {value:g}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,139 @@
+"""
+予想の計測
+レースごとにノードの所要時間と、各LLM呼び出しの最初のトークンまでの時間・トークン数・再試行回数・パース成否を集める
+（エージェントは実行中のノードに紐づいた RaceMetrics へ自動で記録する）
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+import threading
+import time
+
+
+@dataclass
+class CallRecord:
+    """LLM呼び出し1回分の計測値"""
+    agent: str  # エージェントの役割
+    model: Optional[str] = None  # モデル
+    wall_time: float = 0.0  # 所要時間（秒、再試行・修正呼び出しを含む）
+    ttft: Optional[float] = None  # 最初のトークンまでの時間（秒、非ストリーミングでは応答全体が届くまで）
+    input_tokens: int = 0  # 入力トークン（キャッシュ対象外）
+    output_tokens: int = 0  # 出力トークン
+    cache_read_input_tokens: int = 0  # プロンプトキャッシュから読んだ入力トークン
+    cache_creation_input_tokens: int = 0  # プロンプトキャッシュに書き込んだ入力トークン
+    retries: int = 0  # 再試行回数
+    response_cached: bool = False  # 応答キャッシュから返したか
+    parsed: Optional[bool] = None  # パース（スキーマ検証）に成功したか（応答が届かなかった呼び出しはNone）
+    repaired: bool = False  # 修正呼び出しを行ったか
+    error: Optional[str] = None  # 失敗理由
+
+    @property
+    def prompt_tokens(self) -> int:
+        """プロンプト全体のトークン数（キャッシュの有無を問わない）"""
+        return self.input_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens
+
+    def record_usage(self, usage: Any) -> None:
+        """response.usage のトークン数を加算"""
+        if usage is None:
+            return
+        self.input_tokens += getattr(usage, "input_tokens", 0) or 0
+        self.output_tokens += getattr(usage, "output_tokens", 0) or 0
+        self.cache_read_input_tokens += getattr(usage, "cache_read_input_tokens", 0) or 0
+        self.cache_creation_input_tokens += getattr(usage, "cache_creation_input_tokens", 0) or 0
+
+
+@dataclass
+class NodeRecord:
+    """グラフのノード1回分の計測値"""
+    node: str  # ノード名
+    wall_time: float = 0.0  # 所要時間（秒、同時実行数の待ちを含む）
+    calls: List[CallRecord] = field(default_factory=list)  # ノード内のLLM呼び出し
+
+
+# 実行中のノード（LangGraphはノードごとにコンテキストを分けて実行する）
+_current_node: ContextVar[Optional[Tuple["RaceMetrics", NodeRecord]]] = ContextVar("current_node", default=None)
+
+
+def record_call(record: CallRecord) -> None:
+    """実行中のノードにLLM呼び出しを記録（計測していなければ何もしない）"""
+
+    current = _current_node.get()
+    if current is not None:
+        metrics, node = current
+        metrics.add_call(node, record)
+
+
+class RaceMetrics:
+    """1レース分の計測値の集計"""
+
+    def __init__(self, race_id: Optional[str] = None):
+        self.race_id = race_id  # レースの識別子（レポート・出力用）
+        self.nodes: List[NodeRecord] = []
+        self._started = time.perf_counter()
+        self._finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def node(self, name: str):
+        """ノードの実行を計測し、その間のLLM呼び出しをこのノードに紐づける"""
+
+        record = NodeRecord(node=name)
+        token = _current_node.set((self, record))
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.wall_time = time.perf_counter() - started
+            _current_node.reset(token)
+            with self._lock:
+                self.nodes.append(record)
+
+    def add_call(self, node: NodeRecord, record: CallRecord) -> None:
+        with self._lock:
+            node.calls.append(record)
+
+    def finish(self) -> None:
+        self._finished = time.perf_counter()
+
+    def report(self) -> Dict[str, Any]:
+        """レースの計測レポート（ノード別・合計・最も遅いノード・最も大きいプロンプト）"""
+
+        with self._lock:
+            nodes = list(self.nodes)
+        finished = self._finished if self._finished is not None else time.perf_counter()
+        calls = [(node.node, call) for node in nodes for call in node.calls]
+
+        totals = {
+            "calls": len(calls),
+            "input_tokens": sum(call.input_tokens for _, call in calls),
+            "output_tokens": sum(call.output_tokens for _, call in calls),
+            "cache_read_input_tokens": sum(call.cache_read_input_tokens for _, call in calls),
+            "cache_creation_input_tokens": sum(call.cache_creation_input_tokens for _, call in calls),
+            "retries": sum(call.retries for _, call in calls),
+            "response_cache_hits": sum(call.response_cached for _, call in calls),
+            "repairs": sum(call.repaired for _, call in calls),
+            "parse_failures": sum(call.parsed is False for _, call in calls),
+        }
+        slowest = max(nodes, key=lambda node: node.wall_time, default=None)
+        largest = max(calls, key=lambda item: item[1].prompt_tokens, default=None)
+
+        return {
+            "race_id": self.race_id,
+            "wall_time": round(finished - self._started, 4),
+            "nodes": [
+                {
+                    "node": node.node,
+                    "wall_time": round(node.wall_time, 4),
+                    "calls": [
+                        {**asdict(call), "prompt_tokens": call.prompt_tokens}
+                        for call in node.calls
+                    ],
+                }
+                for node in nodes
+            ],
+            "totals": totals,
+            "slowest_node": slowest.node if slowest else None,
+            "largest_prompt": {"node": largest[0], "prompt_tokens": largest[1].prompt_tokens} if largest else None,
+        }
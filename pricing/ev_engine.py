@@ -0,0 +1,166 @@
+"""
+期待値・賭け金の計算エンジン
+専門家の推奨・確信度とモデレーターの信頼度スコアから各馬の勝率を見積もり、
+現在のオッズに対する期待値と賭け金をローカルで計算する（LLM呼び出しなし・再現可能）
+"""
+
+from typing import Dict, List, Optional, Sequence
+from dataclasses import dataclass
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.moderator import BettingRecommendation
+
+
+# 賭け金の決め方
+STAKE_FLAT = "flat"  # 固定額
+STAKE_KELLY = "kelly"  # 分数ケリー
+
+
+@dataclass
+class StakingConfig:
+    """賭け金の設定"""
+    strategy: str = STAKE_FLAT  # flat / kelly
+    flat_stake: int = 1000  # 固定額（円）
+    bankroll: float = 100000.0  # 資金（円）
+    kelly_fraction: float = 0.25  # ケリー基準に掛ける割合
+    max_bet_fraction: float = 0.05  # 1頭あたりの上限（資金に対する割合）
+    max_race_fraction: float = 0.2  # 1レース合計の上限（資金に対する割合）
+    unit: int = 100  # 購入単位（円）
+    min_expected_value: float = 1.0  # この期待値を超える馬を推奨
+
+
+@dataclass
+class ExpertVote:
+    """専門家1人分の推奨"""
+    recommended_horses: Sequence[int]  # 推奨馬番号
+    confidence: float  # 確信度（0.0-1.0）
+
+
+@dataclass
+class PricingResult:
+    """1レース分の計算結果（配列は馬番順）"""
+    horse_numbers: np.ndarray  # 馬番
+    win_odds: np.ndarray  # 単勝オッズ（オッズなしはnan）
+    market_probabilities: np.ndarray  # オッズから逆算した勝率（控除率を除いて正規化）
+    support: np.ndarray  # 専門家の支持（信頼度×確信度で加重、0.0-1.0）
+    win_probabilities: np.ndarray  # 見積もり勝率
+    expected_values: np.ndarray  # 期待値（勝率×オッズ）
+    edge_scores: np.ndarray  # エッジスコア（見積もり勝率のうち市場が織り込んでいない割合）
+    stakes: np.ndarray  # 賭け金（円）
+
+
+def market_probabilities(win_odds: np.ndarray) -> np.ndarray:
+    """単勝オッズから控除率（オーバーラウンド）を除いた市場の勝率"""
+
+    implied = np.where(np.isfinite(win_odds) & (win_odds > 0), 1.0 / win_odds, 0.0)
+    total = implied.sum()
+    return implied / total if total > 0 else implied
+
+
+def expert_support(horse_numbers: np.ndarray, votes: Dict[str, ExpertVote],
+                   reliability: Dict[str, float]) -> np.ndarray:
+    """専門家の推奨を信頼度×確信度で加重した支持（推奨を出した全員が確信度1.0で推すと1.0）
+
+    推奨馬がない専門家（分析の失敗・見送り）は重みの合計に含めない
+    """
+
+    support = np.zeros(len(horse_numbers))
+    total_weight = 0.0
+    for expert, vote in votes.items():
+        if not vote.recommended_horses:
+            continue
+        weight = float(reliability.get(expert, 0.0))
+        total_weight += weight
+        support += weight * float(vote.confidence) * np.isin(horse_numbers, list(vote.recommended_horses))
+    return support / total_weight if total_weight > 0 else support
+
+
+def win_probabilities(market: np.ndarray, support: np.ndarray, signal_strength: float) -> np.ndarray:
+    """市場の勝率を専門家の支持で補正した勝率（対数オッズを支持に比例して加算し再正規化）"""
+
+    adjusted = market * np.exp(signal_strength * support)
+    total = adjusted.sum()
+    return adjusted / total if total > 0 else adjusted
+
+
+def compute_stakes(probabilities: np.ndarray, win_odds: np.ndarray, expected_values: np.ndarray,
+                   config: StakingConfig) -> np.ndarray:
+    """推奨対象（期待値が基準超え）の馬の賭け金"""
+
+    eligible = np.isfinite(win_odds) & (expected_values > config.min_expected_value)
+
+    if config.strategy == STAKE_FLAT:
+        stakes = np.where(eligible, float(config.flat_stake), 0.0)
+    elif config.strategy == STAKE_KELLY:
+        # 単勝のケリー基準: f = (p × odds - 1) / (odds - 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kelly = (probabilities * win_odds - 1.0) / (win_odds - 1.0)
+        kelly = np.where(eligible & np.isfinite(kelly), np.clip(kelly, 0.0, None), 0.0)
+        stakes = config.bankroll * config.kelly_fraction * kelly
+    else:
+        raise ValueError(f"未対応の賭け金の決め方です: {config.strategy}")
+
+    # 資金に対する上限はどちらの決め方にも適用する（1頭あたりで頭打ち、1レースの合計上限を超える場合は比例縮小）
+    stakes = np.minimum(stakes, config.bankroll * config.max_bet_fraction)
+    race_cap = config.bankroll * config.max_race_fraction
+    total = stakes.sum()
+    if total > race_cap:
+        stakes = stakes * (race_cap / total)
+
+    return np.floor(stakes / config.unit) * config.unit
+
+
+class PricingEngine:
+    """期待値・賭け金の計算"""
+
+    def __init__(self, config: Optional[StakingConfig] = None, signal_strength: float = 1.0):
+        self.config = config or StakingConfig()
+        self.signal_strength = signal_strength  # 専門家の支持を勝率にどれだけ反映するか
+
+    def price(self, horse_numbers: Sequence[int], win_odds: Sequence[Optional[float]],
+              votes: Dict[str, ExpertVote], reliability: Dict[str, float]) -> PricingResult:
+        """全出走馬の勝率・期待値・賭け金を計算"""
+
+        numbers = np.asarray(horse_numbers, dtype=int)
+        odds = np.array([np.nan if value is None else value for value in win_odds], dtype=float)
+
+        market = market_probabilities(odds)
+        support = expert_support(numbers, votes, reliability)
+        probabilities = win_probabilities(market, support, self.signal_strength)
+        expected_values = np.where(np.isfinite(odds), probabilities * odds, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            edge_scores = np.where(probabilities > 0, np.clip(1.0 - market / probabilities, 0.0, 1.0), 0.0)
+        stakes = compute_stakes(probabilities, odds, expected_values, self.config)
+
+        return PricingResult(
+            horse_numbers=numbers,
+            win_odds=odds,
+            market_probabilities=market,
+            support=support,
+            win_probabilities=probabilities,
+            expected_values=expected_values,
+            edge_scores=edge_scores,
+            stakes=stakes,
+        )
+
+    def recommendations(self, result: PricingResult) -> List[BettingRecommendation]:
+        """期待値が基準を超え、賭け金が付いた馬（期待値の高い順）"""
+
+        selected = np.flatnonzero(result.stakes > 0)
+        selected = selected[np.argsort(-result.expected_values[selected], kind="stable")]
+        return [
+            BettingRecommendation(
+                horse_number=int(result.horse_numbers[i]),
+                win_odds=float(result.win_odds[i]),
+                expected_value=round(float(result.expected_values[i]), 3),
+                bet_amount=int(result.stakes[i]),
+                confidence=round(float(result.support[i]), 3),
+                edge_score=round(float(result.edge_scores[i]), 3),
+                win_probability=round(float(result.win_probabilities[i]), 4),
+            )
+            for i in selected
+        ]
@@ -0,0 +1,126 @@
+"""
+予想前の絞り込み
+近走の指標とオッズだけで各馬の期待値をローカルで見積もり、妙味のある馬がいるレースだけを
+専門家の分析（LLM）に回す（LLM呼び出しなし・1レース1ミリ秒程度）
+"""
+
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricing.ev_engine import market_probabilities, win_probabilities
+from racecard.features import RaceFeatures, compute_features, PACE_FAST, PACE_SLOW
+from racecard.models import Race
+
+
+@dataclass
+class ScreenConfig:
+    """絞り込みの設定"""
+    signal_strength: float = 1.0  # 指標を勝率にどれだけ反映するか（PricingEngine の signal_strength と同じ尺度）
+    min_expected_value: float = 1.1  # この期待値以上の馬を候補とする（控除率のため市場どおりの馬は0.8前後）
+    min_candidates: int = 1  # 候補がこの頭数以上いるレースを専門家の分析に回す
+    max_odds: float = 100.0  # これより高いオッズの馬は候補にしない（指標の誤差で期待値が過大になりやすい）
+    fit_weight: float = 1.0  # 距離馬場適性の重み
+    closing_weight: float = 1.0  # 末脚（上がり3Fの順位）の重み
+    position_weight: float = 1.0  # 想定ペースに対する位置取りの重み
+    margin_weight: float = 1.0  # 着差の重み
+
+
+@dataclass
+class ScreenResult:
+    """1レース分の絞り込み結果（配列は馬番順）"""
+    horse_numbers: np.ndarray  # 馬番
+    support: np.ndarray  # 指標による評価（0.0-1.0、近走がない馬は0.0）
+    win_probabilities: np.ndarray  # 市場の勝率を指標で補正した勝率
+    expected_values: np.ndarray  # 期待値（勝率×オッズ、オッズなしは0.0）
+    candidates: List[int]  # 期待値が基準以上の馬番（期待値の高い順）
+    passed: bool  # 専門家の分析に回すか
+
+    @property
+    def race_score(self) -> float:
+        """レースの妙味（最大の期待値）"""
+        return float(self.expected_values.max()) if len(self.expected_values) else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "passed": self.passed,
+            "race_score": round(self.race_score, 3),
+            "candidates": self.candidates,
+            "expected_values": {
+                int(number): round(float(value), 3)
+                for number, value in zip(self.horse_numbers, self.expected_values)
+            },
+        }
+
+
+def _scaled(values: np.ndarray, higher_is_better: bool = True) -> np.ndarray:
+    """出走馬内で 0.0-1.0 に正規化（nanはnan、全馬同じ値なら0.5）"""
+
+    known = ~np.isnan(values)
+    if not known.any():
+        return values
+    low, high = np.nanmin(values), np.nanmax(values)
+    if high == low:
+        return np.where(known, 0.5, np.nan)
+    scaled = (values - low) / (high - low)
+    return scaled if higher_is_better else 1.0 - scaled
+
+
+def feature_support(features: RaceFeatures, config: ScreenConfig) -> np.ndarray:
+    """指標から各馬の評価（0.0-1.0）を作る（欠けた指標は重みから除く）"""
+
+    position = _scaled(features.early_index)  # スローペースは前に行ける馬が有利
+    if features.pace == PACE_FAST:
+        position = 1.0 - position  # ハイペースは差し・追込が有利
+    elif features.pace != PACE_SLOW:
+        position = np.full(len(position), np.nan)  # 平均ペースは位置取りで差をつけない
+
+    signals = np.stack([
+        features.fit_score / 100.0,
+        _scaled(features.closing_rank, higher_is_better=False),
+        position,
+        _scaled(features.mean_margin, higher_is_better=False),
+    ], axis=1)
+    weights = np.array([config.fit_weight, config.closing_weight, config.position_weight, config.margin_weight])
+    weights = np.where(np.isnan(signals), 0.0, weights)
+    total = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        support = np.where(total > 0, np.nansum(signals * weights, axis=1) / total, 0.0)
+    return np.clip(support, 0.0, 1.0)
+
+
+class Prescreener:
+    """近走の指標とオッズによる予想前の絞り込み"""
+
+    def __init__(self, config: Optional[ScreenConfig] = None):
+        self.config = config or ScreenConfig()
+
+    def screen(self, race: Race, features: Optional[RaceFeatures] = None) -> ScreenResult:
+        """各馬の期待値を見積もり、専門家の分析に回すかを判定"""
+
+        config = self.config
+        features = features or compute_features(race)
+        odds = np.array([np.nan if entry.win_odds is None else entry.win_odds for entry in race.entries], dtype=float)
+
+        market = market_probabilities(odds)
+        support = feature_support(features, config)
+        # 指標は出走馬の相対評価のため、平均からの差だけを勝率に反映する
+        probabilities = win_probabilities(market, support - support.mean(), config.signal_strength)
+        expected_values = np.where(np.isfinite(odds), probabilities * odds, 0.0)
+
+        eligible = np.isfinite(odds) & (odds <= config.max_odds) & (expected_values >= config.min_expected_value)
+        selected = np.flatnonzero(eligible)
+        selected = selected[np.argsort(-expected_values[selected], kind="stable")]
+        candidates = [int(features.horse_numbers[i]) for i in selected]
+        return ScreenResult(
+            horse_numbers=features.horse_numbers,
+            support=support,
+            win_probabilities=probabilities,
+            expected_values=expected_values,
+            candidates=candidates,
+            passed=len(candidates) >= config.min_candidates,
+        )
@@ -0,0 +1,58 @@
+"""
+出馬表の差分判定
+同じレースの新旧の出馬表を比べ、オッズ・人気だけが動いたのか、出走馬そのものが変わったのかを判定する
+"""
+
+from typing import Optional, Tuple
+from dataclasses import fields
+
+from racecard.models import Race, Entry
+
+
+# 変更の種類
+UNCHANGED = "unchanged"  # 変更なし
+ODDS_ONLY = "odds"  # オッズ・人気のみ変更（専門家の分析は再利用できる）
+FIELD_CHANGED = "field"  # 出走馬・騎手・条件などが変更（専門家の分析からやり直す）
+
+# オッズ更新で変わる項目
+ODDS_FIELDS = ("win_odds", "popularity")
+
+
+def race_key(race: Race) -> Tuple[str, str, Optional[int]]:
+    """レースを識別するキー（開催日・開催・レース番号）"""
+    return (race.date, race.meeting, race.race_number)
+
+
+def race_label(race: Race) -> str:
+    """レースの表示用の識別子（例: 2025年6月22日 3回阪神6日 10R）"""
+    return f"{race.date} {race.meeting} {race.race_number}R"
+
+
+def _entry_without_odds(entry: Entry) -> tuple:
+    return tuple(getattr(entry, f.name) for f in fields(entry) if f.name not in ODDS_FIELDS)
+
+
+def classify_change(old: Race, new: Race) -> str:
+    """新旧の出馬表の変更の種類を判定"""
+
+    if race_key(old) != race_key(new):
+        return FIELD_CHANGED
+
+    race_fields = [f.name for f in fields(old) if f.name != "entries"]
+    if any(getattr(old, name) != getattr(new, name) for name in race_fields):
+        return FIELD_CHANGED
+
+    if [e.number for e in old.entries] != [e.number for e in new.entries]:
+        return FIELD_CHANGED
+
+    odds_changed = False
+    for old_entry, new_entry in zip(old.entries, new.entries):
+        if _entry_without_odds(old_entry) != _entry_without_odds(new_entry):
+            return FIELD_CHANGED
+        # オッズが消えた馬は出走取消とみなす
+        if old_entry.win_odds is not None and new_entry.win_odds is None:
+            return FIELD_CHANGED
+        if (old_entry.win_odds, old_entry.popularity) != (new_entry.win_odds, new_entry.popularity):
+            odds_changed = True
+
+    return ODDS_ONLY if odds_changed else UNCHANGED
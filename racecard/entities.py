@@ -0,0 +1,408 @@
+"""
+騎手・調教師・種牡馬の成績キャッシュ
+出馬表の近走とレース結果から、騎手のコース・馬場別成績、調教師の近走成績、種牡馬の馬場別成績を
+SQLiteに積み上げ、専門家に渡す短い成績表を作る（同じ騎手・調教師・種牡馬を毎レース一から評価し直さない）
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from racecard.models import Race
+from racecard.parser import parse_date, race_date
+from racecard.features import SURFACE_CODES
+
+
+# 成績の種類
+KIND_JOCKEY = "jockey"
+KIND_TRAINER = "trainer"
+KIND_SIRE = "sire"
+
+# 全成績の集計範囲
+SCOPE_ALL = "全体"
+
+# 調教師の調子とみなす直近の走数
+RECENT_RUNS = 20
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS entities (
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        recent TEXT NOT NULL DEFAULT '[]',
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (kind, name)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_entities_accessed_at ON entities(accessed_at)",
+    """CREATE TABLE IF NOT EXISTS entity_stats (
+        kind TEXT NOT NULL,
+        name TEXT NOT NULL,
+        scope TEXT NOT NULL,
+        starts INTEGER NOT NULL,
+        wins INTEGER NOT NULL,
+        top3 INTEGER NOT NULL,
+        PRIMARY KEY (kind, name, scope)
+    )""",
+    """CREATE TABLE IF NOT EXISTS seen_runs (
+        horse TEXT NOT NULL,
+        run_date TEXT NOT NULL,
+        seen_at REAL NOT NULL,
+        PRIMARY KEY (horse, run_date)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_seen_runs_seen_at ON seen_runs(seen_at)",
+    """CREATE TABLE IF NOT EXISTS pending_entries (
+        race_date TEXT NOT NULL,
+        venue TEXT NOT NULL,
+        race_number INTEGER NOT NULL,
+        horse_number INTEGER NOT NULL,
+        horse TEXT NOT NULL,
+        jockey TEXT NOT NULL,
+        trainer TEXT NOT NULL,
+        sire TEXT NOT NULL,
+        surface TEXT NOT NULL,
+        distance INTEGER,
+        observed_at REAL NOT NULL,
+        PRIMARY KEY (race_date, venue, race_number, horse_number)
+    )""",
+    """CREATE TABLE IF NOT EXISTS race_profiles (
+        race_date TEXT NOT NULL,
+        venue TEXT NOT NULL,
+        race_number INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        profiles TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (race_date, venue, race_number)
+    )""",
+]
+
+
+@dataclass(frozen=True)
+class EntityStats:
+    """集計範囲ごとの成績"""
+    starts: int
+    wins: int
+    top3: int
+
+    @property
+    def label(self) -> str:
+        """勝率-複勝率%(出走数)"""
+        if self.starts == 0:
+            return "-"
+        return f"{round(100 * self.wins / self.starts)}-{round(100 * self.top3 / self.starts)}({self.starts})"
+
+
+EMPTY_STATS = EntityStats(0, 0, 0)
+
+
+@dataclass(frozen=True)
+class _Run:
+    """集計する1走（近走から作る場合、調教師と父は今回の出馬表のもの）"""
+    horse: str
+    run_date: str  # ISO形式
+    jockey: str
+    trainer: str
+    sire: str
+    venue: str
+    surface: str  # 芝・ダ・障
+    distance: Optional[int]
+    finish: Optional[int]  # 中止・除外はNone（出走数にだけ数える）
+
+
+def course_scope(venue: str, surface: str, distance: Optional[int]) -> str:
+    """コースの集計範囲（例: 阪神ダ1800）"""
+    return f"{venue}{surface}{distance or ''}"
+
+
+def _scopes(run: _Run) -> List[Tuple[str, str, str]]:
+    """1走が加算される (種類, 名前, 集計範囲)"""
+
+    scopes = [
+        (KIND_JOCKEY, run.jockey, SCOPE_ALL),
+        (KIND_JOCKEY, run.jockey, run.surface),
+        (KIND_JOCKEY, run.jockey, course_scope(run.venue, run.surface, run.distance)),
+        (KIND_TRAINER, run.trainer, SCOPE_ALL),
+        (KIND_SIRE, run.sire, SCOPE_ALL),
+        (KIND_SIRE, run.sire, run.surface),
+    ]
+    return [scope for scope in scopes if scope[1]]
+
+
+class EntityCache:
+    """騎手・調教師・種牡馬の成績のSQLiteキャッシュ（最終参照が古いものから削除）
+
+    出馬表を渡すたびに近走を取り込み（同じ馬・同じ日の走りは一度だけ数える）、
+    今回の出走馬は結果が登録されたときに集計する
+    """
+
+    def __init__(self, path: str, max_entities: int = 20000, max_seen_runs: int = 200000,
+                 max_pending: int = 5000, max_race_profiles: int = 2000):
+        self.path = path
+        self.max_entities = max_entities  # 騎手・調教師・種牡馬の数の上限
+        self.max_seen_runs = max_seen_runs  # 取り込み済みの走りの記録の上限（古いものから忘れる）
+        self.max_pending = max_pending  # 結果待ちの出走馬の上限
+        self.max_race_profiles = max_race_profiles  # 固定したレースごとの成績表の上限
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        # 並行して予想するレースから同時に使われるため、接続は共有してロックで保護する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+
+        # 同じ開催の別レースで同じ騎手・種牡馬を引き直さないよう、更新があるまで参照結果を覚えておく
+        self._memo: Dict[Tuple[str, str, str], EntityStats] = {}
+        self._recent_memo: Dict[Tuple[str, str], EntityStats] = {}
+
+    def _apply(self, runs: Iterable[_Run]) -> int:
+        """未集計の走りを成績に加算し、加算した走数を返す（ロック取得済みで呼ぶ）"""
+
+        now = time.time()
+        applied = 0
+        for run in runs:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO seen_runs (horse, run_date, seen_at) VALUES (?, ?, ?)",
+                (run.horse, run.run_date, now),
+            )
+            if cursor.rowcount == 0:
+                continue
+            applied += 1
+            win = int(run.finish == 1)
+            top3 = int(run.finish is not None and run.finish <= 3)
+            self._conn.executemany(
+                "INSERT INTO entity_stats (kind, name, scope, starts, wins, top3) VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (kind, name, scope) DO UPDATE SET "
+                "starts = starts + 1, wins = wins + excluded.wins, top3 = top3 + excluded.top3",
+                [(kind, name, scope, win, top3) for kind, name, scope in _scopes(run)],
+            )
+            self._conn.executemany(
+                "INSERT INTO entities (kind, name, accessed_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (kind, name) DO UPDATE SET accessed_at = excluded.accessed_at",
+                [(kind, name, now) for kind, name in {(kind, name) for kind, name, _ in _scopes(run)}],
+            )
+            if run.trainer:
+                self._push_recent(run.trainer, run.run_date, top3)
+        if applied:
+            self._memo.clear()
+            self._recent_memo.clear()
+            self._evict()
+        return applied
+
+    def _push_recent(self, trainer: str, run_date: str, top3: int) -> None:
+        """調教師の直近の走り（日付の新しい順に RECENT_RUNS 走）を更新（ロック取得済みで呼ぶ）"""
+
+        (recent,) = self._conn.execute(
+            "SELECT recent FROM entities WHERE kind = ? AND name = ?", (KIND_TRAINER, trainer)
+        ).fetchone()
+        runs = sorted(json.loads(recent) + [[run_date, top3]], reverse=True)[:RECENT_RUNS]
+        self._conn.execute(
+            "UPDATE entities SET recent = ? WHERE kind = ? AND name = ?", (json.dumps(runs), KIND_TRAINER, trainer)
+        )
+
+    def _evict(self) -> None:
+        """上限を超えた分を最終参照・取り込みが古い順に削除（ロック取得済みで呼ぶ）"""
+
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM entities").fetchone()
+        if count > self.max_entities:
+            evicted = self._conn.execute(
+                "SELECT kind, name FROM entities ORDER BY accessed_at ASC LIMIT ?", (count - self.max_entities,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM entity_stats WHERE kind = ? AND name = ?", evicted)
+            self._conn.executemany("DELETE FROM entities WHERE kind = ? AND name = ?", evicted)
+        for table, column, limit in (("seen_runs", "seen_at", self.max_seen_runs),
+                                     ("pending_entries", "observed_at", self.max_pending),
+                                     ("race_profiles", "created_at", self.max_race_profiles)):
+            (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+            if count > limit:
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY {column} ASC LIMIT ?)",
+                    (count - limit,),
+                )
+
+    def observe_race(self, race: Race) -> int:
+        """出馬表の近走を取り込み、今回の出走馬を結果待ちとして登録する（取り込んだ走数を返す）"""
+
+        runs = []
+        for entry in race.entries:
+            for run in entry.past_runs:
+                try:
+                    run_date = parse_date(run.date).isoformat()
+                except ValueError:
+                    continue
+                runs.append(_Run(
+                    horse=entry.name, run_date=run_date, jockey=run.jockey, trainer=entry.trainer,
+                    sire=entry.sire, venue=run.venue, surface=run.surface, distance=run.distance, finish=run.finish,
+                ))
+
+        now = time.time()
+        with self._lock, self._conn:
+            applied = self._apply(runs)
+            if race.race_number is not None:
+                try:
+                    today = race_date(race).isoformat()
+                except ValueError:
+                    return applied
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pending_entries (race_date, venue, race_number, horse_number, horse, "
+                    "jockey, trainer, sire, surface, distance, observed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (today, race.venue, race.race_number, entry.number, entry.name, entry.jockey, entry.trainer,
+                         entry.sire, SURFACE_CODES.get(race.surface, race.surface), race.distance, now)
+                        for entry in race.entries
+                    ],
+                )
+                self._evict()
+        return applied
+
+    def record_result(self, race_date_iso: str, venue: str, race_number: int,
+                      finishes: Dict[int, Optional[int]]) -> int:
+        """結果待ちの出走馬にレース結果（馬番 -> 着順）を反映し、加算した走数を返す"""
+
+        key = (race_date_iso, venue, race_number)
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT horse_number, horse, jockey, trainer, sire, surface, distance FROM pending_entries "
+                "WHERE race_date = ? AND venue = ? AND race_number = ?", key,
+            ).fetchall()
+            runs = [
+                _Run(horse=horse, run_date=race_date_iso, jockey=jockey, trainer=trainer, sire=sire, venue=venue,
+                     surface=surface, distance=distance, finish=finishes[number])
+                for number, horse, jockey, trainer, sire, surface, distance in rows
+                if number in finishes
+            ]
+            applied = self._apply(runs)
+            self._conn.execute(
+                "DELETE FROM pending_entries WHERE race_date = ? AND venue = ? AND race_number = ?", key
+            )
+        return applied
+
+    def stats(self, kind: str, name: str, scope: str = SCOPE_ALL) -> EntityStats:
+        """成績（記録がなければ出走数0）"""
+
+        memo_key = (kind, name, scope)
+        with self._lock, self._conn:
+            cached = self._memo.get(memo_key)
+            if cached is not None:
+                return cached
+            row = self._conn.execute(
+                "SELECT starts, wins, top3 FROM entity_stats WHERE kind = ? AND name = ? AND scope = ?", memo_key
+            ).fetchone()
+            self._conn.execute(
+                "UPDATE entities SET accessed_at = ? WHERE kind = ? AND name = ?", (time.time(), kind, name)
+            )
+            stats = EntityStats(*row) if row else EMPTY_STATS
+            self._memo[memo_key] = stats
+            return stats
+
+    def trainer_form(self, trainer: str) -> EntityStats:
+        """調教師の直近 RECENT_RUNS 走の成績（勝利数は数えず複勝のみ）"""
+
+        memo_key = (KIND_TRAINER, trainer)
+        with self._lock:
+            cached = self._recent_memo.get(memo_key)
+            if cached is not None:
+                return cached
+            row = self._conn.execute(
+                "SELECT recent FROM entities WHERE kind = ? AND name = ?", memo_key
+            ).fetchone()
+            runs = json.loads(row[0]) if row else []
+            form = EntityStats(len(runs), 0, sum(top3 for _, top3 in runs))
+            self._recent_memo[memo_key] = form
+            return form
+
+    def race_profiles(self, race: Race) -> List[Dict[str, Any]]:
+        """出走馬ごとの騎手・調教師・父の成績"""
+
+        surface = SURFACE_CODES.get(race.surface, race.surface)
+        course = course_scope(race.venue, surface, race.distance)
+        profiles = []
+        for entry in race.entries:
+            rides = sum(run.jockey == entry.jockey for run in entry.past_runs)
+            if not entry.past_runs:
+                change = "-"
+            elif entry.past_runs[0].jockey == entry.jockey:
+                change = f"継続({rides})"
+            else:
+                change = f"乗替({rides})"
+            profiles.append({
+                "horse_number": entry.number,
+                "jockey_course": self.stats(KIND_JOCKEY, entry.jockey, course),
+                "jockey_surface": self.stats(KIND_JOCKEY, entry.jockey, surface),
+                "jockey_change": change,
+                "trainer_form": self.trainer_form(entry.trainer),
+                "sire_surface": self.stats(KIND_SIRE, entry.sire, surface),
+            })
+        return profiles
+
+    def format_profiles(self, race: Race) -> str:
+        """騎手・調教師・父の成績表（プロンプト用）
+
+        成績は他のレースの取り込みや結果の登録で変わるため、レースごとに最初に作った成績表を固定して使い回す
+        （同じレースのプロンプトが予想の順序や並行して予想するレースに左右されず、応答キャッシュ・プロンプトキャッシュが効く）。
+        出走馬・騎手・条件が変わった場合だけ作り直す
+        """
+
+        if race.race_number is None:
+            return self._render_profiles(race)
+        try:
+            key = (race_date(race).isoformat(), race.venue, race.race_number)
+        except ValueError:
+            return self._render_profiles(race)
+
+        fingerprint = json.dumps(
+            [race.surface, race.distance] + [[e.number, e.name, e.jockey, e.trainer, e.sire] for e in race.entries],
+            ensure_ascii=False,
+        )
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, profiles FROM race_profiles WHERE race_date = ? AND venue = ? AND race_number = ?",
+                key,
+            ).fetchone()
+        if row is not None and row[0] == fingerprint:
+            return row[1]
+
+        profiles = self._render_profiles(race)
+        with self._lock, self._conn:
+            # 並行して同じレースの成績表を作った場合は、先に保存された方に揃える
+            self._conn.execute(
+                "INSERT INTO race_profiles (race_date, venue, race_number, fingerprint, profiles, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (race_date, venue, race_number) DO UPDATE SET "
+                "fingerprint = excluded.fingerprint, profiles = excluded.profiles, created_at = excluded.created_at "
+                "WHERE fingerprint != excluded.fingerprint",
+                (*key, fingerprint, profiles, time.time()),
+            )
+            (stored,) = self._conn.execute(
+                "SELECT profiles FROM race_profiles WHERE race_date = ? AND venue = ? AND race_number = ?", key
+            ).fetchone()
+            self._evict()
+        return stored
+
+    def _render_profiles(self, race: Race) -> str:
+        """現在の成績から成績表を作る"""
+
+        surface = SURFACE_CODES.get(race.surface, race.surface)
+        lines = [
+            f"騎手・調教師・父の成績（蓄積データ。勝率-複勝率%(出走数)、騎手コース={course_scope(race.venue, surface, race.distance)}、"
+            f"馬場={surface}、乗替=前走から(この騎手の近走騎乗数)、調教師=直近{RECENT_RUNS}走の複勝率%(走数)）",
+            "馬番|騎手コース|騎手馬場|乗替|調教師|父馬場",
+        ]
+        for profile in self.race_profiles(race):
+            form = profile["trainer_form"]
+            lines.append("|".join([
+                str(profile["horse_number"]),
+                profile["jockey_course"].label,
+                profile["jockey_surface"].label,
+                profile["jockey_change"],
+                f"{round(100 * form.top3 / form.starts)}({form.starts})" if form.starts else "-",
+                profile["sire_surface"].label,
+            ]))
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
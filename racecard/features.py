@@ -0,0 +1,205 @@
+"""
+近走からの指標の事前計算
+通過順・上がり3F・距離馬場・着差から、脚質・前行指数・末脚・距離馬場適性と、出走馬全体の想定ペースを求める
+（LLMが毎回近走から読み解く代わりに、決定的に計算した短い表をプロンプトに渡す）
+"""
+
+from typing import Dict, List, Optional
+from dataclasses import dataclass
+import numpy as np
+
+from racecard.models import Race
+
+
+# 近走の重み（新しい順、走数が少ない場合は先頭から使って正規化）
+RECENCY_WEIGHTS = np.array([0.4, 0.3, 0.2, 0.1])
+
+# 距離適性で同距離とみなす差（メートル）
+DISTANCE_TOLERANCE = 200
+
+# 脚質（初角の相対位置の加重平均の上限、逃げは初角先頭の割合で判定）
+STYLE_FRONT = "逃げ"
+STYLE_STALKER = "先行"
+STYLE_MIDFIELD = "差し"
+STYLE_CLOSER = "追込"
+LEADER_SHARE = 0.5  # 初角先頭だった割合がこれ以上なら逃げ
+STALKER_LIMIT = 0.3  # 相対位置がこれ以下なら先行
+MIDFIELD_LIMIT = 0.65  # 相対位置がこれ以下なら差し（超えると追込）
+
+# 想定ペース
+PACE_FAST = "ハイ"
+PACE_EVEN = "平均"
+PACE_SLOW = "スロー"
+
+# 出馬表の馬場表記 -> 近走の馬場表記
+SURFACE_CODES = {"芝": "芝", "ダート": "ダ", "障害": "障"}
+
+
+@dataclass
+class RaceFeatures:
+    """出走馬ごとの指標（配列は馬番順、算出できない値はnan）"""
+    horse_numbers: np.ndarray  # 馬番
+    runs: np.ndarray  # 集計に使った近走の数
+    running_styles: List[str]  # 脚質（近走に通過順がなければ空文字）
+    early_index: np.ndarray  # 前行指数（0-100、初角の相対位置を近走の新しさで加重、高いほど前）
+    turn_position: np.ndarray  # 最終コーナーの相対位置（0が先頭、1が最後方）
+    closing_3f: np.ndarray  # 上がり3Fの加重平均（今回と同じ馬場の近走、芝とダートの上がりは比べられないため）
+    closing_rank: np.ndarray  # 上がり3Fの出走馬内順位（1が最速）
+    straight_gain: np.ndarray  # 最終コーナーから着順までに上げた順位の平均
+    fit_runs: np.ndarray  # 今回と同じ馬場・近い距離の近走の数
+    fit_score: np.ndarray  # 距離馬場適性（同条件の近走の相対着順を反転、0-100）
+    mean_margin: np.ndarray  # 勝ち馬との着差の平均（秒）
+    pace: str  # 想定ペース
+    leaders: List[int]  # 前行指数の上位（先行争いの中心となる馬番）
+
+
+def _weighted_mean(values: np.ndarray) -> np.ndarray:
+    """nanを除いた近走の新しさによる加重平均（行ごと）"""
+
+    weights = np.broadcast_to(RECENCY_WEIGHTS[:values.shape[1]], values.shape)
+    weights = np.where(np.isnan(values), 0.0, weights)
+    total = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, np.nansum(values * weights, axis=1) / total, np.nan)
+
+
+def _nanmean(values: np.ndarray) -> np.ndarray:
+    count = np.sum(~np.isnan(values), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, np.nansum(values, axis=1) / np.maximum(count, 1), np.nan)
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    """昇順の順位（1始まり、nanはnan）"""
+
+    ranks = np.full(len(values), np.nan)
+    known = np.flatnonzero(~np.isnan(values))
+    ranks[known[np.argsort(values[known], kind="stable")]] = np.arange(1, len(known) + 1)
+    return ranks
+
+
+def _past_run_arrays(race: Race) -> Dict[str, np.ndarray]:
+    """近走を (出走馬, 走) の配列にする（欠損はnan）"""
+
+    depth = len(RECENCY_WEIGHTS)
+    shape = (len(race.entries), depth)
+    arrays = {name: np.full(shape, np.nan) for name in
+              ("first_turn", "last_turn", "finish", "field_size", "final_3f", "distance", "margin")}
+    same_surface = np.zeros(shape, dtype=bool)
+    surface = SURFACE_CODES.get(race.surface, race.surface)
+
+    for i, entry in enumerate(race.entries):
+        for j, run in enumerate(entry.past_runs[:depth]):
+            if run.passing_orders:
+                arrays["first_turn"][i, j] = run.passing_orders[0]
+                arrays["last_turn"][i, j] = run.passing_orders[-1]
+            for name, value in (("finish", run.finish), ("field_size", run.field_size), ("final_3f", run.final_3f),
+                                ("distance", run.distance), ("margin", run.margin)):
+                if value is not None:
+                    arrays[name][i, j] = value
+            same_surface[i, j] = run.surface == surface
+    arrays["same_surface"] = same_surface
+    return arrays
+
+
+def _relative(position: np.ndarray, field_size: np.ndarray) -> np.ndarray:
+    """順位を 0（先頭）〜1（最後方）に正規化"""
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.clip((position - 1.0) / (field_size - 1.0), 0.0, 1.0)
+
+
+def projected_pace(styles: List[str], field_size: int) -> str:
+    """逃げ・先行馬の数から想定ペースを判定"""
+
+    front = styles.count(STYLE_FRONT)
+    forward = front + styles.count(STYLE_STALKER)
+    if front >= 2 or (field_size and forward / field_size >= 0.5):
+        return PACE_FAST
+    if front == 0 and (not field_size or forward / field_size < 0.25):
+        return PACE_SLOW
+    return PACE_EVEN
+
+
+def compute_features(race: Race) -> RaceFeatures:
+    """出走馬全体の指標を計算"""
+
+    arrays = _past_run_arrays(race)
+    first_rel = _relative(arrays["first_turn"], arrays["field_size"])
+    last_rel = _relative(arrays["last_turn"], arrays["field_size"])
+    runs = np.sum(~np.isnan(arrays["finish"]) | ~np.isnan(arrays["first_turn"]), axis=1)
+
+    # 脚質と前行指数
+    early = _weighted_mean(first_rel)
+    led = np.where(np.isnan(arrays["first_turn"]), np.nan, (arrays["first_turn"] == 1).astype(float))
+    lead_share = _nanmean(led)
+    styles = np.select(
+        [np.isnan(early), lead_share >= LEADER_SHARE, early <= STALKER_LIMIT, early <= MIDFIELD_LIMIT],
+        ["", STYLE_FRONT, STYLE_STALKER, STYLE_MIDFIELD],
+        STYLE_CLOSER,
+    ).tolist()
+    early_index = np.round((1.0 - early) * 100.0, 0)
+
+    # 末脚（今回と同じ馬場の上がり3F）
+    same = arrays["same_surface"]
+    closing_3f = _weighted_mean(np.where(same, arrays["final_3f"], np.nan))
+    straight_gain = _nanmean(arrays["last_turn"] - arrays["finish"])
+
+    # 距離馬場適性（同じ馬場・近い距離の近走の相対着順）
+    near = same & (np.abs(arrays["distance"] - (race.distance or np.nan)) <= DISTANCE_TOLERANCE)
+    fit_finish = np.where(near, _relative(arrays["finish"], arrays["field_size"]), np.nan)
+    fit_score = np.round((1.0 - _nanmean(fit_finish)) * 100.0, 0)
+
+    numbers = np.array([entry.number for entry in race.entries], dtype=int)
+    order = np.argsort(-np.nan_to_num(early_index, nan=-1.0), kind="stable")
+    leaders = [int(numbers[i]) for i in order[:3] if not np.isnan(early_index[i])]
+
+    return RaceFeatures(
+        horse_numbers=numbers,
+        runs=runs,
+        running_styles=styles,
+        early_index=early_index,
+        turn_position=np.round(_weighted_mean(last_rel), 2),
+        closing_3f=np.round(closing_3f, 1),
+        closing_rank=_rank(closing_3f),
+        straight_gain=np.round(straight_gain, 1),
+        fit_runs=np.sum(near, axis=1),
+        fit_score=fit_score,
+        mean_margin=np.round(_nanmean(arrays["margin"]), 1),
+        pace=projected_pace(styles, race.field_size),
+        leaders=leaders,
+    )
+
+
+def _cell(value: float, digits: Optional[int] = None) -> str:
+    if np.isnan(value):
+        return "-"
+    if digits is None:
+        return str(int(value))
+    return f"{value:.{digits}f}"
+
+
+def format_features(race: Race, features: Optional[RaceFeatures] = None) -> str:
+    """指標の表と想定ペース（プロンプト用）"""
+
+    f = features or compute_features(race)
+    styles = f.running_styles
+    counts = " ".join(f"{style}{styles.count(style)}" for style in (STYLE_FRONT, STYLE_STALKER, STYLE_MIDFIELD, STYLE_CLOSER))
+    lines = [
+        f"指標（近走{len(RECENCY_WEIGHTS)}走までから算出。前行=初角位置0-100で高いほど前、4角=0先頭-1最後方、"
+        f"上り=上がり3F加重平均(順位)、直線=4角から上げた順位、適性={race.surface}{race.distance or ''}±{DISTANCE_TOLERANCE}mの相対着順0-100(走数)、差=平均着差秒）",
+        "馬番|脚質|前行|4角|上り|直線|適性|差",
+    ]
+    for i, number in enumerate(f.horse_numbers):
+        lines.append("|".join([
+            str(number),
+            styles[i] or "-",
+            _cell(f.early_index[i]),
+            _cell(f.turn_position[i], 2),
+            f"{_cell(f.closing_3f[i], 1)}({_cell(f.closing_rank[i])})",
+            _cell(f.straight_gain[i], 1),
+            f"{_cell(f.fit_score[i])}({int(f.fit_runs[i])})",
+            _cell(f.mean_margin[i], 1),
+        ]))
+    lines.append(f"想定ペース: {f.pace}（{counts}） 先行争い: {', '.join(map(str, f.leaders)) or '-'}")
+    return "\n".join(lines)
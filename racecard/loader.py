@@ -0,0 +1,84 @@
+"""
+レース情報の一括読み込み
+ファイル・ディレクトリ・globパターンを受け付け、複数レースを連結したファイルはレースヘッダーで分割して1レースずつ返す
+（ジェネレーターで読むため、1開催分をまとめて読み込まない）
+"""
+
+from typing import Iterable, Iterator, List
+from dataclasses import dataclass
+import glob
+import os
+
+from racecard.parser import HEADER_PATTERN, RACE_NUMBER_PATTERN, ENTRY_PATTERN
+
+
+# ディレクトリ指定時に読み込むファイル
+RACE_FILE_PATTERN = "*.txt"
+
+
+@dataclass(frozen=True)
+class RaceText:
+    """読み込んだレース情報"""
+    source: str  # 読み込み元（複数レースのファイルは「パス#何レース目か」）
+    text: str  # レース情報（netkeiba形式）
+
+
+def expand_inputs(inputs: Iterable[str]) -> Iterator[str]:
+    """入力（ファイル・ディレクトリ・globパターン）をファイルパスに展開（入力ごとにパス順）"""
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            paths = glob.glob(os.path.join(pattern, "**", RACE_FILE_PATTERN), recursive=True)
+        elif os.path.isfile(pattern):
+            paths = [pattern]
+        else:
+            paths = [path for path in glob.glob(pattern) if os.path.isfile(path)]
+        if not paths:
+            raise FileNotFoundError(f"{pattern} に該当するレース情報ファイルがありません")
+        yield from sorted(paths)
+
+
+def split_races(lines: Iterable[str]) -> Iterator[str]:
+    """連結されたレース情報をレースごとに分割
+
+    開催日の行（例: 2025年6月22日（日曜） 3回阪神6日）で区切る。開催日の行が省略され、
+    出走馬の後に「11レース」の行が続く場合は直前の開催日の行の開催日・開催だけを引き継いで区切る
+    （発走時刻は前のレースのものなので引き継がない）
+    """
+
+    chunk: List[str] = []
+    header = None
+    has_entries = False
+    for line in lines:
+        stripped = line.rstrip()
+        if header_match := HEADER_PATTERN.match(stripped):
+            if any(part.strip() for part in chunk):
+                yield "\n".join(chunk)
+            chunk, header, has_entries = [], stripped[:header_match.end(2)], False
+        elif has_entries and header is not None and RACE_NUMBER_PATTERN.match(stripped.strip()):
+            yield "\n".join(chunk)
+            chunk, has_entries = [header], False
+        elif ENTRY_PATTERN.match(stripped):
+            has_entries = True
+        chunk.append(stripped)
+    if any(part.strip() for part in chunk):
+        yield "\n".join(chunk)
+
+
+def iter_races(inputs: Iterable[str]) -> Iterator[RaceText]:
+    """入力からレース情報を1レースずつ読み込む"""
+
+    for path in expand_inputs(inputs):
+        with open(path, "r", encoding="utf-8") as f:
+            races = split_races(f)
+            first = next(races, None)
+            if first is None:
+                continue
+            second = next(races, None)
+            if second is None:
+                yield RaceText(source=path, text=first)
+                continue
+            yield RaceText(source=f"{path}#1", text=first)
+            yield RaceText(source=f"{path}#2", text=second)
+            for number, text in enumerate(races, 3):
+                yield RaceText(source=f"{path}#{number}", text=text)
@@ -0,0 +1,78 @@
+"""
+出馬表のデータモデル
+netkeiba形式のレース情報を構造化したもの
+"""
+
+from typing import List, Optional
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class PastRun:
+    """近走成績（1走分）"""
+    date: str  # 開催日（例: 2025年2月8日）
+    venue: str  # 競馬場
+    race_name: str  # レース名
+    race_class: str  # クラス（例: 3勝ク）
+    finish: Optional[int]  # 着順（中止・除外などはNone）
+    finish_label: str  # 着順の表記（例: 11着、中止）
+    field_size: Optional[int]  # 出走頭数
+    horse_number: Optional[int]  # 馬番
+    popularity: Optional[int]  # 人気
+    jockey: str  # 騎手
+    weight_carried: Optional[float]  # 斤量
+    distance: Optional[int]  # 距離（メートル）
+    surface: str  # 芝・ダ・障
+    time: str  # 走破タイム
+    going: str  # 馬場状態
+    body_weight: Optional[int]  # 馬体重
+    passing_orders: List[int] = field(default_factory=list)  # 通過順
+    final_3f: Optional[float] = None  # 上がり3F
+    opponent: str = ""  # 勝ち馬（自身が勝った場合は2着馬）
+    margin: Optional[float] = None  # 着差（秒）
+
+
+@dataclass(slots=True)
+class Entry:
+    """出走馬"""
+    frame: int  # 枠番
+    number: int  # 馬番
+    name: str  # 馬名
+    win_odds: Optional[float]  # 単勝オッズ
+    popularity: Optional[int]  # 人気
+    body_weight: Optional[int]  # 馬体重
+    weight_diff: Optional[int]  # 馬体重の増減
+    owner: str  # 馬主
+    trainer: str  # 調教師
+    stable: str  # 所属（栗東・美浦など）
+    sire: str  # 父
+    dam: str  # 母
+    damsire: str  # 母の父
+    sex: str  # 性別
+    age: Optional[int]  # 年齢
+    coat: str  # 毛色
+    weight_carried: Optional[float]  # 負担重量
+    jockey: str  # 騎手
+    blinkers: bool = False  # ブリンカー着用
+    past_runs: List[PastRun] = field(default_factory=list)  # 近走（新しい順、最大4走）
+
+
+@dataclass(slots=True)
+class Race:
+    """レース"""
+    date: str  # 開催日
+    meeting: str  # 開催（例: 3回阪神6日）
+    venue: str  # 競馬場
+    post_time: str  # 発走時刻（HH:MM）
+    race_number: Optional[int]  # レース番号
+    race_name: str  # レース名
+    conditions: List[str]  # 条件（年齢・クラス・記号・重量）
+    distance: Optional[int]  # 距離（メートル）
+    surface: str  # 芝・ダート・障害
+    direction: str  # 右・左・直線
+    entries: List[Entry] = field(default_factory=list)  # 出走馬（馬番順）
+
+    @property
+    def field_size(self) -> int:
+        """出走頭数"""
+        return len(self.entries)
@@ -0,0 +1,278 @@
+"""
+出馬表パーサー
+netkeiba.comからコピーしたレース情報（data/race.txt形式）をRace/Entry/PastRunに変換する
+"""
+
+from typing import List, Optional
+from datetime import date, datetime
+import re
+
+from racecard.models import Race, Entry, PastRun
+
+
+# レースヘッダー
+HEADER_PATTERN = re.compile(r"^(\d{4}年\d{1,2}月\d{1,2}日)（.+?）\s*(\d+回(\D+?)\d+日)(?:\s*発走時刻：(\d{1,2})時(\d{2})分)?")
+RACE_NUMBER_PATTERN = re.compile(r"^(\d{1,2})レース$")
+COURSE_PATTERN = re.compile(r"コース：([\d,]+)メートル（(芝|ダート|障害)・?(\S*?)）")
+
+# 出走馬
+ENTRY_PATTERN = re.compile(r"^枠(\d)\S*\t(\d{1,2})\s*$")
+ODDS_PATTERN = re.compile(r"^(\d+\.\d)$")
+POPULARITY_PATTERN = re.compile(r"^\((\d+)番人気\)$")
+BODY_WEIGHT_PATTERN = re.compile(r"^(\d+)kg\(([+-]?\d+)\)$")
+TRAINER_PATTERN = re.compile(r"^(.+?)\((\S+)\)$")
+SEX_AGE_PATTERN = re.compile(r"^(牡|牝|せん|セ)(\d+)/(\S+)$")
+CARRIED_PATTERN = re.compile(r"^(\d+\.\d)kg$")
+
+# 近走
+PAST_RUN_PATTERN = re.compile(r"^(\d{4}年\d{1,2}月\d{1,2}日)\t(\S+)")
+FINISH_PATTERN = re.compile(r"^(\S+?)\t(\d+)頭(\d+)番$")
+PAST_POPULARITY_PATTERN = re.compile(r"^(\d+)番人気$")
+PAST_JOCKEY_PATTERN = re.compile(r"^(.+)\t(\d+\.\d)kg$")
+DISTANCE_PATTERN = re.compile(r"^(\d+)(芝|ダ|障)")
+TIME_PATTERN = re.compile(r"^\d+:\d{2}\.\d$")
+GOINGS = ("良", "稍重", "重", "不良")
+PAST_BODY_WEIGHT_PATTERN = re.compile(r"^(\d+)kg$")
+PASSING_PATTERN = re.compile(r"^\d+(?:\t\d+)*$")
+FINAL_3F_PATTERN = re.compile(r"^3F (\d+\.\d)$")
+OPPONENT_PATTERN = re.compile(r"^(.+)\((-?\d+\.\d)\)$")
+
+# 出走馬一覧の終わり
+FOOTER_MARKERS = ("オッズは最終オッズ", "コースレコード")
+
+# 開催日（例: 2025年6月22日）
+RACE_DATE_PATTERN = re.compile(r"^(\d{4})年(\d{1,2})月(\d{1,2})日$")
+
+
+def _to_int(value: str) -> Optional[int]:
+    try:
+        return int(value.replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _parse_past_run(lines: List[str]) -> PastRun:
+    """近走1走分の行をPastRunに変換"""
+
+    date_match = PAST_RUN_PATTERN.match(lines[0])
+    name, _, race_class = lines[1].partition("\t") if len(lines) > 1 else ("", "", "")
+
+    run = PastRun(
+        date=date_match.group(1),
+        venue=date_match.group(2),
+        race_name=name.strip(),
+        race_class=race_class.strip(),
+        finish=None,
+        finish_label="",
+        field_size=None,
+        horse_number=None,
+        popularity=None,
+        jockey="",
+        weight_carried=None,
+        distance=None,
+        surface="",
+        time="",
+        going="",
+        body_weight=None,
+    )
+
+    # 取消・中止などで欠ける行があるため、位置ではなく形式で判定する
+    for line in lines[2:]:
+        if match := FINISH_PATTERN.match(line):
+            run.finish_label = match.group(1)
+            run.finish = _to_int(match.group(1).rstrip("着"))
+            run.field_size = int(match.group(2))
+            run.horse_number = int(match.group(3))
+        elif match := PAST_POPULARITY_PATTERN.match(line):
+            run.popularity = int(match.group(1))
+        elif match := PAST_JOCKEY_PATTERN.match(line):
+            run.jockey = match.group(1).strip()
+            run.weight_carried = float(match.group(2))
+        elif match := DISTANCE_PATTERN.match(line):
+            run.distance = int(match.group(1))
+            run.surface = match.group(2)
+        elif TIME_PATTERN.match(line):
+            run.time = line
+        elif line in GOINGS:
+            run.going = line
+        elif match := PAST_BODY_WEIGHT_PATTERN.match(line):
+            run.body_weight = int(match.group(1))
+        elif PASSING_PATTERN.match(line):
+            run.passing_orders = [int(order) for order in line.split("\t")]
+        elif match := FINAL_3F_PATTERN.match(line):
+            run.final_3f = float(match.group(1))
+        elif match := OPPONENT_PATTERN.match(line):
+            run.opponent = match.group(1)
+            run.margin = float(match.group(2))
+
+    return run
+
+
+def _parse_entry(lines: List[str]) -> Entry:
+    """出走馬1頭分の行をEntryに変換"""
+
+    entry_match = ENTRY_PATTERN.match(lines[0])
+    entry = Entry(
+        frame=int(entry_match.group(1)),
+        number=int(entry_match.group(2)),
+        name="",
+        win_odds=None,
+        popularity=None,
+        body_weight=None,
+        weight_diff=None,
+        owner="",
+        trainer="",
+        stable="",
+        sire="",
+        dam="",
+        damsire="",
+        sex="",
+        age=None,
+        coat="",
+        weight_carried=None,
+        jockey="",
+    )
+
+    # 馬柱の見出し部分（近走の前まで）
+    index = 1
+    previous = ""
+    while index < len(lines) and not PAST_RUN_PATTERN.match(lines[index]):
+        line = lines[index].strip()
+        index += 1
+
+        if line == "ブリンカー着用":
+            entry.blinkers = True
+        elif line == "勝負服の画像":
+            pass
+        elif not entry.name:
+            entry.name = line
+        elif match := ODDS_PATTERN.match(line):
+            entry.win_odds = float(match.group(1))
+        elif match := POPULARITY_PATTERN.match(line):
+            entry.popularity = int(match.group(1))
+        elif match := BODY_WEIGHT_PATTERN.match(line):
+            entry.body_weight = int(match.group(1))
+            entry.weight_diff = int(match.group(2))
+        elif line.startswith("父："):
+            entry.sire = line[2:]
+        elif line.startswith("母："):
+            entry.dam = line[2:]
+        elif line.startswith("(母の父："):
+            entry.damsire = line[5:].rstrip(")")
+        elif match := SEX_AGE_PATTERN.match(line):
+            entry.sex = match.group(1)
+            entry.age = int(match.group(2))
+            entry.coat = match.group(3)
+        elif match := CARRIED_PATTERN.match(line):
+            entry.weight_carried = float(match.group(1))
+        elif CARRIED_PATTERN.match(previous):
+            # 負担重量の次の行が騎手名
+            entry.jockey = line
+        elif not entry.owner and (BODY_WEIGHT_PATTERN.match(previous) or previous == "計不"):
+            # 馬体重の次の行が馬主名
+            entry.owner = line
+        elif match := TRAINER_PATTERN.match(line):
+            entry.trainer = match.group(1).strip()
+            entry.stable = match.group(2)
+        previous = line
+
+    # 近走（日付行で区切る）
+    run_lines: List[str] = []
+    for line in lines[index:]:
+        if PAST_RUN_PATTERN.match(line) and run_lines:
+            entry.past_runs.append(_parse_past_run(run_lines))
+            run_lines = []
+        run_lines.append(line)
+    if run_lines:
+        entry.past_runs.append(_parse_past_run(run_lines))
+
+    return entry
+
+
+def parse_race_card(text: str) -> Race:
+    """netkeiba形式のレース情報をRaceに変換
+
+    ヘッダーまたは出走馬が見つからない場合はValueErrorを送出する
+    """
+
+    # 空行や「勝負服の画像」「印刷用ページ」などは行の形式で読み飛ばす
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+
+    header_match = None
+    header_index = 0
+    for header_index, line in enumerate(lines):
+        if header_match := HEADER_PATTERN.match(line):
+            break
+    if header_match is None:
+        raise ValueError("レースヘッダー（開催日・開催）が見つかりません")
+
+    post_time = ""
+    if header_match.group(4):
+        post_time = f"{int(header_match.group(4)):02d}:{header_match.group(5)}"
+
+    race = Race(
+        date=header_match.group(1),
+        meeting=header_match.group(2),
+        venue=header_match.group(3),
+        post_time=post_time,
+        race_number=None,
+        race_name="",
+        conditions=[],
+        distance=None,
+        surface="",
+        direction="",
+    )
+
+    index = header_index + 1
+    while index < len(lines) and not ENTRY_PATTERN.match(lines[index]):
+        line = lines[index]
+        if match := RACE_NUMBER_PATTERN.match(line.strip()):
+            race.race_number = int(match.group(1))
+        elif course_match := COURSE_PATTERN.search(line):
+            # 条件行の直前の行がレース名
+            race.race_name = lines[index - 1].strip()
+            race.conditions = [part.strip() for part in line.split("\t") if part.strip() and "コース：" not in part]
+            race.distance = _to_int(course_match.group(1))
+            race.surface = course_match.group(2)
+            race.direction = course_match.group(3)
+        index += 1
+
+    # 出走馬ごとに行をまとめる
+    entry_lines: List[str] = []
+    for line in lines[index:]:
+        if line.startswith(FOOTER_MARKERS):
+            break
+        if ENTRY_PATTERN.match(line) and entry_lines:
+            race.entries.append(_parse_entry(entry_lines))
+            entry_lines = []
+        entry_lines.append(line)
+    if entry_lines:
+        race.entries.append(_parse_entry(entry_lines))
+
+    if not race.entries:
+        raise ValueError("出走馬が見つかりません")
+
+    return race
+
+
+def parse_date(text: str) -> date:
+    """「2025年6月22日」形式の日付（解釈できない場合はValueError）"""
+
+    match = RACE_DATE_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"開催日を解釈できません: {text}")
+    return date(*(int(part) for part in match.groups()))
+
+
+def race_date(race: Race) -> date:
+    """開催日（日付として解釈できない場合はValueError）"""
+    return parse_date(race.date)
+
+
+def post_datetime(race: Race) -> datetime:
+    """発走日時（発走時刻がない出馬表はValueError）"""
+
+    if not race.post_time:
+        raise ValueError(f"{race.date} {race.meeting} {race.race_number}R: 発走時刻がありません")
+    hour, minute = (int(part) for part in race.post_time.split(":"))
+    return datetime.combine(race_date(race), datetime.min.time()).replace(hour=hour, minute=minute)
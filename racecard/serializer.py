@@ -0,0 +1,116 @@
+"""
+出馬表のコンパクトなテキスト表現
+パース済みのRaceを、生のコピー＆ペーストより大幅に短いプロンプト用テキストに変換する
+"""
+
+from typing import List, Optional
+import re
+
+from racecard.models import Race, Entry, PastRun
+
+
+DATE_PATTERN = re.compile(r"(\d{4})年(\d{1,2})月(\d{1,2})日")
+
+
+def _value(value: Optional[object], suffix: str = "") -> str:
+    """Noneは「-」で表す"""
+    return "-" if value is None else f"{value}{suffix}"
+
+
+def _short_date(date: str) -> str:
+    """2025年2月8日 -> 25/2/8"""
+    match = DATE_PATTERN.match(date)
+    if not match:
+        return date
+    return f"{match.group(1)[2:]}/{match.group(2)}/{match.group(3)}"
+
+
+def format_race_header(race: Race) -> str:
+    """レース概要（開催・条件・コース）"""
+
+    lines = [
+        f"{race.date} {race.meeting} {_value(race.race_number, 'R')} {race.race_name} 発走{race.post_time or '-'}",
+        f"{' '.join(race.conditions)} {race.surface}{_value(race.distance, 'm')}{race.direction} {race.field_size}頭",
+    ]
+    return "\n".join(lines)
+
+
+def format_body_weight(entry: Entry) -> str:
+    """馬体重（増減）"""
+    if entry.body_weight is None:
+        return "-"
+    if entry.weight_diff is None:
+        return str(entry.body_weight)
+    return f"{entry.body_weight}({entry.weight_diff:+d})"
+
+
+# 近走の項目（表示順）
+PAST_RUN_FIELDS = {
+    "日付場": lambda r: f"{_short_date(r.date)}{r.venue}",
+    "レース": lambda r: r.race_name or r.race_class or "-",
+    "着順/頭数": lambda r: f"{r.finish_label or '-'}/{_value(r.field_size, '頭')}",
+    "人気": lambda r: _value(r.popularity, "人"),
+    "騎手": lambda r: r.jockey or "-",
+    "距離馬場": lambda r: f"{r.surface}{_value(r.distance)}{r.going}",
+    "タイム": lambda r: r.time or "-",
+    "通過順": lambda r: "-".join(str(order) for order in r.passing_orders) or "-",
+    "上がり3F": lambda r: _value(r.final_3f),
+    "着差秒": lambda r: f"差{_value(r.margin)}",
+}
+
+
+def format_past_run(run: PastRun, fields: Optional[List[str]] = None) -> str:
+    """近走1走分を1行で表す"""
+
+    selected = fields or list(PAST_RUN_FIELDS)
+    return " ".join(PAST_RUN_FIELDS[name](run) for name in selected)
+
+
+# 出走馬一覧の列（表示順）
+ENTRY_COLUMNS = {
+    "馬番": lambda e: str(e.number),
+    "枠": lambda e: str(e.frame),
+    "馬名": lambda e: e.name + ("(B)" if e.blinkers else ""),
+    "性齢": lambda e: f"{e.sex}{_value(e.age)}",
+    "斤量": lambda e: _value(e.weight_carried),
+    "騎手": lambda e: e.jockey,
+    "調教師": lambda e: f"{e.trainer}({e.stable})" if e.stable else e.trainer,
+    "単勝": lambda e: _value(e.win_odds),
+    "人気": lambda e: _value(e.popularity),
+    "馬体重": format_body_weight,
+    "父": lambda e: e.sire,
+    "母父": lambda e: e.damsire,
+}
+
+
+def format_entry_table(race: Race, columns: Optional[List[str]] = None) -> str:
+    """出走馬一覧を区切り文字付きの表にする"""
+
+    selected = columns or list(ENTRY_COLUMNS)
+
+    lines = ["|".join(selected)]
+    for entry in race.entries:
+        lines.append("|".join(ENTRY_COLUMNS[column](entry) for column in selected))
+    return "\n".join(lines)
+
+
+def format_past_runs(race: Race, fields: Optional[List[str]] = None) -> str:
+    """全出走馬の近走"""
+
+    selected = fields or list(PAST_RUN_FIELDS)
+    lines = [f"近走（{' '.join(selected)}）"]
+    for entry in race.entries:
+        lines.append(f"{entry.number} {entry.name}:")
+        for run in entry.past_runs:
+            lines.append(f"  {format_past_run(run, selected)}")
+    return "\n".join(lines)
+
+
+def format_race_card(race: Race) -> str:
+    """Raceをプロンプト用のコンパクトなテキストに変換"""
+
+    return "\n\n".join([
+        format_race_header(race),
+        format_entry_table(race),
+        format_past_runs(race),
+    ])
@@ -0,0 +1,86 @@
+"""
+専門家ごとの出馬表ビュー
+各エージェントの分析に必要な列だけを出馬表から取り出し、プロンプトを小さくする
+（近走から読み取る脚質・末脚・距離適性は racecard.features で事前に計算した指標の表で、
+騎手・調教師・父の成績は racecard.entities のキャッシュから作る成績表で渡す）
+"""
+
+from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+
+from racecard.entities import EntityCache
+from racecard.features import format_features
+from racecard.models import Race
+from racecard.serializer import format_race_card, format_race_header, format_entry_table, format_past_runs
+
+
+@dataclass(slots=True)
+class RaceView:
+    """出馬表から取り出す列の定義"""
+    entry_columns: List[str]  # 出走馬一覧の列
+    past_run_fields: List[str] = field(default_factory=list)  # 近走の項目（空なら近走を含めない）
+    features: bool = False  # 近走から計算した指標の表を含める
+    entities: bool = False  # 騎手・調教師・父の成績表を含める（成績キャッシュがある場合）
+    entity_past_run_fields: Optional[List[str]] = None  # 成績表を含める場合の近走の項目（Noneなら past_run_fields）
+
+    def render(self, race: Race, entity_cache: Optional[EntityCache] = None) -> str:
+        """ビューに含まれる列だけで出馬表をテキスト化"""
+
+        sections = [format_race_header(race), format_entry_table(race, self.entry_columns)]
+        if self.features:
+            sections.append(format_features(race))
+        past_run_fields = self.past_run_fields
+        if self.entities and entity_cache is not None:
+            sections.append(entity_cache.format_profiles(race))
+            if self.entity_past_run_fields is not None:
+                past_run_fields = self.entity_past_run_fields
+        if past_run_fields:
+            sections.append(format_past_runs(race, past_run_fields))
+        return "\n\n".join(sections)
+
+
+# 展開予想専門家：脚質・前行指数・末脚と枠順が中心（近走の通過順・上がりは指標に集約し、生の近走は含めない）
+PACE_VIEW = RaceView(
+    entry_columns=["馬番", "枠", "馬名", "斤量", "単勝", "人気"],
+    features=True,
+)
+
+# 騎手専門家：騎手・乗り替わり・厩舎が中心（血統は不要、近走は乗り替わりの確認用で、成績表があれば不要）
+JOCKEY_VIEW = RaceView(
+    entry_columns=["馬番", "馬名", "性齢", "斤量", "騎手", "調教師", "単勝", "人気"],
+    past_run_fields=["日付場", "着順/頭数", "人気", "騎手"],
+    features=True,
+    entities=True,
+    entity_past_run_fields=[],
+)
+
+# 穴狙い専門家：オッズ・人気と、人気以上に走れる材料（前走の敗因・条件替わり・血統）
+CONTRARIAN_VIEW = RaceView(
+    entry_columns=["馬番", "馬名", "性齢", "騎手", "単勝", "人気", "馬体重", "父", "母父"],
+    past_run_fields=["日付場", "着順/頭数", "人気", "距離馬場"],
+    features=True,
+    entities=True,
+    entity_past_run_fields=["着順/頭数", "人気"],  # 条件替わりは指標の適性、血統は父の成績で見る
+)
+
+# 総合判断専門家：専門家の意見を統合するため、近走は含めずオッズ中心
+MODERATOR_VIEW = RaceView(
+    entry_columns=["馬番", "馬名", "単勝", "人気"],
+)
+
+EXPERT_VIEWS: Dict[str, RaceView] = {
+    "pace_expert": PACE_VIEW,
+    "jockey_expert": JOCKEY_VIEW,
+    "contrarian_expert": CONTRARIAN_VIEW,
+    "moderator": MODERATOR_VIEW,
+}
+
+
+def render_view(race: Race, role: str, views: Optional[Dict[str, RaceView]] = None,
+                entity_cache: Optional[EntityCache] = None) -> str:
+    """役割に対応するビューで出馬表をテキスト化（未定義の役割は全列）"""
+
+    view = (views or EXPERT_VIEWS).get(role)
+    if view is None:
+        return format_race_card(race)
+    return view.render(race, entity_cache)
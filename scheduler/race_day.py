@@ -0,0 +1,268 @@
+"""
+開催日のスケジューラー
+1日分の出馬表を発走時刻順に並べ、専門家の分析を早めに済ませておき、発走が近づいたらオッズだけで総合判断をやり直し、
+発走の指定分前に最終予想を出す（同時に予想できるレース数が足りない場合は締切の近いレースを優先する）
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import argparse
+import glob
+import heapq
+import itertools
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtest.store import ResultsStore
+from graph.incremental import IncrementalPredictor, REJUDGE_MODERATOR, REJUDGE_LOCAL
+from graph.prediction_graph import HorseRacePredictionGraph, print_judgment
+from racecard.diff import race_label
+from racecard.parser import parse_race_card, post_datetime
+
+
+# 予想の段階（同じレースではこの順に1つずつ実行する）
+STAGE_ANALYZE = "analyze"  # 専門家の分析を含むフル予想
+STAGE_REFRESH = "refresh"  # オッズ更新による総合判断のやり直し
+STAGE_FINAL = "final"  # 最新のオッズで判断し直して最終予想を確定
+
+
+@dataclass
+class ScheduleConfig:
+    """段階ごとの実行時刻（発走の何分前か）と同時実行数"""
+    analysis_lead: float = 90.0  # 専門家の分析を始める発走前の分数（これより前には実行しない）
+    refresh_leads: Tuple[float, ...] = (30.0, 15.0)  # オッズで総合判断をやり直す発走前の分数
+    final_lead: float = 5.0  # 最終予想を出す発走前の分数
+    max_workers: int = 4  # 同時に予想するレース数
+
+    def __post_init__(self):
+        if self.max_workers < 1:
+            raise ValueError("max_workers は1以上を指定してください")
+        if any(lead <= self.final_lead for lead in self.refresh_leads):
+            raise ValueError("refresh_leads は final_lead より前（大きい分数）を指定してください")
+
+
+@dataclass
+class ScheduledRace:
+    """スケジュール対象のレース"""
+    race_id: str  # 表示用の識別子
+    post_time: datetime  # 発走日時
+    source: Callable[[], str]  # 最新のレース情報を返す（オッズ更新のたびに読み直す）
+
+
+@dataclass
+class StageRun:
+    """段階の実行記録"""
+    race_id: str
+    stage: str
+    scheduled_at: datetime  # 実行予定時刻
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    update: Optional[str] = None  # 実行内容（full / odds / unchanged）
+    skipped: Optional[str] = None  # 実行しなかった理由
+    error: Optional[str] = None
+
+
+@dataclass
+class _Task:
+    race: ScheduledRace
+    stage: str
+    ready_at: datetime  # この時刻以降に実行する
+    deadline: datetime  # この時刻を過ぎたら意味がない（次の段階の時刻または発走時刻）
+    remaining: List[Tuple[str, datetime, datetime]] = field(default_factory=list)  # 後続の段階
+
+
+class SystemClock:
+    """実時間の時計"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def real_seconds(self, seconds: float) -> float:
+        """この時計での秒数を実時間の秒数に換算"""
+        return seconds
+
+
+class SimulatedClock:
+    """指定した時刻から speed 倍の速さで進む時計（過去の開催日での予行演習用）"""
+
+    def __init__(self, start: datetime, speed: float = 1.0):
+        if speed <= 0:
+            raise ValueError("speed は正の値を指定してください")
+        self.start = start
+        self.speed = speed
+        self._started = time.monotonic()
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=(time.monotonic() - self._started) * self.speed)
+
+    def real_seconds(self, seconds: float) -> float:
+        return seconds / self.speed
+
+
+def load_race_day(paths: List[str]) -> List[ScheduledRace]:
+    """出馬表ファイルを読み込み、発走時刻順に並べる（ファイルは段階ごとに読み直す）"""
+
+    races = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            race = parse_race_card(f.read())
+
+        def source(path: str = path) -> str:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+
+        races.append(ScheduledRace(race_id=race_label(race), post_time=post_datetime(race), source=source))
+    return sorted(races, key=lambda race: race.post_time)
+
+
+class RaceDayScheduler:
+    """発走時刻に合わせて各レースの段階（分析 -> オッズ再判断 -> 最終予想）を実行する
+
+    同時に実行できるレースは max_workers まで。実行可能な段階が多い場合は締切（次の段階の時刻、
+    最終予想は発走時刻）の近いものから実行する。締切を過ぎたオッズ再判断は次の段階に任せて省き、
+    分析が最終予想の時刻までに始まらなかったレースは最終予想でまとめて予想する
+    """
+
+    def __init__(self, graph: HorseRacePredictionGraph, config: Optional[ScheduleConfig] = None,
+                 odds_rejudge: str = REJUDGE_MODERATOR, clock: Optional[Any] = None,
+                 on_result: Optional[Callable[[str, ScheduledRace, Dict[str, Any]], None]] = None):
+        self.config = config or ScheduleConfig()
+        self.predictor = IncrementalPredictor(graph, odds_rejudge)
+        self.clock = clock or SystemClock()
+        self.on_result = on_result  # 段階が終わるたびに (段階, レース, 予想結果) で呼ぶ
+        self.history: List[StageRun] = []  # 段階の実行記録
+        self._order = itertools.count()
+
+    def _stages(self, race: ScheduledRace) -> List[Tuple[str, datetime, datetime]]:
+        """レースの段階 (段階, 実行予定時刻, 締切) の一覧"""
+
+        config = self.config
+        final_at = race.post_time - timedelta(minutes=config.final_lead)
+        refresh_times = [race.post_time - timedelta(minutes=lead) for lead in sorted(config.refresh_leads, reverse=True)]
+        stages = [(STAGE_ANALYZE, race.post_time - timedelta(minutes=config.analysis_lead), final_at)]
+        for i, refresh_at in enumerate(refresh_times):
+            next_at = refresh_times[i + 1] if i + 1 < len(refresh_times) else final_at
+            stages.append((STAGE_REFRESH, refresh_at, next_at))
+        stages.append((STAGE_FINAL, final_at, race.post_time))
+        return stages
+
+    @staticmethod
+    def _task(race: ScheduledRace, stages: List[Tuple[str, datetime, datetime]]) -> _Task:
+        stage, ready_at, deadline = stages[0]
+        return _Task(race=race, stage=stage, ready_at=ready_at, deadline=deadline, remaining=stages[1:])
+
+    def _run_stage(self, task: _Task, run: StageRun) -> Dict[str, Any]:
+        run.started_at = self.clock.now()
+        result = self.predictor.refresh(task.race.source())
+        run.finished_at = self.clock.now()
+        run.update = result.get("update")
+        return result
+
+    def run(self, races: List[ScheduledRace]) -> Dict[str, Dict[str, Any]]:
+        """全レースの最終予想が出るまで実行し、レースの識別子 -> 最終予想の結果を返す"""
+
+        pending: List[Tuple[datetime, int, _Task]] = []  # 実行予定時刻順
+        ready: List[Tuple[datetime, int, _Task]] = []  # 締切順
+        for race in races:
+            task = self._task(race, self._stages(race))
+            heapq.heappush(pending, (task.ready_at, next(self._order), task))
+
+        finals: Dict[str, Dict[str, Any]] = {}
+        running: Dict[Future, Tuple[_Task, StageRun]] = {}
+
+        def advance(task: _Task) -> None:
+            """同じレースの次の段階を予定に入れる"""
+            if task.remaining:
+                following = self._task(task.race, task.remaining)
+                heapq.heappush(pending, (following.ready_at, next(self._order), following))
+
+        with ThreadPoolExecutor(max_workers=self.config.max_workers) as executor:
+            while pending or ready or running:
+                now = self.clock.now()
+                while pending and pending[0][0] <= now:
+                    _, order, task = heapq.heappop(pending)
+                    heapq.heappush(ready, (task.deadline, order, task))
+
+                while ready and len(running) < self.config.max_workers:
+                    _, _, task = heapq.heappop(ready)
+                    run = StageRun(race_id=task.race.race_id, stage=task.stage, scheduled_at=task.ready_at)
+                    self.history.append(run)
+                    if now >= task.deadline:
+                        # 締切を過ぎた段階は省く（分析とオッズ再判断は最終予想がまとめて行う）
+                        run.skipped = "発走済み" if task.stage == STAGE_FINAL else "締切超過"
+                        advance(task)
+                        continue
+                    running[executor.submit(self._run_stage, task, run)] = (task, run)
+
+                timeout = None
+                if pending and len(running) < self.config.max_workers:
+                    timeout = self.clock.real_seconds(max(0.0, (pending[0][0] - self.clock.now()).total_seconds()))
+                if not running:
+                    if timeout is not None:
+                        time.sleep(timeout)
+                    continue
+
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, run = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        run.finished_at = self.clock.now()
+                        run.error = f"{type(e).__name__}: {e}"
+                    else:
+                        if task.stage == STAGE_FINAL:
+                            finals[task.race.race_id] = result
+                        if self.on_result is not None:
+                            self.on_result(task.stage, task.race, result)
+                    advance(task)
+        return finals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="開催日のスケジューラー（発走時刻に合わせて予想）")
+    parser.add_argument("cards", nargs="+", help="出馬表ファイル（ワイルドカード可、1ファイル1レース）")
+    parser.add_argument("--analysis-minutes", type=float, default=90.0, help="専門家の分析を始める発走前の分数")
+    parser.add_argument("--refresh-minutes", type=float, nargs="*", default=[30.0, 15.0],
+                        help="オッズで総合判断をやり直す発走前の分数")
+    parser.add_argument("--final-minutes", type=float, default=5.0, help="最終予想を出す発走前の分数")
+    parser.add_argument("--workers", type=int, default=4, help="同時に予想するレース数")
+    parser.add_argument("--odds-rejudge", choices=[REJUDGE_MODERATOR, REJUDGE_LOCAL], default=REJUDGE_MODERATOR,
+                        help="オッズ更新時の再判断（moderator: 総合判断専門家を再実行 / local: 期待値だけ再計算）")
+    parser.add_argument("--start", help="予行演習の開始時刻（例: 2025-06-22 09:00、指定時は --speed 倍速の時計で動く）")
+    parser.add_argument("--speed", type=float, default=1.0, help="予行演習の時計の速さ")
+    parser.add_argument("--store", help="予想を保存するストア（バックテスト用のSQLiteファイル）")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.cards for path in glob.glob(pattern)})
+    races = load_race_day(paths)
+    clock = SimulatedClock(datetime.fromisoformat(args.start), args.speed) if args.start else SystemClock()
+    config = ScheduleConfig(
+        analysis_lead=args.analysis_minutes,
+        refresh_leads=tuple(args.refresh_minutes),
+        final_lead=args.final_minutes,
+        max_workers=args.workers,
+    )
+
+    def show(stage: str, race: ScheduledRace, result: Dict[str, Any]) -> None:
+        now = clock.now().strftime("%H:%M:%S")
+        print(f"[{now}] {race.race_id}（発走 {race.post_time:%H:%M}） {stage}: {result.get('update')}")
+        if stage == STAGE_FINAL:
+            print_judgment(result["final_judgment"])
+
+    graph = HorseRacePredictionGraph(results_store=ResultsStore(args.store) if args.store else None)
+    scheduler = RaceDayScheduler(graph, config, args.odds_rejudge, clock, show)
+    print(f"=== {len(races)}レースをスケジュール ===")
+    scheduler.run(races)
+    for run in scheduler.history:
+        if run.skipped or run.error:
+            print(f"{run.race_id} {run.stage}: {run.skipped or run.error}")
+
+
+if __name__ == "__main__":
+    main()
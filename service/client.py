@@ -0,0 +1,150 @@
+"""
+予想サービスのクライアント
+出馬表を常駐の予想サービスへ送り、結果を表示またはJSONLに書き出す
+（起動を速くするため、標準ライブラリ以外はレースの読み込み直前まで読み込まない）
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """Unixソケット経由のHTTP接続"""
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ServiceClient:
+    """予想サービスへの依頼"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: Optional[str] = None,
+                 timeout: float = 600.0, retries: int = 5):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.retries = retries  # 混雑（503）で断られたときに送り直す回数
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, Dict[str, Any], Optional[str]]:
+        connection = self._connection()
+        try:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read().decode("utf-8")), response.getheader("Retry-After")
+        finally:
+            connection.close()
+
+    def get(self, path: str) -> Dict[str, Any]:
+        status, payload, _ = self._request("GET", path)
+        if status != 200:
+            raise RuntimeError(f"{status}: {payload.get('error')}")
+        return payload
+
+    def predict(self, races: List[str]) -> List[Dict[str, Any]]:
+        """レース情報を送って予想結果を受け取る（混雑で断られたら Retry-After 秒待って送り直す）"""
+
+        for attempt in range(self.retries + 1):
+            status, payload, retry_after = self._request("POST", "/predict", {"races": races})
+            if status == 200:
+                return payload["results"]
+            if status != 503 or attempt == self.retries:
+                raise RuntimeError(f"{status}: {payload.get('error')}")
+            time.sleep(float(retry_after or 1))
+        return []
+
+
+def summary(source: str, result: Dict[str, Any]) -> str:
+    """1レースの結果の要約（graph.prediction_graph の複数レース時の表示と同じ形）"""
+
+    if "error" in result:
+        return f"{source}: 予想に失敗しました（{result['error']}）"
+    judgment = result.get("final_judgment") or {}
+    picks = [rec["horse_number"] for rec in judgment.get("recommendations", [])]
+    outcome = "見送り（絞り込み）" if not result.get("screening", {}).get("passed", True) else f"推奨馬 {picks}"
+    return f"{source}: {result.get('race_id') or '（出馬表を解析できません）'} {outcome}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="予想サービスのクライアント")
+    parser.add_argument("--input", nargs="+",
+                        default=[os.path.join(os.path.dirname(__file__), "../data/race.txt")],
+                        help="レース情報（ファイル・ディレクトリ・globパターン、1ファイルに複数レースを連結可）")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="予想サービスのアドレス")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="予想サービスのポート")
+    parser.add_argument("--socket", help="TCPの代わりに接続するUnixソケットのパス")
+    parser.add_argument("--output", help="結果を1レース1行で書き出すJSONLファイル")
+    parser.add_argument("--chunk", type=int, default=8, help="1回の依頼で送るレース数")
+    parser.add_argument("--timeout", type=float, default=600.0, help="1回の依頼の待ち時間の上限（秒）")
+    parser.add_argument("--retries", type=int, default=5, help="混雑で断られたときに送り直す回数")
+    parser.add_argument("--health", action="store_true", help="予想サービスが動いているか確認する")
+    parser.add_argument("--stats", action="store_true", help="予想サービスのキュー・バッチの状況を表示する")
+    args = parser.parse_args()
+
+    client = ServiceClient(args.host, args.port, args.socket, args.timeout, args.retries)
+    try:
+        if args.health or args.stats:
+            print(json.dumps(client.get("/health" if args.health else "/stats"), ensure_ascii=False, indent=2))
+            return
+
+        # 出馬表の分割はサーバーと同じ処理を使う（ここで初めてプロジェクトのモジュールを読み込む）
+        from racecard.loader import expand_inputs, iter_races
+
+        try:
+            races = iter_races(list(expand_inputs(args.input)))
+        except FileNotFoundError as e:
+            print(f"エラー: {e}")
+            return
+
+        output = open(args.output, "w", encoding="utf-8") if args.output else None
+        count = 0
+        try:
+            while True:
+                chunk = [race for _, race in zip(range(max(1, args.chunk)), races)]
+                if not chunk:
+                    break
+                results = client.predict([race.text for race in chunk])
+                for race, result in zip(chunk, results):
+                    if output is not None:
+                        output.write(json.dumps({"source": race.source, **result}, ensure_ascii=False) + "\n")
+                        output.flush()
+                    print(summary(race.source, result))
+                count += len(chunk)
+        finally:
+            if output is not None:
+                output.close()
+        if count == 0:
+            print(f"エラー: {' '.join(args.input)} にレース情報がありません")
+        else:
+            print(f"\n{count}レースを予想しました" + (f"（{args.output}）" if args.output else ""))
+    except (OSError, RuntimeError) as e:
+        print(f"エラー: 予想サービスに依頼できません（{e}）")
+
+
+if __name__ == "__main__":
+    main()
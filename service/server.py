@@ -0,0 +1,350 @@
+"""
+常駐の予想サービス
+グラフのコンパイル・クライアントのコネクションプール・キャッシュを保持したまま、HTTP（TCPまたはUnixソケット）で出馬表を受け付ける
+受け付けたレースは上限付きのキューに入れ、少しずつまとめて（同じ出馬表は1回だけ）並行予想し、結果をJSONで返す
+キューがいっぱいのときは 503（Retry-After付き）を返して送り手に待ってもらう
+
+エンドポイント:
+  POST /predict  {"races": ["出馬表", ...]}（text/plain なら連結した出馬表）-> {"results": [...]}
+  GET  /health   -> {"status": "ok"}
+  GET  /stats    -> キュー・バッチの状況
+"""
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.client_pool import pooled_async_client
+from graph.prediction_graph import HorseRacePredictionGraph, add_system_arguments, build_system
+from racecard.loader import split_races
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# HTTPのステータス
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+@dataclass
+class ServiceConfig:
+    """キューとバッチの設定"""
+    queue_size: int = 64  # 受け付けて待たせるレース数の上限（空きが足りない依頼は 503、上限を超えるレース数の依頼は 413 で断る）
+    batch_size: int = 8  # 1回にまとめて予想するレース数の上限
+    batch_window: float = 0.05  # 最初のレースが届いてから、まとめるために待つ秒数
+    max_batches: int = 2  # 同時に実行するバッチ数（実行中のバッチがいっぱいならキューで待つ）
+    max_concurrency: int = 8  # 全バッチ共通のLLM同時呼び出し数
+    max_body: int = 4 * 1024 * 1024  # 依頼の本文の上限（バイト）
+    retry_after: int = 5  # 503 のときに送り手に待ってもらう秒数
+
+    def __post_init__(self):
+        if min(self.queue_size, self.batch_size, self.max_batches, self.max_concurrency) < 1:
+            raise ValueError("queue_size / batch_size / max_batches / max_concurrency は1以上を指定してください")
+
+
+class QueueFull(Exception):
+    """キューに空きがない"""
+
+
+class TooManyRaces(Exception):
+    """1回の依頼のレース数がキューの上限を超えている（待っても受け付けられない）"""
+
+
+class ServiceStopped(Exception):
+    """サービスの停止で予想を中断した"""
+
+
+class PredictionService:
+    """予想のキューとバッチ実行"""
+
+    def __init__(self, graph: HorseRacePredictionGraph, config: Optional[ServiceConfig] = None):
+        self.graph = graph
+        self.config = config or ServiceConfig()
+        self.started_at = time.time()
+        self.counts = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0, "batches": 0, "deduplicated": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._running = 0  # 実行中のバッチ数
+        self._batches: Set[asyncio.Task] = set()  # 実行中のバッチ
+        self._pending: Set[asyncio.Future] = set()  # キューから取り出して結果を待っているレース
+
+    async def start(self) -> None:
+        """キューと振り分けを開始（イベントループの中で呼ぶ）"""
+
+        self._queue = asyncio.Queue(self.config.queue_size)
+        self._semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        self._slots = asyncio.Semaphore(self.config.max_batches)
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self) -> None:
+        """振り分けと実行中のバッチを止め、結果を待っている依頼を ServiceStopped で終わらせる"""
+
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        for task in list(self._batches):
+            task.cancel()
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            self._pending.add(future)
+        for future in self._pending:
+            if not future.done():
+                future.set_exception(ServiceStopped("予想サービスを停止しました"))
+        self._pending.clear()
+
+    async def submit(self, races: List[str]) -> List[Dict[str, Any]]:
+        """レースをキューに入れて結果を待つ
+
+        キューの上限を超えるレース数は TooManyRaces、空きが足りなければ1件も入れずに QueueFull
+        """
+
+        queue = self._queue
+        if len(races) > queue.maxsize:
+            self.counts["rejected"] += len(races)
+            raise TooManyRaces(f"1回の依頼は{queue.maxsize}レースまでです（{len(races)}レース）")
+        if queue.maxsize - queue.qsize() < len(races):
+            self.counts["rejected"] += len(races)
+            raise QueueFull()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for race_info in races:
+            future = loop.create_future()
+            queue.put_nowait((race_info, future))
+            futures.append(future)
+        self.counts["accepted"] += len(races)
+        return await asyncio.gather(*futures)
+
+    async def _next_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """最初のレースが届いてから batch_window 秒の間に届いたレースを batch_size 件までまとめる"""
+
+        batch = [await self._queue.get()]
+        self._pending.add(batch[0][1])
+        deadline = asyncio.get_running_loop().time() + self.config.batch_window
+        while len(batch) < self.config.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                self._pending.add(batch[-1][1])
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch(self) -> None:
+        """キューからバッチを作り、実行中のバッチに空きができ次第実行する"""
+
+        while True:
+            await self._slots.acquire()
+            batch = await self._next_batch()
+            self._running += 1
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task) -> None:
+        self._batches.discard(task)
+        self._running -= 1
+        self._slots.release()
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """バッチ内のレースを並行予想（同じ出馬表は1回だけ予想して結果を共有）"""
+
+        self.counts["batches"] += 1
+        waiting: Dict[str, List[asyncio.Future]] = {}
+        for race_info, future in batch:
+            waiting.setdefault(race_info, []).append(future)
+        self.counts["deduplicated"] += len(batch) - len(waiting)
+
+        outcomes = await asyncio.gather(
+            *[self.graph.apredict_race(race_info, self._semaphore) for race_info in waiting],
+            return_exceptions=True
+        )
+        for (race_info, futures), outcome in zip(waiting.items(), outcomes):
+            if isinstance(outcome, Exception):
+                self.counts["failed"] += len(futures)
+                result = {"error": f"{type(outcome).__name__}: {outcome}"}
+            else:
+                self.counts["completed"] += len(futures)
+                result = {"race_id": outcome["metrics"]["race_id"]}
+                result.update({key: value for key, value in outcome.items() if key != "race_info"})
+            for future in futures:
+                self._pending.discard(future)
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """キュー・バッチの状況"""
+
+        return {
+            **self.counts,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running_batches": self._running,
+            "uptime": round(time.time() - self.started_at, 1),
+        }
+
+
+async def _read_request(reader: asyncio.StreamReader, max_body: int) -> Tuple[str, str, Dict[str, str], bytes]:
+    """HTTPリクエスト（メソッド・パス・ヘッダー・本文）を読む"""
+
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    method, path, _ = request_line.split(" ", 2)
+    headers: Dict[str, str] = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > max_body:
+        raise ValueError("本文が大きすぎます")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _parse_races(headers: Dict[str, str], body: bytes) -> List[str]:
+    """依頼の本文からレース情報を取り出す（JSONの races / race、またはテキストの連結した出馬表）"""
+
+    if headers.get("content-type", "").startswith("application/json"):
+        payload = json.loads(body.decode("utf-8"))
+        if not isinstance(payload, dict):
+            raise ValueError("本文は races（または race）を持つJSONオブジェクトで指定してください")
+        races = payload.get("races", [payload["race"]] if "race" in payload else [])
+        if not isinstance(races, list) or not all(isinstance(race, str) for race in races):
+            raise ValueError("races はレース情報の文字列のリストで指定してください")
+        return races
+    return list(split_races(body.decode("utf-8").splitlines()))
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any],
+                          extra_headers: Optional[Dict[str, str]] = None) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json; charset=utf-8",
+        "Content-Length": str(len(body)),
+        "Connection": "close",
+        **(extra_headers or {}),
+    }
+    head = f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+    await writer.drain()
+
+
+async def handle_connection(service: PredictionService, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+    """1接続1リクエストを処理"""
+
+    try:
+        try:
+            method, path, headers, body = await _read_request(reader, service.config.max_body)
+        except ValueError as e:
+            await _write_response(writer, 413 if "大きすぎ" in str(e) else 400, {"error": str(e)})
+            return
+
+        if path == "/health":
+            await _write_response(writer, 200, {"status": "ok"})
+        elif path == "/stats":
+            await _write_response(writer, 200, service.stats())
+        elif path != "/predict":
+            await _write_response(writer, 404, {"error": f"{path} はありません"})
+        elif method != "POST":
+            await _write_response(writer, 405, {"error": "POST で送ってください"})
+        else:
+            try:
+                races = _parse_races(headers, body)
+            except (ValueError, KeyError) as e:
+                await _write_response(writer, 400, {"error": f"依頼を読み取れません: {e}"})
+                return
+            if not races:
+                await _write_response(writer, 400, {"error": "レース情報がありません"})
+                return
+            try:
+                results = await service.submit(races)
+            except TooManyRaces as e:
+                await _write_response(writer, 413, {"error": str(e)})
+                return
+            except ServiceStopped as e:
+                await _write_response(writer, 503, {"error": str(e)})
+                return
+            except QueueFull:
+                await _write_response(writer, 503, {"error": "混雑しています。しばらくしてから送り直してください"},
+                                      {"Retry-After": str(service.config.retry_after)})
+                return
+            await _write_response(writer, 200, {"results": results})
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # 送り手が切断した
+    finally:
+        writer.close()
+
+
+async def serve(graph: HorseRacePredictionGraph, config: ServiceConfig, host: str = DEFAULT_HOST,
+                port: int = DEFAULT_PORT, socket_path: Optional[str] = None) -> None:
+    """サービスを起動して停止されるまで受け付ける"""
+
+    service = PredictionService(graph, config)
+    await service.start()
+    # プロセス共通の非同期クライアントを先に作り、最初の依頼でコネクションプールの初期化を待たせない
+    pooled_async_client()
+
+    def handler(reader, writer):
+        return handle_connection(service, reader, writer)
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # 前回の起動で残ったソケット
+        server = await asyncio.start_unix_server(handler, path=socket_path)
+        address = socket_path
+    else:
+        server = await asyncio.start_server(handler, host, port)
+        address = f"http://{host}:{port}"
+    print(f"予想サービスを起動しました: {address}（専門家: {', '.join(graph.expert_keys)}）", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常駐の予想サービス")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="待ち受けるポート")
+    parser.add_argument("--socket", help="TCPの代わりに待ち受けるUnixソケットのパス")
+    parser.add_argument("--queue-size", type=int, default=ServiceConfig.queue_size, help="待たせるレース数の上限")
+    parser.add_argument("--batch-size", type=int, default=ServiceConfig.batch_size, help="まとめて予想するレース数の上限")
+    parser.add_argument("--batch-window", type=float, default=ServiceConfig.batch_window,
+                        help="レースをまとめるために待つ秒数")
+    parser.add_argument("--concurrency", type=int, default=ServiceConfig.max_concurrency, help="LLM同時呼び出し数")
+    add_system_arguments(parser)
+    args = parser.parse_args()
+
+    config = ServiceConfig(
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        batch_window=args.batch_window,
+        max_concurrency=args.concurrency,
+    )
+    try:
+        asyncio.run(serve(build_system(args), config, args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        print("\n予想サービスを停止しました")
+
+
+if __name__ == "__main__":
+    main()